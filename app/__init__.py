@@ -24,8 +24,67 @@ def create_app():
         VERTEX_AI_LOCATION=os.getenv('VERTEX_AI_LOCATION', 'us-central1'),
         FEATURE_STORE_ID=os.getenv('FEATURE_STORE_ID', 'products_online_feature_store'),
         ENTITY_TYPE_ID=os.getenv('ENTITY_TYPE_ID', 'products_feature_view'),
+        VECTOR_INDEX_BACKEND=os.getenv('VECTOR_INDEX_BACKEND', 'feature_store'),
+        VECTOR_INDEX_PATH=os.getenv('VECTOR_INDEX_PATH', ''),
+        IVF_NLIST=int(os.getenv('IVF_NLIST', '0')),
+        IVF_NPROBE=int(os.getenv('IVF_NPROBE', '8')),
+        MMAP_RERANK=int(os.getenv('MMAP_RERANK', '4')),
+        REDUCED_PROJECTION_PATH=os.getenv('REDUCED_PROJECTION_PATH', ''),
+        REDUCED_CANDIDATES=int(os.getenv('REDUCED_CANDIDATES', '300')),
+        RECALL_SAMPLE_RATE=float(os.getenv('RECALL_SAMPLE_RATE', '0')),
         BIGQUERY_DATASET=os.getenv('BIGQUERY_DATASET', 'raves_us'),
-        GEMINI_API_KEY=os.getenv('GEMINI_API_KEY')
+        BIGQUERY_VECTOR_SEARCH=os.getenv('BIGQUERY_VECTOR_SEARCH', 'dot'),
+        BIGQUERY_EMBEDDINGS_TABLE=os.getenv('BIGQUERY_EMBEDDINGS_TABLE', 'product_embeddings_normalized'),
+        GEMINI_API_KEY=os.getenv('GEMINI_API_KEY'),
+        FEATURE_STORE_ENDPOINT_TTL=float(os.getenv('FEATURE_STORE_ENDPOINT_TTL', '600')),
+        EMBEDDING_CACHE_SIZE=int(os.getenv('EMBEDDING_CACHE_SIZE', '10000')),
+        EMBEDDING_CACHE_TTL=float(os.getenv('EMBEDDING_CACHE_TTL', '86400')),
+        EMBEDDING_CACHE_MAX_BYTES=int(os.getenv('EMBEDDING_CACHE_MAX_BYTES', str(64 * 1024 * 1024))),
+        EMBEDDING_CACHE_PATH=os.getenv('EMBEDDING_CACHE_PATH', ''),
+        EMBEDDING_CACHE_DISK_MAX_ROWS=int(os.getenv('EMBEDDING_CACHE_DISK_MAX_ROWS', '100000')),
+        CATALOG_SOURCE=os.getenv('CATALOG_SOURCE', 'bigquery'),
+        CATALOG_UPDATED_COLUMN=os.getenv('CATALOG_UPDATED_COLUMN', ''),
+        CATALOG_REFRESH_INTERVAL=float(os.getenv('CATALOG_REFRESH_INTERVAL', '300')),
+        FILTER_ATTRIBUTES=os.getenv('FILTER_ATTRIBUTES', 'apparel_type,gender,color'),
+        FILTER_MIN_CANDIDATES=int(os.getenv('FILTER_MIN_CANDIDATES', '0')),
+        SIGNED_URL_EXPIRATION=int(os.getenv('SIGNED_URL_EXPIRATION', '3600')),
+        SIGNED_URL_REFRESH_MARGIN=int(os.getenv('SIGNED_URL_REFRESH_MARGIN', '300')),
+        THUMB_URI_TEMPLATE=os.getenv('THUMB_URI_TEMPLATE', ''),
+        THUMB_SOURCE=os.getenv('THUMB_SOURCE', 'gcs'),
+        THUMB_CACHE_DIR=os.getenv('THUMB_CACHE_DIR', 'thumb_cache'),
+        THUMB_CACHE_MAX_BYTES=int(os.getenv('THUMB_CACHE_MAX_BYTES', str(256 * 1024 * 1024))),
+        THUMB_SIZES=os.getenv('THUMB_SIZES', 'small:160,medium:320,large:640'),
+        THUMB_RESULT_SIZE=os.getenv('THUMB_RESULT_SIZE', 'medium'),
+        THUMB_QUALITY=int(os.getenv('THUMB_QUALITY', '80')),
+        THUMB_MAX_AGE=int(os.getenv('THUMB_MAX_AGE', '86400')),
+        SEARCH_RESULT_CACHE_TTL=float(os.getenv('SEARCH_RESULT_CACHE_TTL', '30')),
+        SEARCH_RESULT_CACHE_SIZE=int(os.getenv('SEARCH_RESULT_CACHE_SIZE', '1000')),
+        SEARCH_CANDIDATES=int(os.getenv('SEARCH_CANDIDATES', '100')),
+        SEARCH_CURSOR_TTL=float(os.getenv('SEARCH_CURSOR_TTL', '600')),
+        SEARCH_CURSOR_MAX=int(os.getenv('SEARCH_CURSOR_MAX', '1000')),
+        REQUEST_DEADLINE=float(os.getenv('REQUEST_DEADLINE', '15')),
+        UPSTREAM_TIMEOUTS=os.getenv('UPSTREAM_TIMEOUTS', 'embedding:3,knn:2,bigquery:5,gemini:8'),
+        UPSTREAM_MAX_WORKERS=int(os.getenv('UPSTREAM_MAX_WORKERS', '32')),
+        HEDGE_UPSTREAMS=os.getenv('HEDGE_UPSTREAMS', 'embedding,knn'),
+        HEDGE_PERCENTILE=float(os.getenv('HEDGE_PERCENTILE', '95')),
+        BREAKER_FAILURES=int(os.getenv('BREAKER_FAILURES', '5')),
+        BREAKER_RESET_TIMEOUT=float(os.getenv('BREAKER_RESET_TIMEOUT', '30')),
+        SEARCH_BATCH_MAX=int(os.getenv('SEARCH_BATCH_MAX', '256')),
+        WEBCAM_SESSION_MAX=int(os.getenv('WEBCAM_SESSION_MAX', '1000')),
+        WEBCAM_SESSION_TTL=float(os.getenv('WEBCAM_SESSION_TTL', '300')),
+        WEBCAM_PHASH_THRESHOLD=int(os.getenv('WEBCAM_PHASH_THRESHOLD', '6')),
+        STAGE_MAX_WORKERS=int(os.getenv('STAGE_MAX_WORKERS', '16')),
+        STAGE_TIMEOUT=float(os.getenv('STAGE_TIMEOUT', '10')),
+        MAX_CONTENT_LENGTH=int(os.getenv('MAX_UPLOAD_BYTES', str(10 * 1024 * 1024))),
+        MAX_IMAGE_PIXELS=int(os.getenv('MAX_IMAGE_PIXELS', str(40 * 1000 * 1000))),
+        MAX_NEIGHBOR_COUNT=int(os.getenv('MAX_NEIGHBOR_COUNT', '1000')),
+        GEMINI_CACHE_TTL=float(os.getenv('GEMINI_CACHE_TTL', '86400')),
+        GEMINI_CACHE_SIZE=int(os.getenv('GEMINI_CACHE_SIZE', '10000')),
+        GEMINI_BATCH_SIZE=int(os.getenv('GEMINI_BATCH_SIZE', '8')),
+        ANALYZE_BATCH_MAX=int(os.getenv('ANALYZE_BATCH_MAX', '32')),
+        SERVING_MODE=os.getenv('SERVING_MODE', 'sync'),
+        HTTP_POOL_SIZE=int(os.getenv('HTTP_POOL_SIZE', '32')),
+        WARMUP_ON_START=os.getenv('WARMUP_ON_START', 'false').lower() == 'true'
     )
 
     # Validate required configuration
@@ -33,6 +92,24 @@ def create_app():
         app.logger.error('GEMINI_API_KEY not found in environment variables')
         raise ValueError('GEMINI_API_KEY is required. Please set it in your .env file.')
     
+    # Cooperative I/O has to be in place before any client is built
+    from .serving import init_serving_mode
+    app.config['SERVING_MODE'] = init_serving_mode(app.config)
+
+    # Share SDK clients and models across requests in this worker
+    from .services.registry import ServiceRegistry
+    registry = ServiceRegistry(app.config)
+    app.extensions['service_registry'] = registry
+    if app.config['WARMUP_ON_START']:
+        try:
+            registry.warm_up()
+        except Exception as e:
+            app.logger.error(f'Service warm-up failed: {str(e)}')
+
+    # Command line tools (flask --app run ingest ...)
+    from .cli import register_commands
+    register_commands(app)
+
     # Register blueprints
     from .api.routes import bp as api_bp
     app.register_blueprint(api_bp, url_prefix='/api')
@@ -1,213 +1,545 @@
-from flask import Blueprint, jsonify, request, current_app
+from flask import Blueprint, Response, g, jsonify, request, current_app, send_file, stream_with_context, url_for
+from werkzeug.exceptions import RequestEntityTooLarge
 from ..services.gemini_service import GeminiService
 from ..services.vertex_ai_service import VertexAIService
 from ..services.bigquery_service import BigQueryService
-from google.cloud import bigquery
-from google.cloud import aiplatform
-from google.cloud.aiplatform_v1beta1 import (
-    FeatureOnlineStoreAdminServiceClient,
-    FeatureOnlineStoreServiceClient
-)
-from google.cloud.aiplatform_v1beta1.types import NearestNeighborQuery
-from google.cloud.aiplatform_v1beta1.types import feature_online_store_service as feature_online_store_service_pb2
-import vertexai
+from ..services.embedding_cache import EmbeddingCache, image_content_hash
+from ..services.stages import Stage, StageError
+from ..services.metrics import RequestTimings
+from ..services.image_pipeline import ImageTooLarge, PreparedImage
+from ..services.thumbnails import FORMATS as THUMBNAIL_FORMATS
+from ..services.pagination import decode_cursor, new_token, page
+from ..services.resilience import CircuitOpenError, Deadline, DeadlineExceeded, set_deadline
 import vertexai.vision_models as vision_models
-from vertexai.vision_models import MultiModalEmbeddingModel, Image
-import re
+import json
 import time
-import base64
-from io import BytesIO
-from PIL import Image as PILImage
+import uuid
 
 bp = Blueprint('api', __name__)
 
+def get_registry():
+    return current_app.extensions['service_registry']
+
 def get_gemini_service():
-    api_key = current_app.config.get('GEMINI_API_KEY')
-    if not api_key:
-        raise ValueError("GEMINI_API_KEY not found in application config")
-    return GeminiService(api_key=api_key)
+    return get_registry().gemini_service()
 
 def get_vertex_service():
-    project_id = current_app.config.get('GOOGLE_CLOUD_PROJECT')
-    location = current_app.config.get('VERTEX_AI_LOCATION')
-    return VertexAIService(project_id, location)
+    return get_registry().vertex_service()
 
 def get_bigquery_service():
-    project_id = current_app.config.get('GOOGLE_CLOUD_PROJECT')
-    dataset = current_app.config.get('BIGQUERY_DATASET')
-    return BigQueryService(project_id, dataset)
+    return get_registry().bigquery_service()
 
-def get_image_embeddings(project_id, location, image_data=None, contextual_text=None):
-    vertexai.init(project=project_id, location=location)
-    model = MultiModalEmbeddingModel.from_pretrained("multimodalembedding")
+def get_timings():
+    return g.timings
 
-    if image_data:
-        try:
-            # Create a temporary file to store the image
-            import tempfile
-            import os
-            
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as temp_file:
-                temp_file.write(base64.b64decode(image_data))
-                temp_file_path = temp_file.name
+def run_stages(stages):
+    """ Run independent stages on the shared executor and record their timings """
+    try:
+        results = get_registry().stage_runner().run(stages)
+    except StageError as e:
+        get_timings().record(e.result.name, e.result.elapsed, error=True)
+        raise
+    get_timings().record_stages(results)
+    return results
 
-            # Load image from the temporary file
-            image = vision_models.Image.load_from_file(temp_file_path)
-            
-            # Clean up the temporary file
-            try:
-                os.unlink(temp_file_path)
-            except:
-                pass
-        except Exception as e:
-            raise Exception(f"Failed to process image: {str(e)}")
+@bp.before_request
+def start_request_timings():
+    g.timings = RequestTimings(request.endpoint, get_registry().metrics())
+    # Stages and upstream calls of this request share one time budget
+    set_deadline(Deadline(current_app.config.get('REQUEST_DEADLINE') or None))
+
+@bp.after_request
+def add_server_timing(response):
+    timings = g.get('timings')
+    if timings is not None:
+        # Headers go out before a streamed body is generated, so for NDJSON
+        # responses Server-Timing only covers the stages run up to that point
+        response.headers['Server-Timing'] = timings.server_timing()
+        if response.is_streamed:
+            # Stages recorded while streaming still reach the histograms; the
+            # request latency is taken once the last event has been sent
+            status = response.status_code
+            response.call_on_close(lambda: timings.finish(status))
+        else:
+            timings.finish(response.status_code)
+    return response
+
+# Fields sent as strings by multipart forms and query strings
+INTEGER_FIELDS = ('neighbor_count',)
+BOOLEAN_FIELDS = ('stream',)
+STRING_FIELDS = ('query', 'cursor')
+
+def read_image_request():
+    """ (fields, PreparedImage or None) from a JSON, multipart/form-data or raw image body.
+
+    JSON carries the image base64-encoded in image_data. A multipart form
+    sends it as the binary 'image' part next to the other fields, and an
+    application/octet-stream (or image/*) body is the image itself, with the
+    fields in the query string. Fields are None when a JSON body is missing or
+    is not JSON. Bodies over MAX_CONTENT_LENGTH raise RequestEntityTooLarge
+    before being read, and images over MAX_IMAGE_PIXELS raise ImageTooLarge
+    before decoding. Malformed fields or image data raise ValueError.
+    """
+    mimetype = request.mimetype
+    if mimetype == 'multipart/form-data':
+        upload = request.files.get('image')
+        fields = form_fields(request.form)
+        image = PreparedImage(upload.read()) if upload else None
+    elif mimetype == 'application/octet-stream' or mimetype.startswith('image/'):
+        body = request.get_data(cache=False)
+        fields = form_fields(request.args)
+        image = PreparedImage(body) if body else None
     else:
-        image = None
+        fields = request.get_json(silent=True)
+        if fields is not None and not isinstance(fields, dict):
+            raise ValueError("The JSON body must be an object")
+        fields = typed_fields(fields) if fields is not None else None
+        image_data = fields.get('image_data') if fields else None
+        image = decode_image(image_data) if image_data else None
 
-    embeddings = model.get_embeddings(
-        image=image,
-        contextual_text=contextual_text,
-    )
+    if image is not None:
+        image.check_pixels(current_app.config.get('MAX_IMAGE_PIXELS'))
+    return fields, image
+
+def form_fields(values):
+    """ Request fields from form or query string values, typed like their JSON counterparts """
+    return typed_fields(values.to_dict())
+
+def typed_fields(fields):
+    """ fields with INTEGER_FIELDS and BOOLEAN_FIELDS converted; raises ValueError for bad values """
+    for name in STRING_FIELDS:
+        if fields.get(name) is not None and not isinstance(fields[name], str):
+            raise ValueError(f"{name} must be a string")
+    limit = current_app.config.get('MAX_NEIGHBOR_COUNT')
+    for name in INTEGER_FIELDS:
+        value = fields.get(name)
+        if value is None:
+            continue
+        if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+            raise ValueError(f"{name} must be a positive integer")
+        try:
+            fields[name] = int(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"{name} must be a positive integer")
+        if fields[name] < 1:
+            raise ValueError(f"{name} must be a positive integer")
+        if limit and fields[name] > limit:
+            raise ValueError(f"{name} must be at most {limit}")
+    for name in BOOLEAN_FIELDS:
+        if isinstance(fields.get(name), str):
+            fields[name] = fields[name].lower() in ('1', 'true', 'yes')
+    return fields
+
+def decode_image(image_data):
+    """ PreparedImage from a base64 string; raises ValueError when it is not one """
+    if not isinstance(image_data, str):
+        raise ValueError("image_data must be a base64 string")
+    try:
+        return PreparedImage.from_base64(image_data)
+    except ValueError as e:
+        raise ValueError(f"image_data is not valid base64: {str(e)}")
+
+def upload_too_large(error):
+    return jsonify({'error': 'Upload too large', 'details': str(error)}), 413
+
+def invalid_request(error):
+    return jsonify({'error': 'Invalid request', 'details': str(error)}), 400
+
+def get_image_embeddings(model, image_data=None, contextual_text=None, cache=None, upstream=None):
+    image = PreparedImage.coerce(image_data)
+    if cache is not None:
+        key = EmbeddingCache.make_key(
+            'multimodalembedding',
+            text=contextual_text,
+            image_hash=image_content_hash(image)
+        )
+        return cache.get_or_compute(
+            key, lambda: get_image_embeddings(model, image, contextual_text, upstream=upstream)
+        )
+
+    def call():
+        return model.get_embeddings(
+            image=vision_models.Image(image_bytes=image.jpeg_bytes()) if image else None,
+            contextual_text=contextual_text,
+        )
+    embeddings = call() if upstream is None else upstream.call(call)
 
     embedding_value = embeddings.image_embedding or embeddings.text_embedding
     embedding = [v for v in embedding_value]
     return embedding
 
-def online_store_search(project_id, region, n_cnt, prompt=None, image_data=None):
-    """ Initialize Google Cloud clients """
-    GCS_IMAGE_BUCKET = "raves_us"
-    BQ_DATASET_ID = "raves_us"
-    BQ_TABLE_ID = "product_feature_store"
-    BQ_TABLE_ID_FQN = "raves-altostrat.raves_us.product_feature_store"
-    DATA_SOURCE = f"bq://{BQ_TABLE_ID_FQN}"
-    
-    # Initialize AI Platform clients
-    aiplatform.init(project=project_id, location=region)
-    FEATURE_ONLINE_STORE_ID = "products_online_feature_store"
-    API_ENDPOINT = f"{region}-aiplatform.googleapis.com"
-    admin_client = FeatureOnlineStoreAdminServiceClient(
-        client_options={"api_endpoint": API_ENDPOINT}
-    )
-    FEATURE_VIEW_ID = "products_feature_view"
-    DIMENSIONS = 1408
-    EMBEDDING_COLUMN = "embedding"
+def nearest_neighbor_search(registry, n_cnt, prompt=None, image_data=None):
+    """ Embed the query and search the configured vector index backend """
+    timings = get_timings()
+    with timings.stage('embedding'):
+        EMBEDDINGS = get_image_embeddings(
+            registry.embedding_model(),
+            image_data=image_data,
+            contextual_text=prompt,
+            cache=registry.embedding_cache(),
+            upstream=registry.upstream('embedding')
+        )
 
-    feature_online_store_instance = admin_client.get_feature_online_store(
-        name=f"projects/{project_id}/locations/{region}/featureOnlineStores/{FEATURE_ONLINE_STORE_ID}"
-    )
+    with timings.stage('knn'):
+        neighbors = registry.vector_index().search(EMBEDDINGS, n_cnt)
+    gcs_uri_list = [neighbor['gcs_uri'] for neighbor in neighbors]
+    productid_list = [neighbor['product_id'] for neighbor in neighbors]
+    return gcs_uri_list, productid_list
 
-    PUBLIC_ENDPOINT = feature_online_store_instance.dedicated_serving_endpoint.public_endpoint_domain_name
-    data_client = FeatureOnlineStoreServiceClient(client_options={"api_endpoint": PUBLIC_ENDPOINT})
+# Result field filled in by each enrichment stage
+ENRICHMENT_FIELDS = {'signing': 'image_url', 'catalog': 'aisle'}
 
-    # Get embeddings using the same function as Product_Semantic_Search.py
-    EMBEDDINGS = get_image_embeddings(
-        project_id=project_id,
-        location=region,
-        image_data=image_data,
-        contextual_text=prompt
-    )
+def thumbnail_urls(productid_list):
+    """ Thumbnail proxy URLs for the products, or None when thumbnails are not configured """
+    if not current_app.config.get('THUMB_URI_TEMPLATE'):
+        return None
+    size = current_app.config.get('THUMB_RESULT_SIZE', 'medium')
+    return [url_for('api.thumbnail', product_id=pid, size=size) for pid in productid_list]
 
-    output = data_client.search_nearest_entities(
-        request=feature_online_store_service_pb2.SearchNearestEntitiesRequest(
-            feature_view=f"projects/{project_id}/locations/{region}/featureOnlineStores/{FEATURE_ONLINE_STORE_ID}/featureViews/{FEATURE_VIEW_ID}",
-            query=NearestNeighborQuery(
-                embedding=NearestNeighborQuery.Embedding(value=EMBEDDINGS),
-                neighbor_count=n_cnt,
-            ),
-            return_full_entity=True,
+def enrichment_stages(registry, gcs_uri_list, productid_list, sign=True):
+    """ Optional signing and aisle stages; either may degrade to placeholders """
+    stages = [
+        Stage(
+            'catalog',
+            lambda: [registry.catalog().get(pid, 'aisle', 'Unknown') for pid in productid_list],
+            required=False,
+            default=['Unknown'] * len(productid_list)
         )
+    ]
+    if sign:
+        signing_provider = registry.signed_url_provider()
+        stages.insert(0, Stage(
+            'signing',
+            lambda: signing_provider.sign_many(gcs_uri_list),
+            required=False,
+            default=[''] * len(gcs_uri_list)
+        ))
+    return stages
+
+def search_key(query, image_data, neighbor_count):
+    """ Identity of a search: normalized text, image content hash and result count """
+    key = EmbeddingCache.make_key('search', text=query, image_hash=image_content_hash(image_data))
+    return key, neighbor_count
+
+def index_version(registry):
+    """ Changes whenever the vector index is reloaded """
+    return getattr(registry.vector_index(), 'version', None)
+
+def search_version(registry):
+    """ Changes whenever the vector index or the catalog behind a result is reloaded """
+    return index_version(registry), registry.catalog().version
+
+def retrieve_candidates(registry, query, image_data, count):
+    """ Over-fetch the ranked candidate list once and keep it for later pages; returns (token, candidates).
+
+    Candidates are only ids and image URIs, joined to the catalog again on
+    every page, so the list is keyed on the index version alone and
+    survives catalog refreshes.
+    """
+    n_cnt = max(count, int(current_app.config.get('SEARCH_CANDIDATES', 100)))
+    candidates = nearest_neighbor_search(
+        registry,
+        n_cnt=n_cnt,
+        prompt=query,
+        image_data=image_data
     )
+    token = new_token()
+    registry.search_cursors().put(token, index_version(registry), candidates)
+    return token, candidates
 
-    gcs_uri_list = []
-    productid_list = []
-    for i in range(n_cnt):
-        product_id = output.nearest_neighbors.neighbors[i].entity_key_values.key_values.features[8].value
-        productid_list.append(str(product_id))
-        gcs_uri = output.nearest_neighbors.neighbors[i].entity_key_values.key_values.features[9].value
-        gcs_uri_list.append(str(gcs_uri))
+def enrich_results(registry, gcs_uri_list, productid_list):
+    """ Image URLs and aisles for one page of products; returns (results, degraded stages) """
+    # Sign image URLs and look up aisles concurrently (thumbnail proxy URLs need no signing)
+    image_urls = thumbnail_urls(productid_list)
+    stages = run_stages(enrichment_stages(registry, gcs_uri_list, productid_list, sign=image_urls is None))
+    for name in stages.degraded:
+        current_app.logger.error(f"Search stage {name} failed: {str(stages[name].error)}")
 
-    return gcs_uri_list, productid_list
+    if 'signing' in stages:
+        image_urls = stages.value('signing')
+    results = [
+        {'id': product_id, 'image_url': image_url, 'aisle': aisle}
+        for product_id, image_url, aisle in zip(productid_list, image_urls, stages.value('catalog'))
+    ]
+    return results, stages.degraded
+
+def search_pipeline(registry, query, image_data, neighbor_count):
+    """ Embedding, kNN and enrichment of the first page; returns ({results, next_cursor}, degraded stages) """
+    token, candidates = retrieve_candidates(registry, query, image_data, neighbor_count)
+    gcs_uri_list, productid_list, next_cursor = page(candidates, token, 0, neighbor_count)
+    results, degraded = enrich_results(registry, gcs_uri_list, productid_list)
+    return {'results': results, 'next_cursor': next_cursor}, degraded
+
+def search_page(registry, cursor, query, image_data, neighbor_count, stream, start_time):
+    """ A later page of a search: only the new products are enriched.
+
+    The candidate list is held by the worker that ran the search for
+    SEARCH_CURSOR_TTL seconds. When it is gone (expired, evicted or held by
+    another worker) and the request repeats the query, it is retrieved again;
+    otherwise the client is told to resend the query with 410.
+    """
+    try:
+        token, offset = decode_cursor(cursor)
+    except ValueError as e:
+        return jsonify({'error': 'Invalid cursor', 'details': str(e)}), 400
+
+    candidates = registry.search_cursors().get(token, index_version(registry))
+    if candidates is None:
+        if not query and not image_data:
+            return jsonify({'error': 'Cursor expired'}), 410
+        token, candidates = retrieve_candidates(registry, query, image_data, offset + neighbor_count)
+
+    gcs_uri_list, productid_list, next_cursor = page(candidates, token, offset, neighbor_count)
+    if stream:
+        image_urls = thumbnail_urls(productid_list)
+        stages = enrichment_stages(registry, gcs_uri_list, productid_list, sign=image_urls is None)
+        return Response(
+            stream_with_context(stream_search_results(
+                registry, stages, productid_list, image_urls, start_time, next_cursor=next_cursor
+            )),
+            mimetype='application/x-ndjson'
+        )
+
+    results, degraded = enrich_results(registry, gcs_uri_list, productid_list)
+    response = {
+        'results': results,
+        'next_cursor': next_cursor,
+        'elapsed_time': time.time() - start_time
+    }
+    if degraded:
+        response['degraded'] = degraded
+    return jsonify(response)
+
+def wants_stream(data):
+    return bool(data.get('stream')) or request.accept_mimetypes.best == 'application/x-ndjson'
+
+def ndjson(event):
+    return json.dumps(event) + '\n'
+
+def stream_cached_results(cached, start_time, degraded=None):
+    yield ndjson({'type': 'results', 'results': cached['results']})
+    done = {'type': 'done', 'elapsed_time': time.time() - start_time, 'next_cursor': cached['next_cursor']}
+    if degraded:
+        done['degraded'] = degraded
+    yield ndjson(done)
 
-def get_signed_urls(project_id, urls):
-    bq_client = bigquery.Client(project=project_id)
-    uris = [re.search(r'"(gs://[^"]+)"', item).group(1) for item in urls]
-    uri_string = ", ".join([f"'{uri}'" for uri in uris])
+def stream_search_results(registry, stages, productid_list, image_urls, start_time, next_cursor=None,
+                          on_complete=None):
+    """ NDJSON events: ranked ids first, then each enrichment stage as it resolves.
 
-    query = f"""
-    SELECT signed_url
-    FROM EXTERNAL_OBJECT_TRANSFORM(TABLE `raves-altostrat.raves_us.product_images`, ['SIGNED_URL'])
-    WHERE uri IN ({uri_string})
+    The done event carries the cursor of the next page. on_complete receives
+    the assembled page when no stage degraded.
     """
+    timings = get_timings()
+    results = [
+        {'id': pid, 'image_url': image_urls[i] if image_urls else None, 'aisle': None}
+        for i, pid in enumerate(productid_list)
+    ]
+    yield ndjson({'type': 'results', 'results': results})
 
-    query_job = bq_client.query(query)
-    results = query_job.result()
-    signed_url_list = [row.signed_url for row in results]
-    return signed_url_list
+    degraded = []
+    try:
+        for result in registry.stage_runner().iter_results(stages):
+            timings.record(result.name, result.elapsed, error=not result.ok)
+            if not result.ok:
+                degraded.append(result.name)
+                current_app.logger.error(f"Search stage {result.name} failed: {str(result.error)}")
+            field = ENRICHMENT_FIELDS[result.name]
+            for entry, value in zip(results, result.value):
+                entry[field] = value
+            yield ndjson({
+                'type': 'update',
+                'field': field,
+                'values': dict(zip(productid_list, result.value))
+            })
+    except Exception as e:
+        current_app.logger.error(f"Streaming search failed: {str(e)}")
+        yield ndjson({'type': 'error', 'error': 'Search operation failed', 'details': str(e)})
+        return
 
-def search_aisle_info(project_id, region, productid_list):
-    bq_client = bigquery.Client()
+    if on_complete is not None and not degraded:
+        on_complete({'results': results, 'next_cursor': next_cursor})
+    done = {'type': 'done', 'elapsed_time': time.time() - start_time, 'next_cursor': next_cursor}
+    if degraded:
+        done['degraded'] = degraded
+    yield ndjson(done)
 
-    pattern = r'string_value: "([^"]+)"'
-    product_list = [re.search(pattern, item).group(1) for item in productid_list]
-    product_id_list = [int(file_name.split('.')[0]) for file_name in product_list]
+def embed_queries(registry, queries):
+    """ Embeddings for (text, image_data) pairs; each distinct cache miss is computed once.
 
-    query = f"""
-    SELECT productid, aisle
-    FROM `raves-altostrat.raves_us.product_qty`
-    WHERE productid IN ({','.join(map(str, product_id_list))})
+    The multimodal model embeds one input per call, so misses fan out over the
+    shared stage executor, in the request's context so the deadline applies.
+    Failed items come back as the raised exception.
     """
+    model = registry.embedding_model()
+    cache = registry.embedding_cache()
+    upstream = registry.upstream('embedding')
+    keys = [
+        EmbeddingCache.make_key('multimodalembedding', text=text, image_hash=image_content_hash(image_data))
+        for text, image_data in queries
+    ]
+
+    embeddings = {}
+    missing = {}
+    for key, (text, image_data) in zip(keys, queries):
+        if key in embeddings or key in missing:
+            continue
+        cached = cache.get(key)
+        if cached is not None:
+            embeddings[key] = cached
+        else:
+            missing[key] = (text, image_data)
+
+    def compute(item):
+        text, image_data = item
+        try:
+            return get_image_embeddings(model, image_data=image_data, contextual_text=text, upstream=upstream)
+        except Exception as e:
+            return e
+
+    computed = registry.stage_runner().map(compute, missing.values())
+    for key, embedding in zip(missing, computed):
+        if not isinstance(embedding, Exception):
+            cache.put(key, embedding)
+        embeddings[key] = embedding
+    return [embeddings[key] for key in keys]
+
+@bp.route('/search/batch', methods=['POST'])
+def search_batch():
+    try:
+        data = request.get_json(silent=True)
+        queries = data.get('queries') if isinstance(data, dict) else None
+        if not queries or not isinstance(queries, list):
+            return jsonify({'error': 'A non-empty list of queries must be provided'}), 400
+
+        max_batch = current_app.config.get('SEARCH_BATCH_MAX', 256)
+        if len(queries) > max_batch:
+            return jsonify({'error': f'At most {max_batch} queries are allowed per batch'}), 400
+        if any(not isinstance(q, dict) or (not q.get('query') and not q.get('image_data')) for q in queries):
+            return jsonify({'error': 'Each query needs either query or image_data'}), 400
+
+        # Validate every query before doing any work, so one bad item is a 400 rather than a failed batch
+        try:
+            default_count = typed_fields({'neighbor_count': data.get('neighbor_count', 10)})['neighbor_count']
+            items = []
+            for i, q in enumerate(queries):
+                try:
+                    fields = typed_fields({
+                        'query': q.get('query'),
+                        'neighbor_count': q.get('neighbor_count', default_count)
+                    })
+                    image = decode_image(q['image_data']) if q.get('image_data') else None
+                except ValueError as e:
+                    raise ValueError(f"Query {i}: {str(e)}")
+                items.append((fields['query'], image, fields['neighbor_count']))
+        except ValueError as e:
+            return invalid_request(e)
+
+        counts = [count for _, _, count in items]
+        start_time = time.time()
+        registry = get_registry()
+        timings = get_timings()
+
+        # Embed every distinct query, then run all kNN lookups together
+        with timings.stage('embedding'):
+            embeddings = embed_queries(registry, [(text, image) for text, image, _ in items])
+        valid = [i for i, embedding in enumerate(embeddings) if not isinstance(embedding, Exception)]
+        with timings.stage('knn'):
+            neighbor_lists = registry.vector_index().search_batch(
+                [embeddings[i] for i in valid], max(counts)
+            ) if valid else []
+        neighbors_by_query = dict(zip(valid, neighbor_lists))
 
-    query_job = bq_client.query(query)
-    results = query_job.result()
-    
-    aisle_info = []
-    for row in results:
-        aisle_info.append({
-            'productid': row.productid,
-            'aisle': row.aisle
+        # One signing pass and one catalog pass over the union of all results
+        union = {}
+        for i, neighbors in neighbors_by_query.items():
+            for neighbor in neighbors[:counts[i]]:
+                union.setdefault(neighbor['product_id'], neighbor['gcs_uri'])
+        product_ids = list(union)
+        thumbnails = thumbnail_urls(product_ids)
+        if thumbnails is not None:
+            signed_urls = dict(zip(product_ids, thumbnails))
+        else:
+            with timings.stage('signing'):
+                signed_urls = dict(zip(product_ids, registry.signed_url_provider().sign_many(list(union.values()))))
+        with timings.stage('catalog'):
+            catalog = registry.catalog()
+            aisles = {pid: catalog.get(pid, 'aisle', 'Unknown') for pid in product_ids}
+
+        batch_results = []
+        for i, count in enumerate(counts):
+            if i not in neighbors_by_query:
+                batch_results.append({'error': 'Failed to embed query', 'details': str(embeddings[i])})
+                continue
+            batch_results.append({'results': [
+                {
+                    'id': neighbor['product_id'],
+                    'image_url': signed_urls[neighbor['product_id']],
+                    'aisle': aisles[neighbor['product_id']]
+                }
+                for neighbor in neighbors_by_query[i][:count]
+            ]})
+
+        return jsonify({
+            'results': batch_results,
+            'elapsed_time': time.time() - start_time
         })
-    
-    return aisle_info
+
+    except Exception as e:
+        current_app.logger.error(f"Error in batch search endpoint: {str(e)}")
+        return jsonify({
+            'error': 'Batch search failed',
+            'details': str(e)
+        }), 500
 
 @bp.route('/analyze-image', methods=['POST'])
 def analyze_image():
     try:
-        print("Starting /analyze-image endpoint...")
-        data = request.get_json()
+        try:
+            data, image = read_image_request()
+        except (RequestEntityTooLarge, ImageTooLarge) as e:
+            return upload_too_large(e)
+        except ValueError as e:
+            return invalid_request(e)
         
-        if not data:
-            print("No JSON data received")
+        if data is None:
             return jsonify({'error': 'No JSON data provided'}), 400
             
-        if 'image_data' not in data:
-            print("No image_data in request")
+        if image is None:
             return jsonify({'error': 'No image data provided'}), 400
 
-        print("Getting Gemini service...")
         try:
             gemini_service = get_gemini_service()
         except Exception as e:
-            print(f"Failed to initialize Gemini service: {str(e)}")
+            current_app.logger.error(f"Failed to initialize Gemini service: {str(e)}")
             return jsonify({
                 'error': 'Service configuration error',
                 'details': str(e)
             }), 500
-        
-        print("Calling Gemini service analyze_image...")
-        result = gemini_service.analyze_image(data['image_data'])
-        print(f"Gemini service result: {result}")
+
+
+        # Webcam clients send a session id; a frame showing the same scene as
+        # the last one reuses its attributes instead of calling Gemini again
+        session_id = data.get('session_id')
+        sessions = get_registry().webcam_sessions()
+        session = sessions.match(session_id, image.perceptual_hash) if session_id else None
+        if session is not None and session.features is not None:
+            return jsonify(session.features)
+
+        start = time.perf_counter()
+        result = gemini_service.analyze_image(image)
+        get_timings().record('gemini', time.perf_counter() - start, error='error' in result)
         
         if 'error' in result:
-            error_msg = f"Gemini analysis error: {result.get('details', 'Unknown error')}"
-            print(error_msg)
-            return jsonify(result), 500
-            
+            current_app.logger.error(f"Gemini analysis error: {result.get('details', 'Unknown error')}")
+            return jsonify(result), 503 if result.get('unavailable') else 500
+
+        if session_id:
+            sessions.update(session_id, image.perceptual_hash, features=result)
         return jsonify(result)
 
     except Exception as e:
-        import traceback
-        error_msg = f"Error in analyze_image: {str(e)}\nTraceback: {traceback.format_exc()}"
-        print(error_msg)
+        current_app.logger.exception(f"Error in analyze_image: {str(e)}")
         return jsonify({
             'error': 'Failed to analyze image',
             'details': str(e)
@@ -216,16 +548,21 @@ def analyze_image():
 @bp.route('/search', methods=['POST'])
 def search():
     try:
-        data = request.get_json()
+        try:
+            data, image_data = read_image_request()
+        except (RequestEntityTooLarge, ImageTooLarge) as e:
+            return upload_too_large(e)
+        except ValueError as e:
+            return invalid_request(e)
         
-        if not data:
+        if data is None:
             return jsonify({'error': 'No search data provided'}), 400
             
         query = data.get('query')
-        image_data = data.get('image_data')
         neighbor_count = data.get('neighbor_count', 10)
+        cursor = data.get('cursor')
         
-        if not query and not image_data:
+        if not query and not image_data and not cursor:
             return jsonify({'error': 'Either query or image_data must be provided'}), 400
             
         project_id = current_app.config.get('GOOGLE_CLOUD_PROJECT')
@@ -239,44 +576,89 @@ def search():
         start_time = time.time()
         
         try:
-            # Perform feature store search
-            gcs_uri_list, productid_list = online_store_search(
-                project_id=project_id,
-                region=region,
-                n_cnt=neighbor_count,
-                prompt=query,
-                image_data=image_data
-            )
-            
-            # Get signed URLs for images
-            try:
-                signed_urls = get_signed_urls(project_id, gcs_uri_list)
-            except Exception as e:
-                current_app.logger.error(f"Failed to get signed URLs: {str(e)}")
-                return jsonify({'error': 'Failed to get image URLs', 'details': str(e)}), 500
-            
-            # Get aisle information
-            try:
-                aisle_info = search_aisle_info(project_id, region, productid_list)
-            except Exception as e:
-                current_app.logger.error(f"Failed to get aisle info: {str(e)}")
-                return jsonify({'error': 'Failed to get aisle information', 'details': str(e)}), 500
-            
-            # Combine results
-            results = []
-            for i, (product_id, signed_url) in enumerate(zip(productid_list, signed_urls)):
-                product_info = next((info for info in aisle_info if str(info['productid']) == re.search(r'"([^"]+)"', product_id).group(1).split('.')[0]), None)
-                results.append({
-                    'id': re.search(r'"([^"]+)"', product_id).group(1).split('.')[0],
-                    'image_url': signed_url,
-                    'aisle': product_info['aisle'] if product_info else 'Unknown'
+            registry = get_registry()
+            timings = get_timings()
+            stream = wants_stream(data)
+            # "Load more" pages through the candidate list retrieved by the first page
+            if cursor:
+                return search_page(registry, cursor, query, image_data, neighbor_count, stream, start_time)
+
+            version = search_version(registry)
+
+            # Identical searches share a short-lived cached result...
+            key = search_key(query, image_data, neighbor_count)
+            result_cache = registry.search_result_cache()
+            cached = result_cache.get(key, version)
+            if cached is not None:
+                if stream:
+                    return Response(stream_cached_results(cached, start_time), mimetype='application/x-ndjson')
+                return jsonify({
+                    **cached,
+                    'elapsed_time': time.time() - start_time
                 })
+
+            # ...and concurrent identical searches share one pipeline execution
+            flight = registry.search_flight()
+            if stream:
+                # Ranked ids go out as soon as kNN returns; URLs and aisles follow
+                # as each stage resolves (thumbnail proxy URLs need no signing)
+                wait_start = time.perf_counter()
+                (token, candidates), shared = flight.do(('candidates', key), lambda: retrieve_candidates(
+                    registry, query, image_data, neighbor_count
+                ))
+                if shared:
+                    timings.record('coalesced', time.perf_counter() - wait_start)
+                gcs_uri_list, productid_list, next_cursor = page(candidates, token, 0, neighbor_count)
+                image_urls = thumbnail_urls(productid_list)
+                stages = enrichment_stages(registry, gcs_uri_list, productid_list, sign=image_urls is None)
+                return Response(
+                    stream_with_context(stream_search_results(
+                        registry, stages, productid_list, image_urls, start_time, next_cursor=next_cursor,
+                        on_complete=lambda first_page: result_cache.put(key, version, first_page)
+                    )),
+                    mimetype='application/x-ndjson'
+                )
+
+            wait_start = time.perf_counter()
+            (first_page, degraded), shared = flight.do(('results', key), lambda: search_pipeline(
+                registry, query, image_data, neighbor_count
+            ))
+            if shared:
+                timings.record('coalesced', time.perf_counter() - wait_start)
+            elif not degraded:
+                result_cache.put(key, version, first_page)
             
             elapsed_time = time.time() - start_time
             
-            return jsonify({
-                'results': results,
+            response = {
+                **first_page,
                 'elapsed_time': elapsed_time
+            }
+            if degraded:
+                response['degraded'] = degraded
+            return jsonify(response)
+
+        except (CircuitOpenError, DeadlineExceeded) as e:
+            # An upstream is failing fast or ran out of time: serve the last result
+            # for this search if one is still held, otherwise ask the client to retry
+            current_app.logger.warning(f"Search upstream unavailable: {str(e)}")
+            stale = None
+            if not cursor:
+                stale = registry.search_result_cache().get_stale(
+                    search_key(query, image_data, neighbor_count), search_version(registry)
+                )
+            if stale is None:
+                return jsonify({
+                    'error': 'Search temporarily unavailable',
+                    'details': str(e)
+                }), 503
+            if stream:
+                return Response(stream_cached_results(stale, start_time, degraded=['stale']),
+                                mimetype='application/x-ndjson')
+            return jsonify({
+                **stale,
+                'elapsed_time': time.time() - start_time,
+                'degraded': ['stale']
             })
             
         except Exception as e:
@@ -293,45 +675,194 @@ def search():
             'details': str(e)
         }), 500
 
+@bp.route('/analyze-images', methods=['POST'])
+def analyze_images():
+    """ Gemini attributes for several images, batched into as few model calls as possible """
+    try:
+        try:
+            if request.mimetype == 'multipart/form-data':
+                images = [PreparedImage(upload.read()) for upload in request.files.getlist('image')]
+            else:
+                data = request.get_json(silent=True)
+                items = data.get('images') if isinstance(data, dict) else None
+                if items is not None and not isinstance(items, list):
+                    raise ValueError("images must be a list of base64 strings")
+                images = [decode_image(item) for item in items or []]
+            max_pixels = current_app.config.get('MAX_IMAGE_PIXELS')
+            for image in images:
+                image.check_pixels(max_pixels)
+        except (RequestEntityTooLarge, ImageTooLarge) as e:
+            return upload_too_large(e)
+        except ValueError as e:
+            return invalid_request(e)
+
+        if not images:
+            return jsonify({'error': 'No images provided'}), 400
+        max_batch = current_app.config.get('ANALYZE_BATCH_MAX', 32)
+        if len(images) > max_batch:
+            return jsonify({'error': f'At most {max_batch} images are allowed per request'}), 400
+
+        with get_timings().stage('gemini'):
+            results = get_gemini_service().analyze_images(images)
+        return jsonify({'results': results})
+
+    except Exception as e:
+        current_app.logger.exception(f"Error in analyze_images: {str(e)}")
+        return jsonify({
+            'error': 'Failed to analyze images',
+            'details': str(e)
+        }), 500
+
 @bp.route('/analyze-webcam', methods=['POST'])
 def analyze_webcam():
     try:
-        data = request.get_json()
-        if not data or 'image_data' not in data:
+        try:
+            data, image = read_image_request()
+        except (RequestEntityTooLarge, ImageTooLarge) as e:
+            return upload_too_large(e)
+        except ValueError as e:
+            return invalid_request(e)
+        if image is None:
             return jsonify({'error': 'No image data provided'}), 400
 
+        registry = get_registry()
         gemini_service = get_gemini_service()
         vertex_service = get_vertex_service()
         bigquery_service = get_bigquery_service()
+
+        # Reuse the previous frame's analysis while the camera shows the same scene
+        session_id = data.get('session_id') or uuid.uuid4().hex
+        neighbor_count = data.get('neighbor_count', 10)
+        sessions = registry.webcam_sessions()
+        session = sessions.match(session_id, image.perceptual_hash)
+        if session is not None and session.results is not None and session.neighbor_count == neighbor_count:
+            return jsonify({
+                'results': session.results,
+                'features': session.features or {},
+                'session_id': session_id,
+                'reused': True,
+                'elapsed_time': get_timings().elapsed
+            })
+
+        # Gemini analysis and the image embedding are independent, so run them
+        # together; without Gemini attributes the search still proceeds
+        def analyze():
+            features = gemini_service.analyze_image(image)
+            if 'error' in features:
+                raise ValueError(features.get('details', features['error']))
+            return features
+
+        stage_list = [Stage('embedding', lambda: vertex_service.get_image_embedding(image))]
+        if session is None or session.features is None:
+            stage_list.append(Stage('gemini', analyze, required=False, default={}))
+        stages = run_stages(stage_list)
+        features = stages.value('gemini') if 'gemini' in stages else session.features
+        image_embedding = stages.value('embedding')
+
+        # Then search only the products matching Gemini's attributes
+        timings = get_timings()
+        with timings.stage('search'):
+            results, applied_filters = bigquery_service.search_products_with_filters(
+                embedding=image_embedding,
+                apparel_type=features.get('apparel_type'),
+                color=features.get('color'),
+                gender=features.get('gender'),
+                k=neighbor_count
+            )
         
-        # First analyze with Gemini
-        features = gemini_service.analyze_image(data['image_data'])
-        if 'error' in features:
-            return jsonify(features), 500
-            
-        # Then search with features
-        image_embedding = vertex_service.get_image_embedding(data['image_data'])
-        results = bigquery_service.search_products_with_filters(
-            embedding=image_embedding,
-            apparel_type=features.get('apparel_type'),
-            color=features.get('color'),
-            gender=features.get('gender')
+        sessions.update(
+            session_id, image.perceptual_hash,
+            features=None if 'gemini' in stages.degraded else features,
+            results=results,
+            neighbor_count=neighbor_count
         )
-        
-        return jsonify({
+
+        response = {
             'results': results,
             'features': features,
-            'elapsed_time': 0.5
-        })
+            'session_id': session_id,
+            'reused': False,
+            # Catalog values actually used to narrow the search; fewer than
+            # Gemini reported means filters were relaxed
+            'filters': applied_filters,
+            'elapsed_time': timings.elapsed
+        }
+        if stages.degraded:
+            response['degraded'] = stages.degraded
+        return jsonify(response)
 
     except Exception as e:
-        import traceback
-        print(f"Webcam analysis error: {str(e)}\nTraceback: {traceback.format_exc()}")
+        current_app.logger.exception(f"Webcam analysis error: {str(e)}")
         return jsonify({
             'error': 'Failed to analyze webcam image',
             'details': str(e)
         }), 500
 
+@bp.route('/thumb/<product_id>', methods=['GET'])
+def thumbnail(product_id):
+    """ Resized product image from the local thumbnail cache, with a strong ETag """
+    if not current_app.config.get('THUMB_URI_TEMPLATE'):
+        return jsonify({'error': 'Thumbnails are not configured'}), 404
+
+    size = request.args.get('size', 'medium')
+    format = request.args.get('format') or (
+        'webp' if request.accept_mimetypes.best_match(['image/webp', 'image/jpeg']) == 'image/webp' else 'jpeg'
+    )
+    try:
+        with get_timings().stage('thumbnail'):
+            thumb = get_registry().thumbnail_cache().get(product_id, size=size, format=format)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        if isinstance(e, FileNotFoundError) or getattr(e, 'code', None) == 404:
+            return jsonify({'error': 'Product image not found'}), 404
+        current_app.logger.error(f"Thumbnail error for {product_id}: {str(e)}")
+        return jsonify({
+            'error': 'Failed to load thumbnail',
+            'details': str(e)
+        }), 500
+
+    response = send_file(
+        thumb.path,
+        mimetype=THUMBNAIL_FORMATS[format][1],
+        etag=thumb.etag,
+        max_age=current_app.config.get('THUMB_MAX_AGE', 86400)
+    )
+    response.cache_control.public = True
+    response.vary.add('Accept')
+    return response
+
+@bp.route('/metrics', methods=['GET'])
+def metrics():
+    """ Prometheus text exposition of this worker's latency, error and cache metrics """
+    registry = get_registry()
+    caches = {}
+    for name, attribute in (
+        ('embedding', 'embedding_cache'),
+        ('signed_url', 'signed_url_provider'),
+        ('webcam_session', 'webcam_sessions'),
+        ('gemini_attributes', 'gemini_cache'),
+        ('thumbnail', 'thumbnail_cache'),
+        ('search_result', 'search_result_cache'),
+        ('search_coalescing', 'search_flight'),
+        ('search_cursor', 'search_cursors')
+    ):
+        instance = registry.peek(attribute)
+        if instance is not None:
+            caches[name] = instance.stats()
+    upstreams = registry.peek('upstreams')
+    index = registry.peek('vector_index')
+    # Only backends that sample their recall (the reduced backend) have stats()
+    indexes = {'vector': index.stats()} if hasattr(index, 'stats') else None
+    filtered_search = registry.peek('filtered_search')
+    filters = {'webcam': filtered_search.stats()} if filtered_search is not None else None
+    return Response(
+        registry.metrics().render(
+            caches, upstreams.stats() if upstreams is not None else None, indexes, filters
+        ),
+        mimetype='text/plain; version=0.0.4'
+    )
+
 @bp.route('/health', methods=['GET'])
 def health_check():
     return jsonify({'status': 'healthy'}) 
\ No newline at end of file
@@ -0,0 +1,154 @@
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+
+@click.command('ingest')
+@click.argument('source')
+@click.option('--output', default=None,
+              help='Snapshot to write (defaults to VECTOR_INDEX_PATH)')
+@click.option('--uri-prefix', default=None,
+              help='gs:// prefix recorded for images read from a local directory')
+@click.option('--workers', default=8, show_default=True, help='Images decoded and embedded concurrently')
+@click.option('--batch-size', default=32, show_default=True, help='Images per embedding batch and checkpoint part')
+@click.option('--rate', default=10.0, show_default=True, help='Embedding requests per second (0 = unlimited)')
+@click.option('--max-size', default=1024, show_default=True, help='Longest image side sent to the model')
+@with_appcontext
+def ingest_command(source, output, uri_prefix, workers, batch_size, rate, max_size):
+    """Embed every product image under SOURCE (a directory or gs://bucket/prefix) into a snapshot.
+
+    Rerunning after a failure resumes from the checkpoint parts, and images
+    whose content has not changed since the last snapshot are skipped.
+    """
+    from .services.ingestion import IngestionPipeline, image_source
+    from .services.vertex_ai_service import VertexAIService
+
+    output = output or current_app.config.get('VECTOR_INDEX_PATH')
+    if not output:
+        raise click.UsageError('Pass --output or set VECTOR_INDEX_PATH')
+
+    registry = current_app.extensions['service_registry']
+    # No query cache here: catalog images would only evict real queries
+    embedder = VertexAIService(registry.project_id, registry.location, model=registry.embedding_model())
+    pipeline = IngestionPipeline(
+        embedder, output,
+        workers=workers, batch_size=batch_size, rate=rate, max_size=max_size
+    )
+    stats = pipeline.run(image_source(source, registry.storage_client, uri_prefix=uri_prefix))
+    click.echo(f"{stats}; snapshot written to {output}")
+
+
+@click.command('build-store')
+@click.argument('snapshot')
+@click.argument('output')
+@click.option('--dtype', type=click.Choice(['int8', 'float16']), default='int8', show_default=True)
+@click.option('--no-full', is_flag=True, help='Omit the float32 matrix; candidates are re-ranked dequantized')
+def build_store_command(snapshot, output, dtype, no_full):
+    """Convert an .npz SNAPSHOT into a memory-mapped store at OUTPUT for the mmap backend"""
+    from .services.embedding_store import write_embedding_store
+    from .services.vector_index import load_snapshot
+
+    ids, embeddings, gcs_uris = load_snapshot(snapshot)
+    write_embedding_store(output, ids, embeddings, gcs_uris, dtype=dtype, include_full=not no_full)
+    click.echo(f"Wrote {len(ids)} {dtype} embeddings to {output}")
+
+
+@click.command('fit-projection')
+@click.argument('snapshot')
+@click.argument('output')
+@click.option('--dimensions', default=256, show_default=True, help='Dimensions kept by the projection')
+@click.option('--report', default='64,128,256,512', show_default=True,
+              help='Comma-separated dimensions to measure recall for (empty to skip)')
+@click.option('--queries', default=None, help='.npy file of query embeddings (default: noisy catalog rows)')
+@click.option('--sample', default=500, show_default=True, help='Catalog rows sampled as queries without --queries')
+@click.option('-k', default=10, show_default=True, help='Neighbours compared with exact search')
+@click.option('--candidates', default=300, show_default=True, help='Candidates re-ranked at full dimension')
+def fit_projection_command(snapshot, output, dimensions, report, queries, sample, k, candidates):
+    """Fit a PCA projection of an .npz SNAPSHOT for the reduced backend and report its recall"""
+    import numpy as np
+    from .services.projection import fit_projection, reduced_recall_report, sample_queries, save_projection
+    from .services.vector_index import load_snapshot
+
+    _, embeddings, _ = load_snapshot(snapshot)
+    save_projection(output, fit_projection(embeddings, dimensions))
+    click.echo(f"Wrote a {embeddings.shape[1]} -> {dimensions} projection to {output}")
+
+    sizes = [int(size) for size in report.split(',') if size.strip()]
+    if not sizes:
+        return
+    query_embeddings = np.load(queries) if queries else sample_queries(embeddings, sample)
+    click.echo(f"recall@{k} over {len(query_embeddings)} queries, {candidates} candidates re-ranked:")
+    click.echo(f"{'dimensions':>10} {'recall':>8} {'ms/query':>9}")
+    for row in reduced_recall_report(embeddings, query_embeddings, sizes, k=k, candidates=candidates):
+        click.echo(f"{row['dimensions']:>10} {row['recall']:>8.3f} {row['ms_per_query']:>9.2f}")
+
+
+@click.command('eval-index')
+@click.argument('snapshot')
+@click.option('--queries', default=None,
+              help='Query set: a JSON-lines log of {"query", "image"} entries or an .npy of embeddings '
+                   '(default: noisy catalog rows)')
+@click.option('--backends', default='bruteforce,ivf,feature_store', show_default=True,
+              help='Comma-separated backends with optional parameters, e.g. ivf:nprobe=4:nlist=256,mmap:path=x.emb')
+@click.option('--k', 'neighbor_counts', default='5,10,20', show_default=True, help='Comma-separated neighbour counts')
+@click.option('--sample', default=500, show_default=True, help='Catalog rows sampled as queries without --queries')
+@click.option('--save-queries', default=None, help='Write the embedded query set to this .npy for later runs')
+@click.option('--json', 'json_path', default=None, help='Also write the results as JSON')
+@with_appcontext
+def eval_index_command(snapshot, queries, backends, neighbor_counts, sample, save_queries, json_path):
+    """Measure recall@k, nDCG@k, QPS and latency of kNN backends against exact search over SNAPSHOT"""
+    import json
+    import numpy as np
+    from .services.evaluation import Evaluation, embed_queries, format_results, parse_backends, read_query_log
+    from .services.projection import sample_queries
+    from .services.vector_index import create_vector_index, load_snapshot
+
+    registry = current_app.extensions['service_registry']
+    ids, embeddings, _ = load_snapshot(snapshot)
+    if queries and queries.endswith('.npy'):
+        query_embeddings = np.load(queries)
+    elif queries:
+        query_embeddings = embed_queries(
+            registry.vertex_service(), read_query_log(queries), storage_client_factory=registry.storage_client
+        )
+    else:
+        query_embeddings = sample_queries(embeddings, sample)
+    if save_queries:
+        np.save(save_queries, query_embeddings)
+
+    evaluation = Evaluation(ids, embeddings, query_embeddings)
+    counts = [int(count) for count in neighbor_counts.split(',') if count.strip()]
+    results = [evaluation.baseline(k) for k in counts]
+    for label, backend, overrides in parse_backends(backends):
+        config = dict(current_app.config, VECTOR_INDEX_BACKEND=backend, VECTOR_INDEX_PATH=snapshot,
+                      RECALL_SAMPLE_RATE=0)
+        dimensions = overrides.pop('REDUCED_DIMENSIONS', None)
+        if backend == 'reduced' and dimensions and 'REDUCED_PROJECTION_PATH' not in overrides:
+            overrides['REDUCED_PROJECTION_PATH'] = fit_temporary_projection(embeddings, int(dimensions))
+        config.update(overrides)
+        index = create_vector_index(config, registry)
+        results.extend(evaluation.run(label, index, k) for k in counts)
+
+    click.echo(f"{len(query_embeddings)} queries against {len(ids)} products")
+    click.echo(format_results(results))
+    if json_path:
+        with open(json_path, 'w') as f:
+            json.dump({'snapshot': snapshot, 'queries': len(query_embeddings), 'results': results}, f, indent=2)
+
+
+def fit_temporary_projection(embeddings, dimensions):
+    """Path of a projection fitted for one evaluation run"""
+    import os
+    import tempfile
+    from .services.projection import fit_projection, save_projection
+
+    path = os.path.join(tempfile.mkdtemp(prefix='eval-projection-'), f'projection-{dimensions}.npy')
+    save_projection(path, fit_projection(embeddings, dimensions))
+    return path
+
+
+def register_commands(app):
+    app.cli.add_command(ingest_command)
+    app.cli.add_command(build_store_command)
+    app.cli.add_command(fit_projection_command)
+    app.cli.add_command(eval_index_command)
@@ -0,0 +1,172 @@
+import logging
+import threading
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ATTRIBUTES = ('apparel_type', 'gender', 'color')
+# Values Gemini (or the catalog) uses for "no information"
+UNKNOWN_VALUES = {'', 'unknown', 'none', 'n/a'}
+# Gemini answers (man/woman/boy/girl) and the spellings catalogs commonly use for them
+SYNONYMS = {
+    'man': ('men', 'male', 'mens', "men's"),
+    'woman': ('women', 'female', 'womens', "women's"),
+    'boy': ('boys', "boy's", "boys'"),
+    'girl': ('girls', "girl's", "girls'"),
+    'unisex': ('unisex', 'all')
+}
+
+
+def normalize_value(value):
+    if value is None:
+        return ''
+    return ' '.join(str(value).lower().split())
+
+
+class AttributeBitmaps:
+    """Per-attribute inverted indexes over a fixed list of product ids.
+
+    Each (attribute, value) pair maps to a packed bitmap with one bit per
+    row, so a multi-attribute filter is a few byte-wise ANDs and memory is
+    n/8 bytes per distinct value.
+    """
+
+    def __init__(self, ids, values_by_attribute):
+        self.size = len(ids)
+        self.bitmaps = {}
+        for attribute, values in values_by_attribute.items():
+            normalized = np.array([normalize_value(value) for value in values], dtype=object)
+            uniques, inverse = np.unique(normalized, return_inverse=True)
+            self.bitmaps[attribute] = {
+                value: np.packbits(inverse == position)
+                for position, value in enumerate(uniques)
+                if value not in UNKNOWN_VALUES
+            }
+
+    def resolve(self, attribute, value):
+        """The catalog value matching a Gemini answer, or None.
+
+        Tries the value itself, then its synonyms and plural, then (for free
+        text such as "dark navy blue") its words, last word first.
+        """
+        known = self.bitmaps.get(attribute, {})
+        value = normalize_value(value)
+        candidates = [value, *SYNONYMS.get(value, ()), value + 's', value.rstrip('s')]
+        candidates.extend(reversed(value.split()))
+        for candidate in candidates:
+            if candidate in known:
+                return candidate
+        return None
+
+    def bitmap(self, filters):
+        """Packed bitmap of the rows matching every (attribute, value) in filters"""
+        result = None
+        for attribute, value in filters.items():
+            bitmap = self.bitmaps.get(attribute, {}).get(normalize_value(value))
+            if bitmap is None:
+                return np.zeros((self.size + 7) // 8, dtype=np.uint8)
+            result = bitmap if result is None else np.bitwise_and(result, bitmap)
+        return result
+
+    def rows(self, filters):
+        """Row positions matching every filter, in ascending order"""
+        bitmap = self.bitmap(filters)
+        if bitmap is None:
+            return np.arange(self.size)
+        return np.flatnonzero(np.unpackbits(bitmap, count=self.size))
+
+
+class FilteredSearch:
+    """Attribute-constrained nearest-neighbour search that filters before scoring.
+
+    Bitmaps are built from the catalog for the vector index's rows. Local
+    indexes then score only the matching rows; the feature store gets the
+    same filter pushed down as string filters. Gemini's answers are mapped
+    to the catalog's values first (see AttributeBitmaps.resolve). When fewer
+    than min_candidates rows match, the last attribute in attributes is
+    dropped and the search retried, ending with an unfiltered search.
+
+    Attributes the catalog has no column for cannot filter anything; they
+    are reported with a warning whenever the bitmaps are built, and stats()
+    counts how many searches were filtered, relaxed or unfiltered.
+    """
+
+    def __init__(self, index, catalog, attributes=DEFAULT_ATTRIBUTES, min_candidates=0):
+        self.index = index
+        self.catalog = catalog
+        self.attributes = tuple(attributes)
+        self.min_candidates = min_candidates
+        self._lock = threading.Lock()
+        self._state = (None, None, None)
+        self.filtered = 0
+        self.relaxed = 0
+        self.unfiltered = 0
+
+    def _ids(self):
+        if self.index.ids is not None:
+            return [str(pid) for pid in self.index.ids]
+        return self.catalog.product_ids()
+
+    @property
+    def bitmaps(self):
+        """Bitmaps for the current catalog version; rebuilt after a catalog refresh"""
+        version, ids, bitmaps = self._state
+        if bitmaps is None or version != self.catalog.version:
+            with self._lock:
+                version, ids, bitmaps = self._state
+                if bitmaps is None or version != self.catalog.version:
+                    version = self.catalog.version
+                    ids = self._ids()
+                    columns = self.catalog.columns()
+                    missing = [attribute for attribute in self.attributes if attribute not in columns]
+                    if missing:
+                        logger.warning(
+                            "Catalog has no %s column(s); webcam searches cannot be filtered by them. "
+                            "Add the columns to the catalog source or change FILTER_ATTRIBUTES",
+                            ', '.join(missing)
+                        )
+                    bitmaps = AttributeBitmaps(ids, {
+                        attribute: self.catalog.values(ids, attribute)
+                        for attribute in self.attributes
+                        if attribute in columns
+                    })
+                    self._state = (version, ids, bitmaps)
+        return bitmaps
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def search(self, embedding, k, filters):
+        """Return (neighbors, applied_filters); applied_filters is empty for an unfiltered search"""
+        requested = [
+            attribute for attribute in self.attributes
+            if normalize_value(filters.get(attribute)) not in UNKNOWN_VALUES
+        ]
+        bitmaps = self.bitmaps
+        active = {}
+        for attribute in requested:
+            value = bitmaps.resolve(attribute, filters.get(attribute))
+            if value is not None:
+                active[attribute] = value
+        needed = max(k, self.min_candidates)
+
+        while active:
+            rows = bitmaps.rows(active)
+            if len(rows) >= needed:
+                self._count('filtered' if len(active) == len(requested) else 'relaxed')
+                return self.index.search_subset(embedding, k, rows=rows, filters=active), active
+            logger.info("Only %d products match %s; relaxing", len(rows), active)
+            active.pop(next(reversed(active)))
+        if requested:
+            self._count('unfiltered')
+        return self.index.search(embedding, k), {}
+
+    def stats(self):
+        with self._lock:
+            return {
+                'filtered': self.filtered,
+                'relaxed': self.relaxed,
+                'unfiltered': self.unfiltered
+            }
@@ -1,34 +1,62 @@
+import logging
 from google.cloud import bigquery
+import math
 import re
 import numpy as np
 from google.cloud import storage
+from .signed_urls import SignedUrlProvider
+
+logger = logging.getLogger(__name__)
 
 class BigQueryService:
-    def __init__(self, project_id, dataset):
+    def __init__(self, project_id, dataset, client=None, storage_client=None,
+                 vector_search_mode='dot', embeddings_table='product_embeddings_normalized',
+                 vector_store=None, url_signer=None, catalog=None, filtered_search=None, upstream=None):
         self.project_id = project_id
         self.dataset = dataset
-        self.client = bigquery.Client(project=project_id)
-        self.storage_client = storage.Client(project=project_id)
+        # 'dot' ranks by dot product over normalized vectors; 'native' uses VECTOR_SEARCH
+        self.vector_search_mode = vector_search_mode
+        self.embeddings_table = embeddings_table
+        self.client = client or bigquery.Client(project=project_id)
+        self.storage_client = storage_client or storage.Client(project=project_id)
+        # Optional local stand-in (see LocalProductEmbeddings) used instead of BigQuery
+        self.vector_store = vector_store
+        self.url_signer = url_signer or SignedUrlProvider(self.storage_client)
+        # Optional ProductCatalog snapshot that answers get_product_info in memory
+        self.catalog = catalog
+        # Optional FilteredSearch used by search_products_with_filters
+        self.filtered_search = filtered_search
+        # Optional resilience.Upstream guarding the request-path queries
+        self.upstream = upstream
 
-    def get_signed_urls(self, urls):
-        """Get signed URLs for GCS images"""
-        # Convert the list of URIs into a string for the IN clause
-        uris = [re.search(r'"(gs://[^"]+)"', item).group(1) for item in urls]
-        uri_string = ", ".join([f"'{uri}'" for uri in uris])
-        
-        query = f"""
-        SELECT signed_url
-        FROM EXTERNAL_OBJECT_TRANSFORM(TABLE `raves-altostrat.{self.dataset}.product_images`, ['SIGNED_URL'])
-        WHERE uri IN ({uri_string})
-        """
+    def _query(self, query, job_config=None):
+        """Rows of a request-path query, run through the upstream guard when there is one"""
+        if self.upstream is None:
+            return self.client.query(query, job_config=job_config).result()
+        timeout = self.upstream.timeout
+        return self.upstream.call(
+            lambda: list(self.client.query(query, job_config=job_config).result(timeout=timeout))
+        )
 
-        query_job = self.client.query(query)
-        results = query_job.result()
-        
-        return [row.signed_url for row in results]
+    def get_signed_urls(self, urls):
+        """Get signed URLs for GCS images, in the same order as urls"""
+        # Accepts plain URIs as well as quoted feature store values; anything
+        # without a gs:// URI (e.g. a snapshot without image URIs) is passed
+        # through unsigned, as the search routes do
+        uris = []
+        for item in urls:
+            match = re.search(r'(gs://[^"\s]+)', item or '')
+            uris.append(match.group(1) if match else item or '')
+        return self.url_signer.sign_many(uris)
 
     def get_product_info(self, product_ids):
         """Get product information - only aisle information is available"""
+        if self.catalog is not None:
+            return {
+                str(pid): {'aisle': self.catalog.get(pid, 'aisle', 'Unknown')}
+                for pid in product_ids
+            }
+
         # Convert product IDs to integers
         product_id_list = [int(pid) for pid in product_ids]
         
@@ -39,8 +67,7 @@ class BigQueryService:
         WHERE p.productid IN ({','.join(map(str, product_id_list))})
         """
         
-        query_job = self.client.query(query)
-        results = query_job.result()
+        results = self._query(query)
         
         product_info = {}
         for row in results:
@@ -76,70 +103,124 @@ class BigQueryService:
             
         return product_details
 
-    def search_products(self, embeddings, k=5):
-        """Search for products using embeddings."""
-        try:
-            # Convert embeddings to string format for BigQuery
-            embedding_str = ','.join(map(str, embeddings))
-            
-            query = f"""
-            WITH similarities AS (
-                SELECT 
-                    product_id,
-                    image_uri,
-                    aisle,
-                    (
-                        SELECT 
-                            1 - ACOS(LEAST(1.0, GREATEST(-1.0, 
-                                SUM(e1 * e2) / SQRT(SUM(e1 * e1) * SUM(e2 * e2))
-                            ))) / PI()
-                        FROM UNNEST(embedding) e1 WITH OFFSET pos
-                        CROSS JOIN UNNEST([{embedding_str}]) e2 WITH OFFSET pos2
-                        WHERE pos = pos2
-                    ) as similarity
-                FROM `{self.project_id}.{self.dataset}.product_embeddings`
+    def prepare_vector_search(self):
+        """Materialize unit-length embeddings and (for native mode) a vector index.
+
+        Run once after product_embeddings is (re)loaded; search_products reads
+        the normalized table so each query is a plain dot product.
+        """
+        source = f"`{self.project_id}.{self.dataset}.product_embeddings`"
+        target = f"`{self.project_id}.{self.dataset}.{self.embeddings_table}`"
+        self.client.query(f"""
+        CREATE OR REPLACE TABLE {target} AS
+        SELECT
+            product_id,
+            image_uri,
+            aisle,
+            ARRAY(SELECT e / norm FROM UNNEST(embedding) e WITH OFFSET pos ORDER BY pos) AS embedding
+        FROM (
+            SELECT *, SQRT((SELECT SUM(e * e) FROM UNNEST(embedding) e)) AS norm
+            FROM {source}
+        )
+        WHERE norm > 0
+        """).result()
+
+        if self.vector_search_mode == 'native':
+            self.client.query(f"""
+            CREATE VECTOR INDEX IF NOT EXISTS {self.embeddings_table}_index
+            ON {target}(embedding)
+            OPTIONS(index_type = 'IVF', distance_type = 'COSINE')
+            """).result()
+
+    def _vector_search_query(self):
+        table = f"`{self.project_id}.{self.dataset}.{self.embeddings_table}`"
+        if self.vector_search_mode == 'native':
+            return f"""
+            SELECT
+                base.product_id AS product_id,
+                base.image_uri AS image_uri,
+                base.aisle AS aisle,
+                1 - distance AS similarity
+            FROM VECTOR_SEARCH(
+                TABLE {table}, 'embedding',
+                (SELECT @query AS embedding),
+                top_k => @k,
+                distance_type => 'COSINE'
             )
-            SELECT 
-                product_id,
-                image_uri,
-                aisle,
-                ROUND(similarity * 100, 2) as similarity_score
-            FROM similarities
-            WHERE similarity > 0
             ORDER BY similarity DESC
-            LIMIT {k}
             """
-            
-            query_job = self.client.query(query)
-            results = query_job.result()
+        # Stored vectors are unit length, so the cosine is a single O(d) dot product
+        return f"""
+        SELECT
+            product_id,
+            image_uri,
+            aisle,
+            (SELECT SUM(e * @query[OFFSET(pos)]) FROM UNNEST(embedding) e WITH OFFSET pos) AS similarity
+        FROM {table}
+        ORDER BY similarity DESC
+        LIMIT @k
+        """
+
+    def _run_vector_search(self, query_vector, k):
+        if self.vector_store is not None:
+            return self.vector_store.search(query_vector, k)
+
+        job_config = bigquery.QueryJobConfig(query_parameters=[
+            bigquery.ArrayQueryParameter('query', 'FLOAT64', query_vector),
+            bigquery.ScalarQueryParameter('k', 'INT64', k)
+        ])
+        return self._query(self._vector_search_query(), job_config=job_config)
+
+    def search_products(self, embeddings, k=5):
+        """Search for products using embeddings."""
+        try:
+            query_vector = np.asarray(embeddings, dtype=np.float64)
+            norm = np.linalg.norm(query_vector)
+            if norm == 0:
+                raise ValueError("Query embedding has zero length")
+            query_vector = (query_vector / norm).tolist()
+
+            results = self._run_vector_search(query_vector, k)
             
             # Process results
-            processed_results = []
+            rows = []
             for row in results:
-                # Get signed URL for the image
-                image_uri = row.image_uri
-                if image_uri.startswith('gs://'):
-                    bucket_name = image_uri.split('/')[2]
-                    blob_name = '/'.join(image_uri.split('/')[3:])
-                    bucket = self.storage_client.bucket(bucket_name)
-                    blob = bucket.blob(blob_name)
-                    signed_url = blob.generate_signed_url(
-                        version="v4",
-                        expiration=3600,  # URL expires in 1 hour
-                        method="GET"
-                    )
-                else:
-                    signed_url = image_uri
-                
+                # Angular similarity in [0, 1], computed only for the k returned rows
+                cosine = max(-1.0, min(1.0, row.similarity))
+                similarity = 1 - math.acos(cosine) / math.pi
+                if similarity > 0:
+                    rows.append((row, similarity))
+
+            # Sign all image URLs in one pass
+            signed_urls = self.url_signer.sign_many([row.image_uri for row, _ in rows])
+
+            processed_results = []
+            for (row, similarity), signed_url in zip(rows, signed_urls):
                 processed_results.append({
                     'product_id': row.product_id,
                     'product_image_url': signed_url,
                     'aisle_location': row.aisle,
-                    'similarity_score': row.similarity_score
+                    'similarity_score': round(similarity * 100, 2)
                 })
             
             return processed_results
             
         except Exception as e:
-            print(f"Error in search_products: {str(e)}")
-            raise 
\ No newline at end of file
+            logger.error("Error in search_products: %s", e)
+            raise
+
+    def search_products_with_filters(self, embedding, apparel_type=None, color=None, gender=None, k=10):
+        """(product details, applied filters) for the nearest products restricted to the given attributes.
+
+        Attributes that are empty or unknown are ignored; when too few products
+        match, filters are relaxed down to an unfiltered search.
+        """
+        if self.filtered_search is None:
+            raise ValueError("No filtered search configured for BigQueryService")
+
+        neighbors, applied = self.filtered_search.search(
+            embedding, k,
+            {'apparel_type': apparel_type, 'color': color, 'gender': gender}
+        )
+        logger.debug("Filtered search applied %s", applied or 'no filters')
+        return self.get_product_details(neighbors), applied
@@ -0,0 +1,225 @@
+import csv
+import hashlib
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class BigQueryCatalogLoader:
+    """Reads product rows from the product_qty table.
+
+    With an updated_column the refresh only fetches rows changed since the
+    last watermark; without one every refresh is a full reload.
+    """
+
+    def __init__(self, client, table, updated_column=None):
+        self.client = client
+        self.table = table
+        self.updated_column = updated_column
+
+    def load(self, watermark=None):
+        """Return (rows, new_watermark, is_full_reload)"""
+        from google.cloud import bigquery
+
+        if self.updated_column and watermark is not None:
+            query = f"SELECT * FROM `{self.table}` WHERE {self.updated_column} > @watermark"
+            job_config = bigquery.QueryJobConfig(query_parameters=[
+                bigquery.ScalarQueryParameter('watermark', 'TIMESTAMP', watermark)
+            ])
+            full = False
+        else:
+            query = f"SELECT * FROM `{self.table}`"
+            job_config = None
+            full = True
+
+        rows = [dict(row.items()) for row in self.client.query(query, job_config=job_config).result()]
+        if self.updated_column:
+            stamps = [row[self.updated_column] for row in rows if row.get(self.updated_column) is not None]
+            if stamps:
+                watermark = max(stamps)
+        return rows, watermark, full
+
+
+class FileCatalogLoader:
+    """Reads product rows from a local CSV or Parquet export; reloads when the file changes"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def _read(self):
+        if self.path.endswith('.parquet'):
+            try:
+                import pyarrow.parquet as pq
+            except ImportError:
+                raise ValueError(
+                    f"CATALOG_SOURCE {self.path} is a Parquet file, which needs pyarrow "
+                    "(pip install pyarrow); use a CSV export otherwise"
+                )
+            return pq.read_table(self.path).to_pylist()
+        with open(self.path, newline='') as f:
+            return list(csv.DictReader(f))
+
+    def load(self, watermark=None):
+        mtime = os.path.getmtime(self.path)
+        if watermark is not None and mtime <= watermark:
+            return [], watermark, False
+        return self._read(), mtime, True
+
+
+class ProductCatalog:
+    """Per-worker, array-backed snapshot of product attributes keyed by product id.
+
+    Each attribute is a column list and a dict maps product id to row number,
+    so a lookup is two O(1) indexing operations. Refreshes build a new table
+    (a copy of the current one for incremental updates) and swap it in with a
+    single assignment, so readers never see a half-applied refresh.
+    """
+
+    def __init__(self, loader, key_column='productid', refresh_interval=300):
+        self.loader = loader
+        self.key_column = key_column
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._table = ({}, {})
+        self._watermark = None
+        self._digest = None
+        self._thread = None
+        self._stop = threading.Event()
+        # Bumped only when the content changes; caches keyed on it survive no-op refreshes
+        self.version = 0
+        self.loaded_at = None
+
+    def __len__(self):
+        return len(self._table[0])
+
+    def _build(self, rows, base=None):
+        if base is None:
+            index, columns = {}, {}
+        else:
+            index = dict(base[0])
+            columns = {name: list(column) for name, column in base[1].items()}
+        self._upsert(index, columns, rows)
+        return index, columns
+
+    def _upsert(self, index, columns, rows):
+        for row in rows:
+            key = str(row[self.key_column])
+            position = index.get(key)
+            if position is None:
+                position = len(index)
+                index[key] = position
+                for column in columns.values():
+                    column.append(None)
+            for name, value in row.items():
+                column = columns.get(name)
+                if column is None:
+                    column = columns[name] = [None] * len(index)
+                column[position] = value
+
+    @staticmethod
+    def _table_digest(table):
+        """Hash of every row's values, independent of the order rows were loaded in"""
+        index, columns = table
+        names = sorted(columns)
+        digest = hashlib.sha256('\x1f'.join(names).encode('utf-8'))
+        for key in sorted(index):
+            position = index[key]
+            digest.update(repr([key] + [columns[name][position] for name in names]).encode('utf-8'))
+        return digest.hexdigest()
+
+    def refresh(self):
+        """Pull new or changed rows from the loader; returns the number applied"""
+        rows, watermark, full = self.loader.load(self._watermark)
+        with self._lock:
+            # Readers never take the lock; it only keeps concurrent refreshes apart
+            if full:
+                table = self._build(rows)
+            elif rows:
+                table = self._build(rows, base=self._table)
+            else:
+                table = None
+            digest = self._table_digest(table) if table is not None else None
+            if table is not None and digest != self._digest:
+                self._table = table
+                self._digest = digest
+                self.version += 1
+            self._watermark = watermark
+            self.loaded_at = time.time()
+        return len(rows)
+
+    def lookup(self, product_id, default=None):
+        """All attributes for product_id as a dict, or default when unknown"""
+        rows, columns = self._table
+        position = rows.get(str(product_id))
+        if position is None:
+            return default
+        return {name: column[position] for name, column in columns.items()}
+
+    def get(self, product_id, attribute, default=None):
+        """A single attribute for product_id"""
+        rows, columns = self._table
+        position = rows.get(str(product_id))
+        column = columns.get(attribute)
+        if position is None or column is None:
+            return default
+        value = column[position]
+        return default if value is None else value
+
+    def lookup_many(self, product_ids):
+        return {str(pid): self.lookup(pid) for pid in product_ids}
+
+    def product_ids(self):
+        return list(self._table[0])
+
+    def columns(self):
+        return set(self._table[1])
+
+    def values(self, product_ids, attribute, default=None):
+        """One attribute for each of product_ids, in order, read from a single snapshot"""
+        rows, columns = self._table
+        column = columns.get(attribute)
+        if column is None:
+            return [default] * len(product_ids)
+        values = []
+        for pid in product_ids:
+            position = rows.get(str(pid))
+            values.append(default if position is None else column[position])
+        return values
+
+    def start_background_refresh(self):
+        """Refresh on a daemon thread every refresh_interval seconds"""
+        if self._thread is not None or self.refresh_interval <= 0:
+            return
+        self._thread = threading.Thread(target=self._refresh_loop, name='catalog-refresh', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _refresh_loop(self):
+        while not self._stop.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("Catalog refresh failed; keeping the previous snapshot")
+
+
+def create_catalog(config, bigquery_client_factory):
+    """Build and load the catalog from CATALOG_SOURCE ('bigquery' or a CSV/Parquet path)"""
+    source = config.get('CATALOG_SOURCE') or 'bigquery'
+    if source == 'bigquery':
+        table = f"{config.get('GOOGLE_CLOUD_PROJECT')}.{config.get('BIGQUERY_DATASET')}.product_qty"
+        loader = BigQueryCatalogLoader(
+            bigquery_client_factory(), table,
+            updated_column=config.get('CATALOG_UPDATED_COLUMN') or None
+        )
+    else:
+        loader = FileCatalogLoader(source)
+
+    catalog = ProductCatalog(loader, refresh_interval=float(config.get('CATALOG_REFRESH_INTERVAL', 300)))
+    catalog.refresh()
+    catalog.start_background_refresh()
+    return catalog
@@ -0,0 +1,223 @@
+import base64
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+
+def normalize_text(text):
+    """Normalize a text query so trivially different spellings share a cache entry"""
+    if not text:
+        return ''
+    return ' '.join(text.lower().split())
+
+
+def image_content_hash(image_data):
+    """SHA-256 of the decoded image bytes; accepts a PreparedImage, raw bytes or a base64/data-URL string"""
+    if not image_data:
+        return ''
+    if hasattr(image_data, 'content_hash'):
+        return image_data.content_hash
+    if isinstance(image_data, str):
+        if ',' in image_data:
+            image_data = image_data.split(',', 1)[1]
+        image_data = base64.b64decode(image_data)
+    return hashlib.sha256(image_data).hexdigest()
+
+
+class SQLiteEmbeddingStore:
+    """Disk-backed embedding tier shared by every worker on the host.
+
+    Expired rows are purged when the store is opened and every
+    maintenance_interval puts; the oldest rows beyond max_rows go at the
+    same time, so the file stays bounded.
+    """
+
+    def __init__(self, path, ttl, max_rows=100000, maintenance_interval=1000):
+        self.path = path
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self.maintenance_interval = max(1, maintenance_interval)
+        self._puts = 0
+        self._puts_lock = threading.Lock()
+        self._local = threading.local()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        conn = self._connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, created_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS embeddings_created_at ON embeddings (created_at)")
+        conn.commit()
+        self.maintain()
+
+    def _connection(self):
+        # One connection per thread and per process; sqlite handles must not cross a fork
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        row = self._connection().execute(
+            "SELECT vector, created_at FROM embeddings WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None or time.time() - row[1] > self.ttl:
+            return None
+        vector = array('f')
+        vector.frombytes(row[0])
+        return vector
+
+    def put(self, key, vector):
+        conn = self._connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO embeddings (key, vector, created_at) VALUES (?, ?, ?)",
+            (key, vector.tobytes(), time.time())
+        )
+        conn.commit()
+        with self._puts_lock:
+            self._puts += 1
+            due = self._puts % self.maintenance_interval == 0
+        if due:
+            self.maintain()
+
+    def maintain(self):
+        """Purge expired rows, then evict the oldest rows over max_rows"""
+        self.purge_expired()
+        if not self.max_rows:
+            return
+        conn = self._connection()
+        conn.execute(
+            "DELETE FROM embeddings WHERE key IN ("
+            "SELECT key FROM embeddings ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_rows,)
+        )
+        conn.commit()
+
+    def purge_expired(self):
+        conn = self._connection()
+        conn.execute("DELETE FROM embeddings WHERE created_at < ?", (time.time() - self.ttl,))
+        conn.commit()
+
+    def clear(self):
+        conn = self._connection()
+        conn.execute("DELETE FROM embeddings")
+        conn.commit()
+
+
+class EmbeddingCache:
+    """Bounded LRU/TTL cache for query embeddings with an optional SQLite tier.
+
+    Vectors are held as float32 arrays so the memory budget is predictable;
+    callers always get a fresh list of floats back.
+    """
+
+    def __init__(self, max_entries=10000, ttl=86400, max_bytes=64 * 1024 * 1024, disk_path=None,
+                 disk_max_rows=100000):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk = SQLiteEmbeddingStore(disk_path, ttl, max_rows=disk_max_rows) if disk_path else None
+
+    @staticmethod
+    def make_key(model_name, text=None, image_hash=None):
+        """Cache key from the model, the normalized text and the image content hash"""
+        raw = f"{model_name}\x1f{normalize_text(text)}\x1f{image_hash or ''}"
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, vector = entry
+                if now < expires_at:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return vector.tolist()
+                self._remove(key)
+
+        if self.disk is not None:
+            try:
+                vector = self.disk.get(key)
+            except sqlite3.Error:
+                vector = None
+            if vector is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                    self._insert(key, vector)
+                return vector.tolist()
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, embedding):
+        vector = array('f', embedding)
+        with self._lock:
+            self._insert(key, vector)
+        if self.disk is not None:
+            try:
+                self.disk.put(key, vector)
+            except sqlite3.Error:
+                pass
+
+    def get_or_compute(self, key, compute):
+        """Return the cached embedding for key, calling compute() on a miss"""
+        embedding = self.get(key)
+        if embedding is None:
+            embedding = list(compute())
+            self.put(key, embedding)
+        return embedding
+
+    def _insert(self, key, vector):
+        if key in self._entries:
+            self._remove(key)
+        size = len(vector) * vector.itemsize
+        if size > self.max_bytes:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, vector)
+        self.current_bytes += size
+        while len(self._entries) > self.max_entries or self.current_bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key):
+        _, vector = self._entries.pop(key)
+        self.current_bytes -= len(vector) * vector.itemsize
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+        if self.disk is not None:
+            self.disk.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': (self.hits + self.disk_hits) / lookups if lookups else 0.0
+            }
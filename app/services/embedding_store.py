@@ -0,0 +1,208 @@
+import json
+import mmap
+import os
+import struct
+
+import numpy as np
+
+from .vector_index import VectorIndex, normalize_rows, snapshot_version, top_k
+
+MAGIC = b'PRODEMB1'
+HEADER_SIZE = 4096
+ALIGNMENT = 64
+DTYPES = {'int8': np.int8, 'float16': np.float16}
+# Rows converted to float32 at a time while scanning the quantized matrix
+SCAN_CHUNK = 4096
+
+
+def _string_table(values):
+    encoded = [str(value).encode('utf-8') for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(value) for value in encoded])
+    return offsets, b''.join(encoded)
+
+
+def quantize(embeddings, dtype):
+    """(quantized matrix, per-row scales or None) for unit-length rows"""
+    if dtype == 'float16':
+        return embeddings.astype(np.float16), None
+    # Symmetric per-row int8: each row keeps its own scale, so no row loses range to another
+    scales = np.abs(embeddings).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    quantized = np.clip(np.rint(embeddings / scales[:, None]), -127, 127).astype(np.int8)
+    return quantized, scales.astype(np.float32)
+
+
+def write_embedding_store(path, ids, embeddings, gcs_uris=None, dtype='int8', include_full=True):
+    """Write normalized embeddings as a memory-mappable store.
+
+    Layout: an 8-byte magic, a uint32 header length and a JSON header in the
+    first 4 KiB, then 64-byte aligned sections: the id and image URI string
+    tables, int8 row scales, the quantized matrix and (with include_full)
+    the float32 matrix used to re-rank candidates exactly.
+    """
+    if dtype not in DTYPES:
+        raise ValueError(f"Unsupported embedding store dtype: {dtype}")
+    embeddings = normalize_rows(embeddings)
+    if len(ids) != embeddings.shape[0]:
+        raise ValueError("ids and embeddings have different lengths")
+    quantized, scales = quantize(embeddings, dtype)
+
+    sections = {}
+    sections['id_offsets'], sections['id_data'] = _string_table(ids)
+    if gcs_uris is not None:
+        sections['uri_offsets'], sections['uri_data'] = _string_table(gcs_uris)
+    if scales is not None:
+        sections['scales'] = scales
+    sections['vectors'] = quantized
+    if include_full:
+        sections['full'] = embeddings
+
+    layout = {}
+    position = HEADER_SIZE
+    for name, data in sections.items():
+        size = len(data) if isinstance(data, bytes) else data.nbytes
+        layout[name] = [position, size]
+        position += (size + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+    header = json.dumps({
+        'count': int(embeddings.shape[0]),
+        'dimensions': int(embeddings.shape[1]),
+        'dtype': dtype,
+        'sections': layout
+    }).encode('utf-8')
+    if len(MAGIC) + 4 + len(header) > HEADER_SIZE:
+        raise ValueError("Embedding store header does not fit")
+
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as f:
+        f.write(MAGIC + struct.pack('<I', len(header)) + header)
+        for name, data in sections.items():
+            f.seek(layout[name][0])
+            f.write(data if isinstance(data, bytes) else np.ascontiguousarray(data).tobytes())
+        f.truncate(position)
+    os.replace(temporary, path)
+
+
+class MappedEmbeddingStore:
+    """Read-only view of a store file; every array is backed by the shared page cache.
+
+    Nothing is copied when opening, so a worker starts instantly and all
+    workers on a host share one physical copy of the matrix.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not an embedding store")
+        (length,) = struct.unpack_from('<I', self._map, len(MAGIC))
+        header = json.loads(self._map[len(MAGIC) + 4:len(MAGIC) + 4 + length])
+        self.count = header['count']
+        self.dimensions = header['dimensions']
+        self.dtype = header['dtype']
+        self._sections = header['sections']
+
+        self.vectors = self._array('vectors', DTYPES[self.dtype], (self.count, self.dimensions))
+        self.scales = self._array('scales', np.float32, (self.count,))
+        self.full = self._array('full', np.float32, (self.count, self.dimensions))
+        self._id_offsets = self._array('id_offsets', np.int64, (self.count + 1,))
+        self._uri_offsets = self._array('uri_offsets', np.int64, (self.count + 1,))
+
+    def _array(self, name, dtype, shape):
+        if name not in self._sections:
+            return None
+        offset, _ = self._sections[name]
+        return np.frombuffer(self._map, dtype=dtype, count=int(np.prod(shape)), offset=offset).reshape(shape)
+
+    def _string(self, table, offsets, row):
+        start = self._sections[table][0]
+        return self._map[start + offsets[row]:start + offsets[row + 1]].decode('utf-8')
+
+    def product_id(self, row):
+        return self._string('id_data', self._id_offsets, row)
+
+    def gcs_uri(self, row):
+        if self._uri_offsets is None:
+            return ''
+        return self._string('uri_data', self._uri_offsets, row)
+
+    def approximate_scores(self, query, rows=None):
+        """Scores of the (optionally given) rows computed on the quantized matrix"""
+        if rows is not None:
+            scores = self.vectors[rows].astype(np.float32) @ query
+            return scores * self.scales[rows] if self.scales is not None else scores
+
+        scores = np.empty(self.count, dtype=np.float32)
+        for start in range(0, self.count, SCAN_CHUNK):
+            block = self.vectors[start:start + SCAN_CHUNK]
+            scores[start:start + len(block)] = block.astype(np.float32) @ query
+        if self.scales is not None:
+            scores *= self.scales
+        return scores
+
+    def exact_scores(self, query, rows):
+        """float32 scores of rows; dequantized when the store has no full matrix"""
+        if self.full is not None:
+            return self.full[rows] @ query
+        vectors = self.vectors[rows].astype(np.float32)
+        if self.scales is not None:
+            vectors *= self.scales[rows][:, None]
+        return vectors @ query
+
+
+class MappedIndex(VectorIndex):
+    """Nearest-neighbour search over a MappedEmbeddingStore.
+
+    The quantized matrix is scanned for the rerank * k best candidates,
+    which are then re-scored exactly in float32.
+    """
+
+    def __init__(self, store, rerank=4):
+        self.store = store
+        self.rerank = max(1, rerank)
+        self._ids = None
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        index = cls(MappedEmbeddingStore(path), **kwargs)
+        index.version = snapshot_version(path)
+        return index
+
+    @property
+    def ids(self):
+        # Decoded only when needed (e.g. for attribute bitmaps)
+        if self._ids is None:
+            self._ids = [self.store.product_id(row) for row in range(self.store.count)]
+        return self._ids
+
+    @property
+    def dimensions(self):
+        return self.store.dimensions
+
+    def __len__(self):
+        return self.store.count
+
+    def _rerank(self, query, candidates, k):
+        scores = self.store.exact_scores(query, candidates)
+        best = top_k(scores, k)
+        return [
+            {
+                'product_id': self.store.product_id(row),
+                'gcs_uri': self.store.gcs_uri(row),
+                'score': float(score)
+            }
+            for row, score in zip(candidates[best], scores[best])
+        ]
+
+    def search(self, embedding, k):
+        query = normalize_rows(embedding)
+        approximate = self.store.approximate_scores(query)
+        return self._rerank(query, top_k(approximate, k * self.rerank), k)
+
+    def search_subset(self, embedding, k, rows=None, filters=None):
+        query = normalize_rows(embedding)
+        rows = np.asarray(rows, dtype=np.int64)
+        approximate = self.store.approximate_scores(query, rows)
+        return self._rerank(query, rows[top_k(approximate, k * self.rerank)], k)
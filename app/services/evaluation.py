@@ -0,0 +1,198 @@
+import json
+import logging
+import time
+
+import numpy as np
+
+from .image_pipeline import PreparedImage
+from .signed_urls import split_gcs_uri
+from .vector_index import normalize_rows, top_k
+
+logger = logging.getLogger(__name__)
+
+PERCENTILES = (50, 95, 99)
+# Short backend parameter names accepted in --backends, and the setting each one overrides
+PARAMETERS = {
+    'path': 'VECTOR_INDEX_PATH',
+    'nlist': 'IVF_NLIST',
+    'nprobe': 'IVF_NPROBE',
+    'rerank': 'MMAP_RERANK',
+    # Not a setting: eval-index fits a projection of this size for the run
+    'dimensions': 'REDUCED_DIMENSIONS',
+    'candidates': 'REDUCED_CANDIDATES',
+    'projection': 'REDUCED_PROJECTION_PATH'
+}
+
+
+def parse_backends(value):
+    """'bruteforce,ivf:nprobe=4:nlist=256' -> [('ivf:nprobe=4:nlist=256', 'ivf', {'IVF_NPROBE': '4', ...})]"""
+    backends = []
+    for item in value.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        name, *params = item.split(':')
+        overrides = {}
+        for param in params:
+            key, _, setting = param.partition('=')
+            if key not in PARAMETERS:
+                raise ValueError(f"Unknown backend parameter: {key}")
+            overrides[PARAMETERS[key]] = setting
+        backends.append((item, name, overrides))
+    return backends
+
+
+def read_query_log(path):
+    """(text, image reference) pairs from a JSON-lines log of {"query": ..., "image": ...} entries.
+
+    Either field may be missing; image is a local path or a gs:// URI.
+    """
+    entries = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if entry.get('query') or entry.get('image'):
+                entries.append((entry.get('query') or None, entry.get('image') or None))
+    return entries
+
+
+def embed_queries(embedder, entries, storage_client_factory=None):
+    """Embed logged queries with the same model and preprocessing as /api/search"""
+    embeddings = []
+    for text, reference in entries:
+        image = None
+        if reference:
+            if reference.startswith('gs://'):
+                bucket_name, name = split_gcs_uri(reference)
+                data = storage_client_factory().bucket(bucket_name).blob(name).download_as_bytes()
+            else:
+                with open(reference, 'rb') as f:
+                    data = f.read()
+            image = PreparedImage(data)
+        embeddings.append(embedder.get_image_embeddings(image_data=image, contextual_text=text))
+    return np.asarray(embeddings, dtype=np.float32)
+
+
+def exact_neighbors(embeddings, queries, k, chunk=1024):
+    """(rows, scores) of the exact top-k for every query, best first; both (queries, k) arrays"""
+    embeddings = normalize_rows(embeddings)
+    queries = normalize_rows(queries)
+    k = min(k, embeddings.shape[0])
+    rows = np.empty((len(queries), k), dtype=np.int64)
+    scores = np.empty((len(queries), k), dtype=np.float32)
+    for start in range(0, len(queries), chunk):
+        block = queries[start:start + chunk] @ embeddings.T
+        best = np.argpartition(-block, k - 1, axis=1)[:, :k]
+        best_scores = np.take_along_axis(block, best, axis=1)
+        order = np.argsort(-best_scores, axis=1, kind='stable')
+        rows[start:start + len(block)] = np.take_along_axis(best, order, axis=1)
+        scores[start:start + len(block)] = np.take_along_axis(best_scores, order, axis=1)
+    return rows, scores
+
+
+def ndcg(gains, ideal_gains):
+    """Normalized discounted cumulative gain of gains (in result order) against the ideal order"""
+    discounts = 1.0 / np.log2(np.arange(2, len(ideal_gains) + 2))
+    ideal = float(np.dot(np.clip(ideal_gains, 0, None), discounts))
+    if ideal <= 0:
+        return 1.0
+    gains = np.clip(np.asarray(gains, dtype=np.float32), 0, None)
+    return float(np.dot(gains, discounts[:len(gains)])) / ideal
+
+
+def percentiles(values):
+    points = np.percentile(np.asarray(values), PERCENTILES) if values else [None] * len(PERCENTILES)
+    return {f'p{p}': None if point is None else float(point) for p, point in zip(PERCENTILES, points)}
+
+
+class Evaluation:
+    """Recall@k, nDCG@k, QPS and latency of vector index backends against exact search.
+
+    Ground truth is the exact cosine top-k over the snapshot. Each result's
+    nDCG gain is its exact similarity to the query, so a near miss costs
+    less than an unrelated product.
+    """
+
+    def __init__(self, ids, embeddings, queries):
+        self.ids = np.asarray(ids, dtype=str)
+        self.rows_by_id = {product_id: row for row, product_id in enumerate(self.ids)}
+        self.embeddings = normalize_rows(embeddings)
+        self.queries = normalize_rows(queries)
+        self._truth = {}
+
+    def truth(self, k):
+        if k not in self._truth:
+            self._truth[k] = exact_neighbors(self.embeddings, self.queries, k)
+        return self._truth[k]
+
+    def _gains(self, query, product_ids):
+        rows = [self.rows_by_id.get(product_id) for product_id in product_ids]
+        return [float(self.embeddings[row] @ query) if row is not None else 0.0 for row in rows]
+
+    def run(self, label, index, k):
+        truth_rows, truth_scores = self.truth(k)
+        recalls, ndcgs, latencies = [], [], []
+        errors = 0
+        start = time.perf_counter()
+        for query, expected, ideal in zip(self.queries, truth_rows, truth_scores):
+            began = time.perf_counter()
+            try:
+                results = index.search(query, k)
+            except Exception as e:
+                errors += 1
+                logger.warning("%s search failed: %s", label, e)
+                continue
+            latencies.append(time.perf_counter() - began)
+            found = [result['product_id'] for result in results[:k]]
+            recalls.append(len(set(found) & set(self.ids[expected])) / len(expected))
+            ndcgs.append(ndcg(self._gains(query, found), ideal))
+        wall = time.perf_counter() - start
+        return {
+            'backend': label,
+            'k': k,
+            'queries': len(self.queries),
+            'errors': errors,
+            'recall': float(np.mean(recalls)) if recalls else None,
+            'ndcg': float(np.mean(ndcgs)) if ndcgs else None,
+            'qps': len(latencies) / wall if wall else 0.0,
+            'latency': percentiles(latencies)
+        }
+
+    def baseline(self, k):
+        """The exact scan itself, vectorized one query at a time, for comparison"""
+        latencies = []
+        for query in self.queries:
+            began = time.perf_counter()
+            top_k(self.embeddings @ query, k)
+            latencies.append(time.perf_counter() - began)
+        return {
+            'backend': 'exact',
+            'k': k,
+            'queries': len(self.queries),
+            'errors': 0,
+            'recall': 1.0,
+            'ndcg': 1.0,
+            'qps': len(latencies) / sum(latencies) if sum(latencies) else 0.0,
+            'latency': percentiles(latencies)
+        }
+
+
+def format_results(results):
+    def ms(value):
+        return '-' if value is None else f"{value * 1000:.2f}"
+
+    def ratio(value):
+        return '-' if value is None else f"{value:.3f}"
+
+    lines = [f"{'backend':<36}{'k':>4}{'recall':>8}{'ndcg':>8}{'errors':>8}{'qps':>10}"
+             f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"]
+    for row in results:
+        latency = row['latency']
+        lines.append(
+            f"{row['backend']:<36}{row['k']:>4}{ratio(row['recall']):>8}{ratio(row['ndcg']):>8}"
+            f"{row['errors']:>8}{row['qps']:>10.1f}"
+            f"{ms(latency['p50']):>9}{ms(latency['p95']):>9}{ms(latency['p99']):>9}"
+        )
+    return '\n'.join(lines)
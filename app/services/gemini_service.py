@@ -1,57 +1,16 @@
+import hashlib
+import logging
 import os
 import google.generativeai as genai
-from PIL import Image
-import base64
-import io
 import json
+from .image_pipeline import PreparedImage
+from .resilience import CircuitOpenError, DeadlineExceeded
 
-class GeminiService:
-    def __init__(self, api_key):
-        self.api_key = api_key
-        genai.configure(api_key=api_key)
-        # Use Gemini-2.0-Flash
-        self.model = genai.GenerativeModel('gemini-2.0-flash')
-        self.approved_apparels = ['t-shirt', 'shirt', 'sweatshirt', 'hoodie', 'sweater', 'jacket', 'shoes', 'shorts', 'jeans']
+logger = logging.getLogger(__name__)
 
-    def analyze_image(self, image_data):
-        try:
-            print("Starting image analysis with Gemini-2.0-Flash...")
-            
-            # Validate image data
-            if not image_data:
-                raise ValueError("Image data is empty")
-            
-            print("Processing image data...")
-            # Remove data URL prefix if present
-            if ',' in image_data:
-                image_data = image_data.split(',')[1]
-            
-            image_bytes = base64.b64decode(image_data)
-            
-            # Process image with PIL
-            try:
-                pil_image = Image.open(io.BytesIO(image_bytes))
-                # Convert RGBA to RGB if needed
-                if pil_image.mode == 'RGBA':
-                    pil_image = pil_image.convert('RGB')
-                
-                # Resize if too large
-                max_size = 1024
-                if max(pil_image.size) > max_size:
-                    ratio = max_size / max(pil_image.size)
-                    new_size = tuple(int(dim * ratio) for dim in pil_image.size)
-                    pil_image = pil_image.resize(new_size, Image.Resampling.LANCZOS)
-            except Exception as e:
-                print(f"PIL processing error: {str(e)}")
-                raise ValueError(f"Failed to process image: {str(e)}")
-            
-            # Convert PIL image back to bytes for Gemini
-            buffered = io.BytesIO()
-            pil_image.save(buffered, format="JPEG")
-            image_bytes = buffered.getvalue()
-            
-            # Prepare the prompt for Gemini
-            prompt = """
+MODEL_NAME = 'gemini-2.0-flash'
+
+ATTRIBUTE_PROMPT = """
             Look at this image carefully and analyze the clothing in detail:
             1. What is the main type of clothing shown? (e.g., t-shirt, shirt, sweatshirt, hoodie, sweater, jacket, shoes, shorts, jeans)
             2. What is the primary color of the clothing?
@@ -59,9 +18,9 @@ class GeminiService:
             4. Describe any patterns or designs (e.g., striped, checkered, floral, graphic)
             5. Note any distinctive features (e.g., collar type, sleeve length, buttons, zippers)
             6. Identify any visible logos or brands if present
-            
+
             IMPORTANT: For any field where the information is not visible, not applicable, or unknown, simply leave it as an empty string ("") rather than writing phrases like "none", "none visible", "unknown", or "not applicable".
-            
+
             Respond ONLY with a JSON object in this format:
             {
                 "apparel_type": "type of clothing",
@@ -73,126 +32,265 @@ class GeminiService:
                 "brand": "visible brand or logo or empty string if none/unknown"
             }
             """
-            
-            print("Calling Gemini API...")
+
+BATCH_PROMPT = """
+            You are given {count} images, each introduced by its label ("Image 1", "Image 2", ...).
+            Analyze every image separately, following the instructions below for each one.
+            Instead of a single JSON object, respond ONLY with a JSON array of {count} objects,
+            one per image, in the order the images were given.
+            """
+
+# Cached attributes are only valid for the model and prompt that produced them
+PROMPT_VERSION = hashlib.sha256(f"{MODEL_NAME}\x1f{ATTRIBUTE_PROMPT}".encode('utf-8')).hexdigest()[:16]
+
+GENERATION_CONFIG = {
+    "temperature": 0.2,  # Lower temperature for more consistent results
+    "top_p": 0.95,
+    "top_k": 40
+}
+
+SAFETY_SETTINGS = [
+    {
+        "category": "HARM_CATEGORY_HARASSMENT",
+        "threshold": "BLOCK_MEDIUM_AND_ABOVE"
+    },
+    {
+        "category": "HARM_CATEGORY_HATE_SPEECH",
+        "threshold": "BLOCK_MEDIUM_AND_ABOVE"
+    },
+    {
+        "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
+        "threshold": "BLOCK_MEDIUM_AND_ABOVE"
+    },
+    {
+        "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
+        "threshold": "BLOCK_MEDIUM_AND_ABOVE"
+    }
+]
+
+
+def extract_json(response_text, opening='{'):
+    """The JSON part of a model answer; opening is '{' for an object and '[' for an array"""
+    closing = '}' if opening == '{' else ']'
+    json_match = None
+
+    # Try different patterns to extract JSON
+    if '```json' in response_text:
+        json_match = response_text.split('```json')[1].split('```')[0].strip()
+    elif '```' in response_text:
+        json_match = response_text.split('```')[1].split('```')[0].strip()
+    elif opening in response_text and closing in response_text:
+        # Try to extract just the JSON value
+        start = response_text.find(opening)
+        end = response_text.rfind(closing) + 1
+        json_match = response_text[start:end].strip()
+
+    if not json_match:
+        logger.warning("Failed to extract JSON from Gemini response")
+        json_match = response_text  # Try with the whole text as fallback
+    return json_match
+
+
+def normalize_attributes(result):
+    """Lower-case the attributes and blank out 'none'-style placeholders"""
+    # Gemini sometimes answers null (or a number) for a field; treat it as missing
+    for field in ('apparel_type', 'gender', 'color', 'pattern', 'features', 'brand'):
+        if field in result and not isinstance(result[field], str):
+            del result[field]
+
+    # Normalize apparel type
+    if 'apparel_type' in result:
+        result['apparel_type'] = result['apparel_type'].lower().strip()
+    else:
+        result['apparel_type'] = 'unknown'
+
+    # Normalize gender
+    if 'gender' in result:
+        result['gender'] = result['gender'].lower().strip()
+    else:
+        result['gender'] = 'unknown'
+
+    # Normalize color
+    if 'color' in result:
+        result['color'] = result['color'].lower().strip()
+    else:
+        result['color'] = 'unknown'
+
+    # Normalize pattern
+    if 'pattern' in result:
+        result['pattern'] = result['pattern'].lower().strip()
+        if result['pattern'] in ['none', 'solid', 'n/a', 'none visible', 'not visible', 'not applicable']:
+            result['pattern'] = ''
+    else:
+        result['pattern'] = ''
+
+    # Normalize features
+    if 'features' in result:
+        result['features'] = result['features'].lower().strip()
+        if result['features'] in ['none', 'n/a', 'none visible', 'not visible', 'not applicable']:
+            result['features'] = ''
+    else:
+        result['features'] = ''
+
+    # Normalize brand
+    if 'brand' in result:
+        result['brand'] = result['brand'].lower().strip()
+        if result['brand'] in ['none', 'not visible', 'n/a', 'none visible', 'unknown', 'not applicable']:
+            result['brand'] = ''
+    else:
+        result['brand'] = ''
+
+    return result
+
+
+def unavailable(error):
+    return {
+        'error': 'Image analysis unavailable',
+        'details': str(error),
+        'unavailable': True
+    }
+
+
+class GeminiService:
+    def __init__(self, api_key, upstream=None, cache=None, batch_size=8):
+        self.api_key = api_key
+        # Optional resilience.Upstream guarding generate_content
+        self.upstream = upstream
+        # Optional ResultCache of attributes keyed by image content hash (see PROMPT_VERSION)
+        self.cache = cache
+        # Images sent together in one generate_content call by analyze_images
+        self.batch_size = max(1, batch_size)
+        genai.configure(api_key=api_key)
+        # Use Gemini-2.0-Flash
+        self.model = genai.GenerativeModel(MODEL_NAME)
+        self.approved_apparels = ['t-shirt', 'shirt', 'sweatshirt', 'hoodie', 'sweater', 'jacket', 'shoes', 'shorts', 'jeans']
+
+    def _generate(self, **kwargs):
+        if self.upstream is None:
+            return self.model.generate_content(**kwargs)
+        # google-generativeai 0.3.x has no per-call timeout (request_options would be
+        # rejected as a request field), so Upstream.call stops waiting at the timeout
+        return self.upstream.call(lambda: self.model.generate_content(**kwargs))
+
+    def _request(self, prompt, images, labelled=False):
+        parts = [{"text": prompt}]
+        for number, image in enumerate(images, 1):
+            if labelled:
+                parts.append({"text": f"Image {number}:"})
+            parts.append({"inline_data": {"mime_type": "image/jpeg", "data": image.jpeg_bytes()}})
+        return self._generate(
+            contents=[{"parts": parts}],
+            generation_config=GENERATION_CONFIG,
+            safety_settings=SAFETY_SETTINGS
+        )
+
+    def _cached(self, image):
+        if self.cache is None:
+            return None
+        result = self.cache.get(image.content_hash, PROMPT_VERSION)
+        return dict(result) if result is not None else None
+
+    def _remember(self, image, result):
+        if self.cache is not None:
+            self.cache.put(image.content_hash, PROMPT_VERSION, dict(result))
+
+    def analyze_image(self, image_data):
+        try:
+            # Validate image data
+            if not image_data:
+                raise ValueError("Image data is empty")
+
+            # Decode, orient and downscale once (shared with the embedding path
+            # when the caller passes a PreparedImage)
+            image = PreparedImage.coerce(image_data, max_size=1024)
+
+            # The same photo uploaded again reuses its attributes
+            cached = self._cached(image)
+            if cached is not None:
+                return cached
+
             try:
-                response = self.model.generate_content(
-                    contents=[
-                        {
-                            "parts": [
-                                {"text": prompt},
-                                {"inline_data": {"mime_type": "image/jpeg", "data": base64.b64encode(image_bytes).decode('utf-8')}}
-                            ]
-                        }
-                    ],
-                    generation_config={
-                        "temperature": 0.2,  # Lower temperature for more consistent results
-                        "top_p": 0.95,
-                        "top_k": 40
-                    },
-                    safety_settings=[
-                        {
-                            "category": "HARM_CATEGORY_HARASSMENT",
-                            "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-                        },
-                        {
-                            "category": "HARM_CATEGORY_HATE_SPEECH",
-                            "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-                        },
-                        {
-                            "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
-                            "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-                        },
-                        {
-                            "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
-                            "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-                        }
-                    ]
-                )
-                print(f"Received response from Gemini: {response.text}")
+                response = self._request(ATTRIBUTE_PROMPT, [image])
+            except (CircuitOpenError, DeadlineExceeded) as e:
+                # Fail fast; callers go on without the attributes
+                logger.warning("Gemini unavailable: %s", e)
+                return unavailable(e)
             except Exception as e:
-                print(f"Gemini API call failed: {str(e)}")
+                logger.error("Gemini API call failed: %s", e)
                 raise ValueError(f"Gemini API call failed: {str(e)}")
-            
+
             # Process the response
-            response_text = response.text.strip()
-            print(f"Raw response text: {response_text}")
-            
-            # Extract JSON from the response
-            json_match = None
-            
-            # Try different patterns to extract JSON
-            if '```json' in response_text:
-                json_match = response_text.split('```json')[1].split('```')[0].strip()
-            elif '```' in response_text:
-                json_match = response_text.split('```')[1].split('```')[0].strip()
-            elif '{' in response_text and '}' in response_text:
-                # Try to extract just the JSON object
-                start = response_text.find('{')
-                end = response_text.rfind('}') + 1
-                json_match = response_text[start:end].strip()
-            
-            if not json_match:
-                print("Failed to extract JSON from response")
-                json_match = response_text  # Try with the whole text as fallback
-            
+            json_match = extract_json(response.text.strip())
+
             try:
-                result = json.loads(json_match)
-                print(f"Parsed result: {result}")
-                
-                # Normalize apparel type
-                if 'apparel_type' in result:
-                    result['apparel_type'] = result['apparel_type'].lower().strip()
-                else:
-                    result['apparel_type'] = 'unknown'
-                    
-                # Normalize gender
-                if 'gender' in result:
-                    result['gender'] = result['gender'].lower().strip()
-                else:
-                    result['gender'] = 'unknown'
-                    
-                # Normalize color
-                if 'color' in result:
-                    result['color'] = result['color'].lower().strip()
-                else:
-                    result['color'] = 'unknown'
-                
-                # Normalize pattern
-                if 'pattern' in result:
-                    result['pattern'] = result['pattern'].lower().strip()
-                    if result['pattern'] in ['none', 'solid', 'n/a', 'none visible', 'not visible', 'not applicable']:
-                        result['pattern'] = ''
-                else:
-                    result['pattern'] = ''
-                
-                # Normalize features
-                if 'features' in result:
-                    result['features'] = result['features'].lower().strip()
-                    if result['features'] in ['none', 'n/a', 'none visible', 'not visible', 'not applicable']:
-                        result['features'] = ''
-                else:
-                    result['features'] = ''
-                
-                # Normalize brand
-                if 'brand' in result:
-                    result['brand'] = result['brand'].lower().strip()
-                    if result['brand'] in ['none', 'not visible', 'n/a', 'none visible', 'unknown', 'not applicable']:
-                        result['brand'] = ''
-                else:
-                    result['brand'] = ''
-                
-                return result
-                
+                result = normalize_attributes(json.loads(json_match))
             except json.JSONDecodeError as e:
-                print(f"JSON parsing error: {str(e)}, text: {json_match}")
+                logger.error("JSON parsing error: %s, text: %s", e, json_match)
                 raise ValueError(f"Invalid JSON response from Gemini: {str(e)}")
-            
+
+            self._remember(image, result)
+            return result
+
         except Exception as e:
-            print(f"Error in analyze_image: {str(e)}")
-            import traceback
-            print(f"Traceback: {traceback.format_exc()}")
+            logger.exception("Error in analyze_image: %s", e)
             return {
                 'error': 'Failed to analyze image',
                 'details': str(e)
-            } 
\ No newline at end of file
+            }
+
+    def analyze_images(self, images):
+        """One attribute dict (or error dict) per image, in order.
+
+        Cached images are answered from the cache. The remaining distinct
+        images are sent batch_size at a time, several per generate_content
+        call.
+        """
+        prepared = [PreparedImage.coerce(image, max_size=1024) for image in images]
+        results = [self._cached(image) for image in prepared]
+
+        missing = {}
+        for image, result in zip(prepared, results):
+            if result is None:
+                missing.setdefault(image.content_hash, image)
+        pending = list(missing.values())
+
+        analysed = {}
+        for start in range(0, len(pending), self.batch_size):
+            batch = pending[start:start + self.batch_size]
+            for image, result in zip(batch, self._analyze_batch(batch)):
+                analysed[image.content_hash] = result
+
+        return [
+            result if result is not None else dict(analysed[image.content_hash])
+            for image, result in zip(prepared, results)
+        ]
+
+    def _analyze_batch(self, images):
+        if len(images) == 1:
+            return [self.analyze_image(images[0])]
+        try:
+            response = self._request(BATCH_PROMPT.format(count=len(images)) + ATTRIBUTE_PROMPT, images, labelled=True)
+            results = json.loads(extract_json(response.text.strip(), opening='['))
+            if not isinstance(results, list) or len(results) != len(images) or \
+                    not all(isinstance(result, dict) for result in results):
+                raise ValueError(f"Expected {len(images)} results from Gemini")
+        except (CircuitOpenError, DeadlineExceeded) as e:
+            logger.warning("Gemini unavailable: %s", e)
+            return [unavailable(e) for _ in images]
+        except Exception as e:
+            # A failed or malformed batch answer falls back to one call per image
+            logger.warning("Gemini batch of %d failed, analysing one by one: %s", len(images), e)
+            return [self.analyze_image(image) for image in images]
+
+        normalized = []
+        for image, result in zip(images, results):
+            try:
+                result = normalize_attributes(result)
+            except Exception as e:
+                # One unusable answer only costs that image a call of its own
+                logger.warning("Unusable Gemini batch answer, analysing the image alone: %s", e)
+                normalized.append(self.analyze_image(image))
+                continue
+            self._remember(image, result)
+            normalized.append(result)
+        return normalized
@@ -0,0 +1,141 @@
+import base64
+import hashlib
+import io
+import threading
+from functools import lru_cache
+
+import numpy as np
+from PIL import Image, ImageOps
+
+DEFAULT_MAX_SIZE = 1024
+
+
+@lru_cache(maxsize=4)
+def _dct_matrix(size):
+    """Orthonormal DCT-II basis, so a 2-D DCT is two matrix products"""
+    n = np.arange(size)
+    matrix = np.cos(np.pi * (2 * n[None, :] + 1) * n[:, None] / (2 * size)) * np.sqrt(2.0 / size)
+    matrix[0] /= np.sqrt(2.0)
+    return matrix.astype(np.float32)
+
+
+def perceptual_hash(image, size=32, hash_size=8):
+    """64-bit DCT perceptual hash; near-identical frames differ in only a few bits"""
+    gray = image.convert('L').resize((size, size), Image.Resampling.BILINEAR)
+    pixels = np.asarray(gray, dtype=np.float32)
+    dct = _dct_matrix(size)
+    low = (dct @ pixels @ dct.T)[:hash_size, :hash_size].flatten()
+    # Skip the DC term so overall brightness does not dominate the median
+    bits = low > np.median(low[1:])
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return value
+
+
+def hamming_distance(left, right):
+    return bin(left ^ right).count('1')
+
+
+class ImageTooLarge(ValueError):
+    """The image has more pixels than the server accepts"""
+
+
+class PreparedImage:
+    """A request image decoded once and shared by every consumer.
+
+    The content hash is taken over the original bytes, so it matches the key
+    the embedding cache uses. Decoding, EXIF orientation, the size cap and
+    each encoded variant are computed lazily, at most once.
+    """
+
+    def __init__(self, raw_bytes, max_size=DEFAULT_MAX_SIZE):
+        if not raw_bytes:
+            raise ValueError("Image data is empty")
+        self.raw_bytes = raw_bytes
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._image = None
+        self._encoded = {}
+        self._content_hash = None
+        self._perceptual_hash = None
+
+    @classmethod
+    def from_base64(cls, image_data, max_size=DEFAULT_MAX_SIZE):
+        """Build from a base64 string, with or without a data URL prefix"""
+        if ',' in image_data:
+            image_data = image_data.split(',', 1)[1]
+        return cls(base64.b64decode(image_data), max_size=max_size)
+
+    @classmethod
+    def coerce(cls, image_data, max_size=DEFAULT_MAX_SIZE):
+        """Accept a PreparedImage, raw bytes or a base64 string; None stays None"""
+        if image_data is None or isinstance(image_data, cls):
+            return image_data
+        if isinstance(image_data, (bytes, bytearray, memoryview)):
+            return cls(bytes(image_data), max_size=max_size)
+        return cls.from_base64(image_data, max_size=max_size)
+
+    def check_pixels(self, max_pixels):
+        """Reject images over max_pixels from the header alone, before anything is decoded"""
+        if not max_pixels:
+            return self
+        try:
+            with Image.open(io.BytesIO(self.raw_bytes)) as image:
+                width, height = image.size
+        except Image.DecompressionBombError as e:
+            raise ImageTooLarge(str(e))
+        except Exception as e:
+            raise ValueError(f"Failed to process image: {str(e)}")
+        if width * height > max_pixels:
+            raise ImageTooLarge(f"Image is {width}x{height}; at most {max_pixels} pixels are accepted")
+        return self
+
+    @property
+    def content_hash(self):
+        if self._content_hash is None:
+            self._content_hash = hashlib.sha256(self.raw_bytes).hexdigest()
+        return self._content_hash
+
+    @property
+    def perceptual_hash(self):
+        if self._perceptual_hash is None:
+            self._perceptual_hash = perceptual_hash(self.image)
+        return self._perceptual_hash
+
+    @property
+    def image(self):
+        """Decoded RGB image, upright and no larger than max_size on its long side"""
+        if self._image is None:
+            with self._lock:
+                if self._image is None:
+                    self._image = self._decode()
+        return self._image
+
+    def _decode(self):
+        try:
+            image = Image.open(io.BytesIO(self.raw_bytes))
+            # Let the JPEG decoder downscale by a power of two while decoding
+            image.draft('RGB', (self.max_size, self.max_size))
+            image = ImageOps.exif_transpose(image)
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
+            if max(image.size) > self.max_size:
+                image.thumbnail((self.max_size, self.max_size), Image.Resampling.LANCZOS, reducing_gap=2.0)
+            return image
+        except Exception as e:
+            raise ValueError(f"Failed to process image: {str(e)}")
+
+    def encoded(self, format='JPEG', quality=90):
+        """The prepared image encoded as format; cached per (format, quality)"""
+        key = (format, quality)
+        data = self._encoded.get(key)
+        if data is None:
+            buffer = io.BytesIO()
+            self.image.save(buffer, format=format, quality=quality)
+            data = buffer.getvalue()
+            self._encoded[key] = data
+        return data
+
+    def jpeg_bytes(self, quality=90):
+        return self.encoded('JPEG', quality)
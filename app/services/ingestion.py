@@ -0,0 +1,270 @@
+import glob
+import hashlib
+import logging
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import numpy as np
+
+from .image_pipeline import PreparedImage
+from .signed_urls import split_gcs_uri
+from .vector_index import save_snapshot
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+
+
+def product_id_from_name(name):
+    """Product ids are image file names without the extension, e.g. images/9952.jpg -> 9952"""
+    return os.path.splitext(os.path.basename(name))[0]
+
+
+class SourceImage:
+    """One catalog image; read() fetches its bytes only when it has to be embedded"""
+
+    def __init__(self, product_id, uri, read, content_hash=None):
+        self.product_id = product_id
+        self.uri = uri
+        self._read = read
+        self._data = None
+        self._content_hash = content_hash
+
+    def read(self):
+        if self._data is None:
+            self._data = self._read()
+        return self._data
+
+    @property
+    def content_hash(self):
+        if self._content_hash is None:
+            self._content_hash = hashlib.sha256(self.read()).hexdigest()
+        return self._content_hash
+
+
+class LocalImageSource:
+    """Images under a local directory; uri_prefix maps them to their gs:// location"""
+
+    def __init__(self, directory, uri_prefix=None):
+        self.directory = directory
+        self.uri_prefix = uri_prefix
+
+    def __iter__(self):
+        for root, _, files in os.walk(self.directory):
+            for name in sorted(files):
+                if not name.lower().endswith(IMAGE_EXTENSIONS):
+                    continue
+                path = os.path.join(root, name)
+                relative = os.path.relpath(path, self.directory).replace(os.sep, '/')
+                uri = self.uri_prefix.rstrip('/') + '/' + relative if self.uri_prefix else os.path.abspath(path)
+                yield SourceImage(product_id_from_name(name), uri, lambda path=path: _read_file(path))
+
+
+def _read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+class GCSImageSource:
+    """Images listed under gs://bucket/prefix; unchanged objects are skipped by their MD5 without downloading"""
+
+    def __init__(self, storage_client, uri):
+        self.storage_client = storage_client
+        self.bucket_name, self.prefix = split_gcs_uri(uri)
+
+    def __iter__(self):
+        for blob in self.storage_client.list_blobs(self.bucket_name, prefix=self.prefix or None):
+            if not blob.name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            yield SourceImage(
+                product_id_from_name(blob.name),
+                f"gs://{self.bucket_name}/{blob.name}",
+                blob.download_as_bytes,
+                content_hash=f"md5:{blob.md5_hash}" if blob.md5_hash else None
+            )
+
+
+def image_source(uri, storage_client_factory=None, uri_prefix=None):
+    if uri.startswith('gs://'):
+        return GCSImageSource(storage_client_factory(), uri)
+    return LocalImageSource(uri, uri_prefix=uri_prefix)
+
+
+class RateLimiter:
+    """Token bucket allowing rate calls per second with bursts of up to burst calls"""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.capacity = max(1.0, float(burst))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self.rate:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+
+
+class IngestionStats:
+    def __init__(self):
+        self.seen = 0
+        self.embedded = 0
+        self.skipped = 0
+        self.failed = 0
+        self.started_at = time.time()
+
+    def __str__(self):
+        elapsed = time.time() - self.started_at
+        return (f"{self.seen} images: {self.embedded} embedded, {self.skipped} unchanged, "
+                f"{self.failed} failed in {elapsed:.1f}s")
+
+
+class IngestionPipeline:
+    """Re-embeds a product image catalog into a vector index snapshot.
+
+    Images stream from the source. Up to workers of them are decoded and
+    resized at a time, and their embedding calls go out in batches of
+    batch_size under a rate limit. Each finished batch is written to the
+    checkpoint directory. A rerun after a crash reloads those parts. Images
+    whose content hash matches the previous snapshot or a checkpoint part
+    are not embedded again. When the run completes, the snapshot at output
+    is replaced atomically and the checkpoint directory is removed.
+    """
+
+    def __init__(self, embedder, output, checkpoint_dir=None, workers=8, batch_size=32,
+                 rate=10.0, max_size=1024, retries=3):
+        self.embedder = embedder
+        self.output = output
+        self.checkpoint_dir = checkpoint_dir or output + '.parts'
+        self.workers = workers
+        self.batch_size = batch_size
+        self.limiter = RateLimiter(rate, burst=min(batch_size, workers))
+        self.max_size = max_size
+        self.retries = retries
+
+    # --- State ---------------------------------------------------------------
+
+    def _load_state(self):
+        """product id -> (content hash, embedding, uri) from the last snapshot and any checkpoint parts"""
+        state = {}
+        paths = [self.output] if os.path.exists(self.output) else []
+        paths += sorted(glob.glob(os.path.join(self.checkpoint_dir, 'part-*.npz')))
+        for path in paths:
+            with np.load(path, allow_pickle=False) as snapshot:
+                if 'content_hashes' not in snapshot.files:
+                    continue
+                uris = snapshot['gcs_uris'] if 'gcs_uris' in snapshot.files else None
+                for i, (pid, content_hash, embedding) in enumerate(zip(
+                    snapshot['ids'].astype(str), snapshot['content_hashes'].astype(str),
+                    snapshot['embeddings'].astype(np.float32)
+                )):
+                    state[pid] = (content_hash, embedding, str(uris[i]) if uris is not None else '')
+        return state
+
+    def _write_part(self, results):
+        with self._part_lock:
+            name = f"part-{self._next_part:06d}.npz"
+            self._next_part += 1
+        path = os.path.join(self.checkpoint_dir, name)
+        temporary = os.path.join(self.checkpoint_dir, 'tmp-' + name)
+        save_snapshot(
+            temporary,
+            [pid for pid, _, _, _ in results],
+            np.stack([embedding for _, _, embedding, _ in results]),
+            [uri for _, _, _, uri in results],
+            content_hashes=[content_hash for _, content_hash, _, _ in results]
+        )
+        # The rename is atomic, so a crash never leaves a half-written part
+        os.replace(temporary, path)
+
+    # --- Work ----------------------------------------------------------------
+
+    def _embed(self, item):
+        image = PreparedImage(item.read(), max_size=self.max_size)
+        image.jpeg_bytes()  # decode and resize on this worker thread
+        for attempt in range(self.retries):
+            self.limiter.acquire()
+            try:
+                return np.asarray(self.embedder.get_image_embedding(image), dtype=np.float32)
+            except Exception:
+                if attempt == self.retries - 1:
+                    raise
+                time.sleep(2 ** attempt)
+
+    def _run_batch(self, executor, batch, stats):
+        results = []
+        futures = {executor.submit(self._embed, item): item for item in batch}
+        for future, item in futures.items():
+            try:
+                results.append((item.product_id, item.content_hash, future.result(), item.uri))
+            except Exception as e:
+                logger.error("Failed to embed %s: %s", item.uri, e)
+        if results:
+            self._write_part(results)
+        with self._part_lock:
+            stats.embedded += len(results)
+            stats.failed += len(batch) - len(results)
+
+    def run(self, source):
+        """Ingest every image in source and write the snapshot; returns IngestionStats"""
+        stats = IngestionStats()
+        state = self._load_state()
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        self._part_lock = threading.Lock()
+        self._next_part = len(glob.glob(os.path.join(self.checkpoint_dir, 'part-*.npz')))
+        ids = []
+        batch = []
+        in_flight = set()
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='ingest') as executor, \
+                ThreadPoolExecutor(max_workers=2, thread_name_prefix='ingest-batch') as batches:
+            for item in source:
+                stats.seen += 1
+                ids.append(item.product_id)
+                known = state.get(item.product_id)
+                if known is not None and known[0] == item.content_hash:
+                    stats.skipped += 1
+                    continue
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    # At most two batches of images are held in memory at once
+                    if len(in_flight) >= 2:
+                        done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            future.result()
+                    in_flight.add(batches.submit(self._run_batch, executor, batch, stats))
+                    batch = []
+                if stats.seen % 1000 == 0:
+                    logger.info("Ingestion progress: %s", stats)
+            if batch:
+                in_flight.add(batches.submit(self._run_batch, executor, batch, stats))
+            for future in in_flight:
+                future.result()
+
+        # Every embedded image is in a checkpoint part, so reloading gives the final state
+        state = self._load_state()
+        ids = [pid for pid in dict.fromkeys(ids) if pid in state]
+        if ids:
+            temporary = self.output + '.tmp.npz'
+            save_snapshot(
+                temporary, ids,
+                np.stack([state[pid][1] for pid in ids]),
+                [state[pid][2] for pid in ids],
+                content_hashes=[state[pid][0] for pid in ids]
+            )
+            os.replace(temporary, self.output)
+            shutil.rmtree(self.checkpoint_dir, ignore_errors=True)
+        return stats
@@ -0,0 +1,55 @@
+import sqlite3
+from collections import namedtuple
+
+import numpy as np
+
+VectorSearchRow = namedtuple('VectorSearchRow', ['product_id', 'image_uri', 'aisle', 'similarity'])
+
+
+def _dot_product(left, right):
+    return float(np.dot(np.frombuffer(left, dtype=np.float32), np.frombuffer(right, dtype=np.float32)))
+
+
+class LocalProductEmbeddings:
+    """SQLite stand-in for the normalized product_embeddings table.
+
+    Runs the same ranking as BigQueryService's dot-product query (a dot
+    product against pre-normalized vectors, best first) so search_products
+    can be exercised without BigQuery.
+    """
+
+    def __init__(self, path=':memory:'):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.create_function('dot_product', 2, _dot_product, deterministic=True)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS product_embeddings ("
+            "product_id TEXT PRIMARY KEY, image_uri TEXT, aisle TEXT, embedding BLOB NOT NULL)"
+        )
+
+    def load(self, rows):
+        """Insert (product_id, image_uri, aisle, embedding) rows, normalizing each vector"""
+        records = []
+        for product_id, image_uri, aisle, embedding in rows:
+            vector = np.asarray(embedding, dtype=np.float32)
+            norm = np.linalg.norm(vector)
+            if norm == 0:
+                continue
+            records.append((str(product_id), image_uri, aisle, (vector / norm).tobytes()))
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO product_embeddings VALUES (?, ?, ?, ?)", records
+        )
+        self.conn.commit()
+
+    def search(self, query, k):
+        """Top-k rows by dot product with an already normalized query vector"""
+        query_blob = np.asarray(query, dtype=np.float32).tobytes()
+        cursor = self.conn.execute(
+            """
+            SELECT product_id, image_uri, aisle, dot_product(embedding, :query) AS similarity
+            FROM product_embeddings
+            ORDER BY similarity DESC
+            LIMIT :k
+            """,
+            {'query': query_blob, 'k': k}
+        )
+        return [VectorSearchRow(*row) for row in cursor.fetchall()]
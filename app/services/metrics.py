@@ -0,0 +1,188 @@
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class Counter:
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(self.labels, key)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labels)
+        with self._lock:
+            counts, total, count = self._values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    labels = _format_labels(self.labels, key, ('le', repr(float(bound))))
+                    lines.append(f'{self.name}_bucket{labels} {bucket_count}')
+                lines.append(f'{self.name}_bucket{_format_labels(self.labels, key, ("le", "+Inf"))} {count}')
+                lines.append(f'{self.name}_sum{_format_labels(self.labels, key)} {total}')
+                lines.append(f'{self.name}_count{_format_labels(self.labels, key)} {count}')
+        return lines
+
+
+class Metrics:
+    """Per-worker latency and error metrics rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self.request_latency = Histogram(
+            'search_request_duration_seconds', 'End-to-end API request latency',
+            labels=('endpoint', 'status')
+        )
+        self.stage_latency = Histogram(
+            'search_stage_duration_seconds', 'Latency of each request stage',
+            labels=('endpoint', 'stage')
+        )
+        self.stage_errors = Counter(
+            'search_stage_errors_total', 'Failed or timed-out request stages',
+            labels=('endpoint', 'stage')
+        )
+
+    def render(self, caches=None, upstreams=None, indexes=None, filters=None):
+        """Text exposition; caches, upstreams, indexes and filters map a name to its stats() dict"""
+        lines = []
+        for metric in (self.request_latency, self.stage_latency, self.stage_errors):
+            lines.extend(metric.render())
+
+        if caches:
+            _render_stats(lines, 'cache', caches, (
+                ('cache_hits_total', 'counter', 'Cache hits',
+                 lambda stats: stats.get('hits', 0) + stats.get('disk_hits', 0)),
+                ('cache_misses_total', 'counter', 'Cache misses',
+                 lambda stats: stats.get('misses', 0)),
+                ('cache_hit_ratio', 'gauge', 'Cache hit ratio since start',
+                 lambda stats: stats.get('hit_ratio', 0.0))
+            ))
+        if upstreams:
+            _render_stats(lines, 'upstream', upstreams, (
+                ('upstream_circuit_open', 'gauge', '1 while the circuit breaker is open',
+                 lambda stats: int(stats['state'] == 'open')),
+                ('upstream_calls_total', 'counter', 'Guarded upstream calls',
+                 lambda stats: stats['calls']),
+                ('upstream_hedges_total', 'counter', 'Hedged second requests sent',
+                 lambda stats: stats['hedges']),
+                ('upstream_timeouts_total', 'counter', 'Calls abandoned at their timeout or the request deadline',
+                 lambda stats: stats['timeouts']),
+                ('upstream_rejected_total', 'counter', 'Calls rejected by an open circuit',
+                 lambda stats: stats['rejected'])
+            ))
+        if indexes:
+            _render_stats(lines, 'index', indexes, (
+                ('vector_index_recall_sampled_total', 'counter', 'Queries also answered exactly to measure recall',
+                 lambda stats: stats['sampled']),
+                ('vector_index_recall', 'gauge', 'Mean recall@k of the sampled queries against exact search',
+                 lambda stats: stats['recall'])
+            ))
+        if filters:
+            _render_stats(lines, 'search', filters, (
+                ('filtered_search_filtered_total', 'counter', 'Searches narrowed by every requested attribute',
+                 lambda stats: stats['filtered']),
+                ('filtered_search_relaxed_total', 'counter',
+                 'Searches that dropped an attribute (no catalog match or too few products)',
+                 lambda stats: stats['relaxed']),
+                ('filtered_search_unfiltered_total', 'counter', 'Searches with attributes that ran unfiltered',
+                 lambda stats: stats['unfiltered'])
+            ))
+        return '\n'.join(lines) + '\n'
+
+
+def _render_stats(lines, label, stats_by_name, families):
+    for name, kind, documentation, read in families:
+        lines.append(f'# HELP {name} {documentation}')
+        lines.append(f'# TYPE {name} {kind}')
+        for key, stats in sorted(stats_by_name.items()):
+            lines.append(f'{name}{_format_labels((label,), (key,))} {read(stats)}')
+
+
+class RequestTimings:
+    """Collects per-stage durations for one request.
+
+    Durations feed the stage histograms and the Server-Timing response header.
+    """
+
+    def __init__(self, endpoint, metrics):
+        self.endpoint = endpoint
+        self.metrics = metrics
+        self.start = time.perf_counter()
+        self.stages = []
+
+    def record(self, name, seconds, error=False):
+        self.stages.append((name, seconds))
+        self.metrics.stage_latency.observe(seconds, endpoint=self.endpoint, stage=name)
+        if error:
+            self.metrics.stage_errors.inc(endpoint=self.endpoint, stage=name)
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        error = False
+        try:
+            yield
+        except Exception:
+            error = True
+            raise
+        finally:
+            self.record(name, time.perf_counter() - start, error=error)
+
+    def record_stages(self, results):
+        """Record StageRunner results (they ran on other threads)"""
+        for name, result in results.items():
+            self.record(name, result.elapsed, error=not result.ok)
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def server_timing(self):
+        entries = [f'{name};dur={seconds * 1000:.1f}' for name, seconds in self.stages]
+        entries.append(f'total;dur={self.elapsed * 1000:.1f}')
+        return ', '.join(entries)
+
+    def finish(self, status):
+        self.metrics.request_latency.observe(self.elapsed, endpoint=self.endpoint, status=str(status))
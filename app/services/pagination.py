@@ -0,0 +1,26 @@
+import secrets
+
+
+def new_token():
+    return secrets.token_urlsafe(12)
+
+
+def encode_cursor(token, offset):
+    """Opaque cursor naming a cached candidate list and the position of the next page"""
+    return f"{token}.{offset}"
+
+
+def decode_cursor(cursor):
+    """(token, offset) from a cursor; raises ValueError when it is malformed"""
+    token, _, offset = str(cursor).rpartition('.')
+    if not token or not offset.isdigit():
+        raise ValueError(f"Malformed cursor: {cursor}")
+    return token, int(offset)
+
+
+def page(candidates, token, offset, count):
+    """(gcs_uri_list, productid_list, next cursor or None) for one page of a candidate list"""
+    gcs_uri_list, productid_list = candidates
+    end = offset + count
+    next_cursor = encode_cursor(token, end) if end < len(productid_list) else None
+    return gcs_uri_list[offset:end], productid_list[offset:end], next_cursor
@@ -0,0 +1,166 @@
+import logging
+import random
+import threading
+import time
+
+import numpy as np
+
+from .vector_index import LocalVectorIndex, normalize_rows, top_k
+
+logger = logging.getLogger(__name__)
+
+
+def fit_projection(embeddings, dimensions, sample_size=20000, seed=0):
+    """(dimensions, D) float32 matrix of the top principal directions of the catalog.
+
+    Fitted without centering, so projected dot products approximate the
+    original cosine similarities as closely as dimensions allow.
+    """
+    embeddings = normalize_rows(embeddings)
+    if not 0 < dimensions <= embeddings.shape[1]:
+        raise ValueError(f"Cannot project {embeddings.shape[1]} dimensions down to {dimensions}")
+    if embeddings.shape[0] > sample_size:
+        rng = np.random.default_rng(seed)
+        embeddings = embeddings[rng.choice(embeddings.shape[0], sample_size, replace=False)]
+    _, _, components = np.linalg.svd(embeddings, full_matrices=False)
+    return np.ascontiguousarray(components[:dimensions], dtype=np.float32)
+
+
+def save_projection(path, components):
+    np.save(path, np.asarray(components, dtype=np.float32), allow_pickle=False)
+
+
+def load_projection(path):
+    return np.load(path, allow_pickle=False).astype(np.float32)
+
+
+def recall_at_k(found, expected):
+    """Share of the expected neighbours (row arrays or id lists) that were found"""
+    expected = set(np.asarray(expected).tolist())
+    if not expected:
+        return 1.0
+    return len(expected & set(np.asarray(found).tolist())) / len(expected)
+
+
+class ReducedIndex(LocalVectorIndex):
+    """Two-stage search: candidates on projected vectors, re-ranked at full dimension.
+
+    Every row is projected to len(projection) dimensions with a projection
+    fitted offline (fit_projection, `flask fit-projection`), and the
+    candidates best rows by projected score are re-scored with the full
+    embeddings. A recall_sample share of queries is also answered
+    exactly, and the running recall@k is reported by stats().
+    """
+
+    def __init__(self, ids, embeddings, gcs_uris=None, projection=None, candidates=300, recall_sample=0.0):
+        super().__init__(ids, embeddings, gcs_uris)
+        if projection is None:
+            raise ValueError("ReducedIndex needs a projection; create one with fit_projection")
+        self.projection = np.asarray(projection, dtype=np.float32)
+        if self.projection.shape[1] != self.dimensions:
+            raise ValueError(
+                f"Projection expects {self.projection.shape[1]} dimensions, snapshot has {self.dimensions}"
+            )
+        self.reduced = np.ascontiguousarray(self.embeddings @ self.projection.T)
+        self.candidates = max(1, candidates)
+        self.recall_sample = recall_sample
+        self.sampled = 0
+        self.recall_total = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def reduced_dimensions(self):
+        return self.projection.shape[0]
+
+    def _rerank(self, query, candidates, k):
+        scores = self.embeddings[candidates] @ query
+        best = top_k(scores, k)
+        return candidates[best], scores[best]
+
+    def _search_rows(self, query, k):
+        approximate = self.reduced @ (self.projection @ query)
+        return self._rerank(query, top_k(approximate, max(k, self.candidates)), k)
+
+    def _check_recall(self, query, rows, k):
+        if not self.recall_sample or random.random() >= self.recall_sample:
+            return
+        exact = top_k(self.embeddings @ query, k)
+        recall = recall_at_k(rows, exact)
+        with self._lock:
+            self.sampled += 1
+            self.recall_total += recall
+
+    def search(self, embedding, k):
+        query = normalize_rows(embedding)
+        rows, scores = self._search_rows(query, k)
+        self._check_recall(query, rows, k)
+        return self._results(rows, scores)
+
+    def search_batch(self, embeddings, k):
+        queries = normalize_rows(embeddings)
+        approximate = (queries @ self.projection.T) @ self.reduced.T
+        results = []
+        for query, row_scores in zip(queries, approximate):
+            rows, scores = self._rerank(query, top_k(row_scores, max(k, self.candidates)), k)
+            self._check_recall(query, rows, k)
+            results.append(self._results(rows, scores))
+        return results
+
+    def search_subset(self, embedding, k, rows=None, filters=None):
+        query = normalize_rows(embedding)
+        rows = np.asarray(rows, dtype=np.int64)
+        approximate = self.reduced[rows] @ (self.projection @ query)
+        best, scores = self._rerank(query, rows[top_k(approximate, max(k, self.candidates))], k)
+        return self._results(best, scores)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'dimensions': self.reduced_dimensions,
+                'sampled': self.sampled,
+                'recall': self.recall_total / self.sampled if self.sampled else 0.0
+            }
+
+
+def sample_queries(embeddings, count, noise=0.05, seed=0):
+    """Catalog rows with Gaussian noise added, standing in for real queries.
+
+    Without the noise every query would find itself, which flatters recall.
+    """
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(embeddings.shape[0], min(count, embeddings.shape[0]), replace=False)
+    queries = normalize_rows(embeddings[rows])
+    queries = queries + rng.standard_normal(queries.shape).astype(np.float32) * noise / np.sqrt(queries.shape[1])
+    return normalize_rows(queries)
+
+
+def reduced_recall_report(embeddings, queries, dimensions, k=10, candidates=300, seed=0):
+    """Recall@k against exact search and mean query time for each reduced dimension.
+
+    Returns one dict per entry of dimensions (plus the exact baseline first)
+    with 'dimensions', 'recall' and 'ms_per_query'.
+    """
+    embeddings = normalize_rows(embeddings)
+    queries = normalize_rows(queries)
+
+    start = time.perf_counter()
+    exact = [top_k(embeddings @ query, k) for query in queries]
+    report = [{
+        'dimensions': embeddings.shape[1],
+        'recall': 1.0,
+        'ms_per_query': (time.perf_counter() - start) * 1000 / len(queries)
+    }]
+
+    ids = np.arange(embeddings.shape[0])
+    for size in dimensions:
+        index = ReducedIndex(ids, embeddings, projection=fit_projection(embeddings, size, seed=seed),
+                             candidates=candidates)
+        start = time.perf_counter()
+        found = [index._search_rows(query, k)[0] for query in queries]
+        elapsed = time.perf_counter() - start
+        report.append({
+            'dimensions': size,
+            'recall': float(np.mean([recall_at_k(rows, expected) for rows, expected in zip(found, exact)])),
+            'ms_per_query': elapsed * 1000 / len(queries)
+        })
+    return report
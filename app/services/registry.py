@@ -0,0 +1,320 @@
+import os
+import threading
+import time
+
+import vertexai
+from vertexai.vision_models import MultiModalEmbeddingModel
+from google.cloud import aiplatform
+from google.cloud import bigquery
+from google.cloud import storage
+from google.cloud.aiplatform_v1beta1 import (
+    FeatureOnlineStoreAdminServiceClient,
+    FeatureOnlineStoreServiceClient
+)
+
+
+class ServiceRegistry:
+    """Process-wide cache of SDK clients, models and the feature store serving endpoint.
+
+    Everything is built lazily on first use and then shared by all requests
+    handled by the worker. The registry is fork-safe: a child process (e.g. a
+    gunicorn worker forked from a preloaded master) drops the parent's clients
+    and rebuilds its own, since gRPC channels must not cross a fork.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.project_id = config.get('GOOGLE_CLOUD_PROJECT')
+        self.location = config.get('VERTEX_AI_LOCATION')
+        self.feature_store_id = config.get('FEATURE_STORE_ID')
+        self.feature_view_id = config.get('ENTITY_TYPE_ID')
+        self.endpoint_ttl = float(config.get('FEATURE_STORE_ENDPOINT_TTL', 600))
+        self._reset()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        """Forget every cached object; used at construction and after fork"""
+        self._pid = os.getpid()
+        self._lock = threading.RLock()
+        self._instances = {}
+        self._build_locks = {}
+        self._endpoint = None
+        self._endpoint_expires_at = 0.0
+
+    def _ensure_pid(self):
+        if self._pid != os.getpid():
+            self._reset()
+
+    def get(self, name, factory):
+        """Return the cached object for name, building it with factory on first use"""
+        self._ensure_pid()
+        instance = self._instances.get(name)
+        if instance is None:
+            # One lock per name so a slow build (e.g. the catalog load) does not block others
+            with self._lock:
+                build_lock = self._build_locks.setdefault(name, threading.Lock())
+            with build_lock:
+                instance = self._instances.get(name)
+                if instance is None:
+                    instance = factory()
+                    self._instances[name] = instance
+        return instance
+
+    def peek(self, name):
+        """The cached object for name if it has been built, without building it"""
+        self._ensure_pid()
+        return self._instances.get(name)
+
+    def invalidate(self, name):
+        """Drop a cached object so the next get() rebuilds it"""
+        self._ensure_pid()
+        with self._lock:
+            self._instances.pop(name, None)
+
+    # --- SDK initialisation -------------------------------------------------
+
+    def _init_vertexai(self):
+        def factory():
+            vertexai.init(project=self.project_id, location=self.location)
+            aiplatform.init(project=self.project_id, location=self.location)
+            return True
+        return self.get('vertexai_init', factory)
+
+    # --- Clients and models -------------------------------------------------
+
+    @property
+    def feature_store_name(self):
+        return f"projects/{self.project_id}/locations/{self.location}/featureOnlineStores/{self.feature_store_id}"
+
+    @property
+    def feature_view_name(self):
+        return f"{self.feature_store_name}/featureViews/{self.feature_view_id}"
+
+    def embedding_model(self):
+        """Multimodal embedding model, loaded once per worker"""
+        def factory():
+            self._init_vertexai()
+            return MultiModalEmbeddingModel.from_pretrained("multimodalembedding")
+        return self.get('embedding_model', factory)
+
+    def embedding_cache(self):
+        """Query embedding cache shared by the route and VertexAIService paths"""
+        from .embedding_cache import EmbeddingCache
+        return self.get('embedding_cache', lambda: EmbeddingCache(
+            max_entries=int(self.config.get('EMBEDDING_CACHE_SIZE', 10000)),
+            ttl=float(self.config.get('EMBEDDING_CACHE_TTL', 86400)),
+            max_bytes=int(self.config.get('EMBEDDING_CACHE_MAX_BYTES', 64 * 1024 * 1024)),
+            disk_path=self.config.get('EMBEDDING_CACHE_PATH') or None,
+            disk_max_rows=int(self.config.get('EMBEDDING_CACHE_DISK_MAX_ROWS', 100000))
+        ))
+
+    def _bounded_http(self, client):
+        """Give an HTTP-based client a fixed-size connection pool that blocks when exhausted"""
+        import requests.adapters
+        size = int(self.config.get('HTTP_POOL_SIZE', 32))
+        client._http.mount('https://', requests.adapters.HTTPAdapter(
+            pool_connections=size, pool_maxsize=size, pool_block=True
+        ))
+        return client
+
+    def bigquery_client(self):
+        return self.get('bigquery_client', lambda: self._bounded_http(bigquery.Client(project=self.project_id)))
+
+    def storage_client(self):
+        return self.get('storage_client', lambda: self._bounded_http(storage.Client(project=self.project_id)))
+
+    def signed_url_provider(self):
+        from .signed_urls import SignedUrlProvider
+        return self.get('signed_url_provider', lambda: SignedUrlProvider(
+            self.storage_client(),
+            expiration=int(self.config.get('SIGNED_URL_EXPIRATION', 3600)),
+            refresh_margin=int(self.config.get('SIGNED_URL_REFRESH_MARGIN', 300))
+        ))
+
+    def admin_client(self):
+        def factory():
+            self._init_vertexai()
+            return FeatureOnlineStoreAdminServiceClient(
+                client_options={"api_endpoint": f"{self.location}-aiplatform.googleapis.com"}
+            )
+        return self.get('admin_client', factory)
+
+    def serving_endpoint(self):
+        """Public endpoint of the feature online store, re-resolved after the TTL"""
+        self._ensure_pid()
+        now = time.monotonic()
+        if self._endpoint is None or now >= self._endpoint_expires_at:
+            with self._lock:
+                if self._endpoint is None or now >= self._endpoint_expires_at:
+                    store = self.admin_client().get_feature_online_store(name=self.feature_store_name)
+                    endpoint = store.dedicated_serving_endpoint.public_endpoint_domain_name
+                    if endpoint != self._endpoint:
+                        self._instances.pop('data_client', None)
+                    self._endpoint = endpoint
+                    self._endpoint_expires_at = now + self.endpoint_ttl
+        return self._endpoint
+
+    def data_client(self):
+        """Feature online store serving client bound to the current endpoint"""
+        self._ensure_pid()
+        # Resolve and build under the lock serving_endpoint() refreshes under, so a
+        # client is never built for an endpoint a concurrent refresh has replaced
+        with self._lock:
+            endpoint = self.serving_endpoint()
+            client = self._instances.get('data_client')
+            if client is None:
+                client = self._instances['data_client'] = self._build_data_client(endpoint)
+            return client
+
+    def _build_data_client(self, endpoint):
+        return FeatureOnlineStoreServiceClient(client_options={"api_endpoint": endpoint})
+
+    def catalog(self):
+        """In-memory product_qty snapshot, refreshed in the background"""
+        from .catalog import create_catalog
+        return self.get('catalog', lambda: create_catalog(self.config, self.bigquery_client))
+
+    def vector_index(self):
+        """Nearest-neighbour backend selected by VECTOR_INDEX_BACKEND"""
+        from .vector_index import create_vector_index
+        return self.get('vector_index', lambda: create_vector_index(self.config, self))
+
+    def filtered_search(self):
+        """Attribute-filtered kNN over the vector index, with bitmaps built from the catalog"""
+        from .attribute_filter import FilteredSearch
+        attributes = [
+            attribute.strip()
+            for attribute in (self.config.get('FILTER_ATTRIBUTES') or 'apparel_type,gender,color').split(',')
+            if attribute.strip()
+        ]
+        return self.get('filtered_search', lambda: FilteredSearch(
+            self.vector_index(), self.catalog(),
+            attributes=attributes,
+            min_candidates=int(self.config.get('FILTER_MIN_CANDIDATES', 0))
+        ))
+
+    def thumbnail_cache(self):
+        """Disk cache of resized product images served by /api/thumb"""
+        from .thumbnails import create_thumbnail_cache
+        return self.get('thumbnail_cache', lambda: create_thumbnail_cache(self.config, self.storage_client))
+
+    def gemini_cache(self):
+        """Gemini attributes by image content hash, dropped when the prompt or model changes"""
+        from .coalescing import ResultCache
+        return self.get('gemini_cache', lambda: ResultCache(
+            ttl=float(self.config.get('GEMINI_CACHE_TTL', 86400)),
+            max_entries=int(self.config.get('GEMINI_CACHE_SIZE', 10000))
+        ))
+
+    def search_result_cache(self):
+        """Short-lived cache of complete /api/search results, dropped on index or catalog reload"""
+        from .coalescing import ResultCache
+        return self.get('search_result_cache', lambda: ResultCache(
+            ttl=float(self.config.get('SEARCH_RESULT_CACHE_TTL', 30)),
+            max_entries=int(self.config.get('SEARCH_RESULT_CACHE_SIZE', 1000))
+        ))
+
+    def search_cursors(self):
+        """Over-fetched candidate lists behind "load more" cursors, dropped on index or catalog reload"""
+        from .coalescing import ResultCache
+        return self.get('search_cursors', lambda: ResultCache(
+            ttl=float(self.config.get('SEARCH_CURSOR_TTL', 600)),
+            max_entries=int(self.config.get('SEARCH_CURSOR_MAX', 1000))
+        ))
+
+    def search_flight(self):
+        """Coalesces concurrent identical searches into one pipeline execution"""
+        from .coalescing import SingleFlight
+        return self.get('search_flight', SingleFlight)
+
+    def upstreams(self):
+        """Timeouts, hedging and circuit breakers for remote model, index and query calls"""
+        from .resilience import UpstreamGuards
+        return self.get('upstreams', lambda: UpstreamGuards(self.config))
+
+    def upstream(self, name):
+        return self.upstreams().get(name)
+
+    def metrics(self):
+        from .metrics import Metrics
+        return self.get('metrics', Metrics)
+
+    def stage_runner(self):
+        """Shared bounded executor for concurrent request stages"""
+        from .stages import StageRunner
+        return self.get('stage_runner', lambda: StageRunner(
+            max_workers=int(self.config.get('STAGE_MAX_WORKERS', 16)),
+            default_timeout=float(self.config.get('STAGE_TIMEOUT', 10)) or None
+        ))
+
+    def webcam_sessions(self):
+        """Per-session last-frame state used to skip redundant webcam analysis"""
+        from .webcam_sessions import WebcamSessionStore
+        return self.get('webcam_sessions', lambda: WebcamSessionStore(
+            max_sessions=int(self.config.get('WEBCAM_SESSION_MAX', 1000)),
+            ttl=float(self.config.get('WEBCAM_SESSION_TTL', 300)),
+            threshold=int(self.config.get('WEBCAM_PHASH_THRESHOLD', 6))
+        ))
+
+    # --- Application services -----------------------------------------------
+
+    def gemini_service(self):
+        from .gemini_service import GeminiService
+        api_key = self.config.get('GEMINI_API_KEY')
+        if not api_key:
+            raise ValueError("GEMINI_API_KEY not found in application config")
+        return self.get('gemini_service', lambda: GeminiService(
+            api_key=api_key,
+            upstream=self.upstream('gemini'),
+            cache=self.gemini_cache(),
+            batch_size=int(self.config.get('GEMINI_BATCH_SIZE', 8))
+        ))
+
+    def vertex_service(self):
+        from .vertex_ai_service import VertexAIService
+
+        def factory():
+            self._init_vertexai()
+            return VertexAIService(
+                self.project_id, self.location,
+                model=self.embedding_model(),
+                cache=self.embedding_cache(),
+                index=self.vector_index(),
+                upstream=self.upstream('embedding')
+            )
+        return self.get('vertex_service', factory)
+
+    def bigquery_service(self):
+        from .bigquery_service import BigQueryService
+        dataset = self.config.get('BIGQUERY_DATASET')
+        return self.get(
+            'bigquery_service',
+            lambda: BigQueryService(
+                self.project_id, dataset,
+                client=self.bigquery_client(),
+                storage_client=self.storage_client(),
+                vector_search_mode=self.config.get('BIGQUERY_VECTOR_SEARCH', 'dot'),
+                embeddings_table=self.config.get('BIGQUERY_EMBEDDINGS_TABLE', 'product_embeddings_normalized'),
+                url_signer=self.signed_url_provider(),
+                catalog=self.catalog(),
+                filtered_search=self.filtered_search(),
+                upstream=self.upstream('bigquery')
+            )
+        )
+
+    def warm_up(self):
+        """Build all clients and models and resolve the serving endpoint up front"""
+        self.embedding_model()
+        self.embedding_cache()
+        self.bigquery_client()
+        self.signed_url_provider().credentials  # resolve signing credentials
+        self.vector_index()
+        self.catalog()
+        # Builds the attribute bitmaps, warning now if the catalog lacks filter columns
+        self.filtered_search().bitmaps
+        if self.config.get('VECTOR_INDEX_BACKEND', 'feature_store') == 'feature_store':
+            self.data_client()
+        self.vertex_service()
+        self.bigquery_service()
+        self.gemini_service()
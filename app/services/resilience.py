@@ -0,0 +1,277 @@
+import contextvars
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+logger = logging.getLogger(__name__)
+
+_deadline = contextvars.ContextVar('deadline', default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    """The request budget or an upstream timeout ran out before an answer arrived"""
+
+
+class CircuitOpenError(Exception):
+    """The upstream's circuit breaker is open, so the call was not attempted"""
+
+    def __init__(self, name):
+        self.name = name
+        super().__init__(f"Circuit for {name} is open")
+
+
+def parse_durations(value):
+    """'embedding:3,knn:1.5' -> {'embedding': 3.0, 'knn': 1.5}"""
+    durations = {}
+    for item in (value or '').split(','):
+        name, _, seconds = item.partition(':')
+        if name.strip() and seconds.strip():
+            durations[name.strip()] = float(seconds)
+    return durations
+
+
+class Deadline:
+    """Time budget of one request; every stage and upstream call is capped by what is left"""
+
+    def __init__(self, budget=None):
+        self.budget = budget
+        self.expires_at = time.monotonic() + budget if budget else None
+
+    def remaining(self):
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def cap(self, timeout=None):
+        """The smaller of timeout and the remaining budget; raises once the budget is spent"""
+        remaining = self.remaining()
+        if remaining is None:
+            return timeout
+        if remaining <= 0:
+            raise DeadlineExceeded(f"Request deadline of {self.budget:.2f}s exceeded")
+        return remaining if timeout is None else min(timeout, remaining)
+
+
+def set_deadline(deadline):
+    """Make deadline current for this request; StageRunner carries it onto stage threads"""
+    return _deadline.set(deadline)
+
+
+def current_deadline():
+    return _deadline.get()
+
+
+def deadline_timeout(timeout=None):
+    """timeout capped by the current request's remaining budget"""
+    deadline = current_deadline()
+    return timeout if deadline is None else deadline.cap(timeout)
+
+
+class LatencyWindow:
+    """Recent successful call latencies, for picking the hedge delay"""
+
+    def __init__(self, size=200, min_samples=20):
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, q):
+        """q-th percentile (0-100), or None until min_samples calls have been seen"""
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            samples = sorted(self._samples)
+        return samples[min(len(samples) - 1, int(len(samples) * q / 100))]
+
+
+class CircuitBreaker:
+    """Opens after failure_threshold consecutive failures and fails fast for reset_timeout.
+
+    After that a single trial call is let through (half-open): success closes
+    the circuit, failure opens it again.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name='upstream', failure_threshold=5, reset_timeout=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        if not self.failure_threshold:
+            return True
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or (
+                self.failure_threshold and self.failures >= self.failure_threshold
+            ):
+                if self.state != self.OPEN:
+                    logger.warning("Circuit for %s opened after %d failures", self.name, self.failures)
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self._trial_in_flight = False
+
+
+class Upstream:
+    """Guarded calls to one remote dependency.
+
+    Each call runs on the shared upstream pool so the caller can stop waiting
+    at its timeout (the smaller of this upstream's cap and the request's
+    remaining budget). With hedging enabled, a second identical call is sent
+    once the first has taken longer than the hedge percentile of recent
+    latencies, and whichever answers first wins. Calls that time out or fail
+    count towards the circuit breaker; while it is open, calls raise
+    CircuitOpenError immediately.
+    """
+
+    def __init__(self, name, executor, timeout=None, hedge_percentile=None, breaker=None, window=None):
+        self.name = name
+        self.executor = executor
+        self.timeout = timeout
+        self.hedge_percentile = hedge_percentile
+        self.breaker = breaker or CircuitBreaker(name)
+        self.window = window or LatencyWindow()
+        self.calls = 0
+        self.hedges = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _submit(self, func):
+        # Run in a copy of the caller's context so nested calls see the same deadline
+        return self.executor.submit(contextvars.copy_context().run, func)
+
+    def call(self, func):
+        """Return func() or raise its error, DeadlineExceeded or CircuitOpenError"""
+        try:
+            timeout = deadline_timeout(self.timeout)
+        except DeadlineExceeded:
+            self._count('timeouts')
+            raise
+        if not self.breaker.allow():
+            self._count('rejected')
+            raise CircuitOpenError(self.name)
+        self._count('calls')
+
+        hedge_after = self.window.percentile(self.hedge_percentile) if self.hedge_percentile else None
+        if hedge_after is not None and timeout is not None and hedge_after >= timeout:
+            hedge_after = None
+
+        start = time.perf_counter()
+        pending = {self._submit(func)}
+        error = None
+        while pending:
+            elapsed = time.perf_counter() - start
+            waits = []
+            if timeout is not None:
+                waits.append(timeout - elapsed)
+            if hedge_after is not None:
+                waits.append(hedge_after - elapsed)
+            if waits and min(waits) <= 0 and hedge_after is None:
+                break
+            done, pending = wait(pending, timeout=max(0.0, min(waits)) if waits else None,
+                                 return_when=FIRST_COMPLETED)
+
+            for future in done:
+                try:
+                    value = future.result()
+                except Exception as e:
+                    error = error or e
+                    continue
+                self.window.add(time.perf_counter() - start)
+                self.breaker.record_success()
+                return value
+
+            elapsed = time.perf_counter() - start
+            if hedge_after is not None and elapsed >= hedge_after:
+                hedge_after = None
+                if pending:
+                    self._count('hedges')
+                    pending.add(self._submit(func))
+
+        self.breaker.record_failure()
+        if not pending:
+            raise error
+        self._count('timeouts')
+        raise DeadlineExceeded(f"{self.name} did not answer within {timeout:.2f}s")
+
+    def stats(self):
+        with self._lock:
+            return {
+                'state': self.breaker.state,
+                'calls': self.calls,
+                'hedges': self.hedges,
+                'timeouts': self.timeouts,
+                'rejected': self.rejected
+            }
+
+
+class UpstreamGuards:
+    """One Upstream per remote dependency, configured from the UPSTREAM_* settings"""
+
+    def __init__(self, config):
+        self.timeouts = parse_durations(config.get('UPSTREAM_TIMEOUTS'))
+        self.hedged = {
+            name.strip() for name in (config.get('HEDGE_UPSTREAMS') or '').split(',') if name.strip()
+        }
+        self.hedge_percentile = float(config.get('HEDGE_PERCENTILE', 95)) or None
+        self.failure_threshold = int(config.get('BREAKER_FAILURES', 5))
+        self.reset_timeout = float(config.get('BREAKER_RESET_TIMEOUT', 30))
+        self.executor = ThreadPoolExecutor(
+            max_workers=int(config.get('UPSTREAM_MAX_WORKERS', 32)), thread_name_prefix='upstream'
+        )
+        self._upstreams = {}
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        with self._lock:
+            upstream = self._upstreams.get(name)
+            if upstream is None:
+                upstream = self._upstreams[name] = Upstream(
+                    name, self.executor,
+                    timeout=self.timeouts.get(name),
+                    hedge_percentile=self.hedge_percentile if name in self.hedged else None,
+                    breaker=CircuitBreaker(name, self.failure_threshold, self.reset_timeout)
+                )
+            return upstream
+
+    def stats(self):
+        with self._lock:
+            upstreams = dict(self._upstreams)
+        return {name: upstream.stats() for name, upstream in upstreams.items()}
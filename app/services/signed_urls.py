@@ -0,0 +1,111 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+import google.auth
+from google.auth.transport.requests import Request
+from google.oauth2 import service_account
+
+
+def split_gcs_uri(uri):
+    """Split gs://bucket/path/to/blob into (bucket, blob name)"""
+    bucket_name, _, blob_name = uri[len('gs://'):].partition('/')
+    return bucket_name, blob_name
+
+
+class SignedUrlProvider:
+    """Signs GCS object URLs locally and caches each one until shortly before it expires.
+
+    Service account keys sign entirely in-process. Other credentials (e.g. the
+    GCE metadata server) fall back to IAM signBlob with a cached access token,
+    which is still far cheaper than a BigQuery job per page.
+    """
+
+    def __init__(self, storage_client, credentials=None, expiration=3600,
+                 refresh_margin=300, max_entries=10000):
+        self.storage_client = storage_client
+        self.expiration = expiration
+        self.refresh_margin = min(refresh_margin, expiration // 2)
+        self.max_entries = max_entries
+        self._credentials = credentials
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def credentials(self):
+        if self._credentials is None:
+            self._credentials, _ = google.auth.default(
+                scopes=['https://www.googleapis.com/auth/cloud-platform']
+            )
+        return self._credentials
+
+    def _signing_kwargs(self):
+        credentials = self.credentials
+        if isinstance(credentials, service_account.Credentials):
+            return {'credentials': credentials}
+        with self._lock:
+            if not credentials.valid:
+                credentials.refresh(Request())
+        return {
+            'service_account_email': credentials.service_account_email,
+            'access_token': credentials.token
+        }
+
+    def _sign(self, uri, signing_kwargs):
+        bucket_name, blob_name = split_gcs_uri(uri)
+        blob = self.storage_client.bucket(bucket_name).blob(blob_name)
+        return blob.generate_signed_url(
+            version="v4",
+            expiration=timedelta(seconds=self.expiration),
+            method="GET",
+            **signing_kwargs
+        )
+
+    def sign(self, uri):
+        return self.sign_many([uri])[0]
+
+    def sign_many(self, uris):
+        """Signed URLs for uris, in the same order; non-GCS URIs are returned unchanged"""
+        now = time.time()
+        signed = {}
+        missing = []
+        with self._lock:
+            for uri in uris:
+                if uri in signed or not uri.startswith('gs://'):
+                    continue
+                entry = self._cache.get(uri)
+                if entry is not None and entry[1] > now:
+                    self._cache.move_to_end(uri)
+                    signed[uri] = entry[0]
+                    self.hits += 1
+                elif uri not in missing:
+                    missing.append(uri)
+            self.misses += len(missing)
+
+        if missing:
+            signing_kwargs = self._signing_kwargs()
+            # Refresh before the URL expires so clients never receive a stale one
+            fresh_until = now + self.expiration - self.refresh_margin
+            fresh = [(uri, self._sign(uri, signing_kwargs)) for uri in missing]
+            with self._lock:
+                for uri, url in fresh:
+                    signed[uri] = url
+                    self._cache[uri] = (url, fresh_until)
+                    self._cache.move_to_end(uri)
+                while len(self._cache) > self.max_entries:
+                    self._cache.popitem(last=False)
+
+        return [signed.get(uri, uri) for uri in uris]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._cache),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0
+            }
@@ -0,0 +1,154 @@
+import contextvars
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait
+
+from .resilience import current_deadline
+
+logger = logging.getLogger(__name__)
+
+
+class Stage:
+    """One independent unit of work in a request pipeline.
+
+    A required stage that fails or times out makes StageRunner.run raise;
+    an optional one resolves to its default and is reported as degraded.
+    """
+
+    def __init__(self, name, func, timeout=None, required=True, default=None):
+        self.name = name
+        self.func = func
+        self.timeout = timeout
+        self.required = required
+        self.default = default
+
+
+class StageResult:
+    def __init__(self, name, value=None, error=None, elapsed=0.0, timed_out=False):
+        self.name = name
+        self.value = value
+        self.error = error
+        self.elapsed = elapsed
+        self.timed_out = timed_out
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+class StageError(Exception):
+    """A required stage failed or exceeded its timeout"""
+
+    def __init__(self, result):
+        self.result = result
+        reason = 'timed out' if result.timed_out else str(result.error)
+        super().__init__(f"Stage '{result.name}' {reason}")
+
+
+class StageResults(dict):
+    """Stage name -> StageResult, plus the names of optional stages that fell back"""
+
+    @property
+    def degraded(self):
+        return [name for name, result in self.items() if not result.ok]
+
+    def value(self, name):
+        return self[name].value
+
+
+class StageRunner:
+    """Runs independent stages concurrently on a bounded, process-wide thread pool.
+
+    Latency becomes that of the slowest stage rather than the sum. Timed-out
+    stages keep running in the background (threads cannot be cancelled) but
+    their results are discarded.
+    """
+
+    def __init__(self, max_workers=16, default_timeout=None):
+        self.max_workers = max_workers
+        self.default_timeout = default_timeout
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+
+    @property
+    def executor(self):
+        # Worker threads do not survive a fork, so each process gets its own pool
+        if self._executor is None or self._pid != os.getpid():
+            with self._lock:
+                if self._executor is None or self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.max_workers, thread_name_prefix='stage'
+                    )
+                    self._pid = os.getpid()
+        return self._executor
+
+    def map(self, func, items):
+        """[func(item) for item in items] computed concurrently, each in a copy of the caller's context"""
+        futures = [self.executor.submit(contextvars.copy_context().run, func, item) for item in items]
+        return [future.result() for future in futures]
+
+    def _call(self, stage):
+        start = time.perf_counter()
+        value = stage.func()
+        return value, time.perf_counter() - start
+
+    def run(self, stages):
+        """Run stages concurrently and return StageResults once all have settled"""
+        results = StageResults()
+        for result in self.iter_results(stages):
+            results[result.name] = result
+        return results
+
+    def iter_results(self, stages):
+        """Run stages concurrently and yield each StageResult as soon as it settles.
+
+        Raises StageError as soon as a required stage fails or times out.
+        No stage waits past the current request deadline, if one is set.
+        """
+        start = time.perf_counter()
+        request_deadline = current_deadline()
+        remaining = request_deadline.remaining() if request_deadline is not None else None
+        pending = {}
+        for stage in stages:
+            timeout = stage.timeout if stage.timeout is not None else self.default_timeout
+            if remaining is not None:
+                timeout = remaining if timeout is None else min(timeout, remaining)
+            deadline = None if timeout is None else start + timeout
+            # Stage threads inherit the caller's context, including its deadline
+            future = self.executor.submit(contextvars.copy_context().run, self._call, stage)
+            pending[future] = (stage, deadline)
+
+        while pending:
+            deadlines = [deadline for _, deadline in pending.values() if deadline is not None]
+            remaining = max(0.0, min(deadlines) - time.perf_counter()) if deadlines else None
+            wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+
+            now = time.perf_counter()
+            for future, (stage, deadline) in list(pending.items()):
+                if future.done():
+                    try:
+                        value, elapsed = future.result()
+                        result = StageResult(stage.name, value=value, elapsed=elapsed)
+                    except Exception as e:
+                        result = StageResult(stage.name, value=stage.default, error=e, elapsed=now - start)
+                elif deadline is not None and now >= deadline:
+                    future.cancel()
+                    result = StageResult(stage.name, value=stage.default, error=FutureTimeoutError(),
+                                         elapsed=now - start, timed_out=True)
+                else:
+                    continue
+                del pending[future]
+
+                if not result.ok:
+                    if stage.required:
+                        raise StageError(result)
+                    logger.warning("Stage %s degraded: %s", stage.name,
+                                   'timed out' if result.timed_out else result.error)
+                yield result
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
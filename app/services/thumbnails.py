@@ -0,0 +1,225 @@
+import hashlib
+import io
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+from .image_pipeline import PreparedImage
+from .signed_urls import split_gcs_uri
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {'webp': ('WEBP', 'image/webp'), 'jpeg': ('JPEG', 'image/jpeg')}
+DEFAULT_SIZES = {'small': 160, 'medium': 320, 'large': 640}
+
+
+def parse_sizes(value):
+    """'small:160,medium:320' -> {'small': 160, 'medium': 320}"""
+    sizes = {}
+    for item in (value or '').split(','):
+        name, _, pixels = item.partition(':')
+        if name.strip() and pixels.strip():
+            sizes[name.strip()] = int(pixels)
+    return sizes or dict(DEFAULT_SIZES)
+
+
+class GCSImageReader:
+    """Reads original product images from Cloud Storage"""
+
+    def __init__(self, storage_client):
+        self.storage_client = storage_client
+
+    def read(self, uri):
+        bucket_name, blob_name = split_gcs_uri(uri)
+        return self.storage_client.bucket(bucket_name).blob(blob_name).download_as_bytes()
+
+
+class LocalImageReader:
+    """Reads gs://bucket/path as <root>/path; for tests and offline runs"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def read(self, uri):
+        _, blob_name = split_gcs_uri(uri)
+        path = os.path.normpath(os.path.join(self.root, blob_name))
+        if not path.startswith(os.path.normpath(self.root) + os.sep):
+            raise FileNotFoundError(uri)
+        with open(path, 'rb') as f:
+            return f.read()
+
+
+class Thumbnail:
+    def __init__(self, path, size, etag):
+        self.path = path
+        self.size = size
+        self.etag = etag
+
+
+class ThumbnailCache:
+    """Resized product images kept on local disk under a byte budget.
+
+    The first request for a product fetches the original once and writes
+    every size in every format, so later requests never touch storage.
+    Files are evicted least recently used first. Each worker tracks its own
+    usage over the shared directory, so a file evicted by another worker is
+    simply regenerated.
+    """
+
+    def __init__(self, reader, uri_template, directory, max_bytes=256 * 1024 * 1024,
+                 sizes=None, quality=80):
+        self.reader = reader
+        self.uri_template = uri_template
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.sizes = sizes or dict(DEFAULT_SIZES)
+        self.quality = quality
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._product_locks = {}
+        os.makedirs(directory, exist_ok=True)
+        self._scan()
+
+    def _scan(self):
+        """Adopt files left by a previous run (or another worker), oldest first"""
+        files = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith(('.webp', '.jpeg')) and os.path.isfile(path):
+                stat = os.stat(path)
+                files.append((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted(files):
+            self._entries[name] = Thumbnail(os.path.join(self.directory, name), size, None)
+            self.current_bytes += size
+        self._evict()
+
+    def _name(self, product_id, size, format):
+        key = hashlib.sha256(str(product_id).encode('utf-8')).hexdigest()[:32]
+        return f"{key}-{size}.{format}"
+
+    def get(self, product_id, size='medium', format='webp'):
+        """Thumbnail for product_id, generating all of its variants on a miss"""
+        if size not in self.sizes:
+            raise ValueError(f"Unknown thumbnail size: {size}")
+        if format not in FORMATS:
+            raise ValueError(f"Unknown thumbnail format: {format}")
+        name = self._name(product_id, size, format)
+
+        thumbnail = self._lookup(name)
+        if thumbnail is not None:
+            return thumbnail
+
+        # One fetch per product even when many cards request it at once. The
+        # lock stays registered until its last waiter is done with it, so a
+        # late arrival never gets a fresh lock while the fetch is running.
+        key = str(product_id)
+        with self._lock:
+            entry = self._product_locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                thumbnail = self._lookup(name, count=False)
+                if thumbnail is None:
+                    with self._lock:
+                        self.misses += 1
+                    self._generate(product_id)
+                    thumbnail = self._lookup(name, count=False)
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._product_locks[key]
+        if thumbnail is None:
+            raise FileNotFoundError(f"Thumbnail for {product_id} could not be cached")
+        return thumbnail
+
+    def _lookup(self, name, count=True):
+        with self._lock:
+            thumbnail = self._entries.get(name)
+            if thumbnail is None:
+                return None
+            if not os.path.exists(thumbnail.path):
+                self._forget(name)
+                return None
+            self._entries.move_to_end(name)
+            if count:
+                self.hits += 1
+        if thumbnail.etag is None:
+            with open(thumbnail.path, 'rb') as f:
+                thumbnail.etag = hashlib.sha256(f.read()).hexdigest()[:32]
+        return thumbnail
+
+    def _generate(self, product_id):
+        uri = self.uri_template.format(product_id=product_id)
+        image = PreparedImage(self.reader.read(uri), max_size=max(self.sizes.values())).image
+        # Writing later variants must not evict the ones just written
+        fresh = {self._name(product_id, size, format) for size in self.sizes for format in FORMATS}
+        for size, pixels in self.sizes.items():
+            variant = image.copy()
+            variant.thumbnail((pixels, pixels), Image.Resampling.LANCZOS)
+            for format, (pil_format, _) in FORMATS.items():
+                buffer = io.BytesIO()
+                variant.save(buffer, format=pil_format, quality=self.quality)
+                self._store(self._name(product_id, size, format), buffer.getvalue(), keep=fresh)
+
+    def _store(self, name, data, keep=()):
+        path = os.path.join(self.directory, name)
+        temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary, 'wb') as f:
+            f.write(data)
+        os.replace(temporary, path)
+
+        with self._lock:
+            if name in self._entries:
+                self._forget(name)
+            self._entries[name] = Thumbnail(path, len(data), hashlib.sha256(data).hexdigest()[:32])
+            self.current_bytes += len(data)
+            self._evict(keep=keep or (name,))
+
+    def _evict(self, keep=()):
+        """Drop the least recently used files, never those named in keep, until under budget"""
+        while self.current_bytes > self.max_bytes:
+            name = next((name for name in self._entries if name not in keep), None)
+            if name is None:
+                break
+            evicted = self._forget(name)
+            try:
+                os.remove(evicted.path)
+            except OSError:
+                pass
+
+    def _forget(self, name):
+        thumbnail = self._entries.pop(name)
+        self.current_bytes -= thumbnail.size
+        return thumbnail
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0
+            }
+
+
+def create_thumbnail_cache(config, storage_client_factory):
+    """Build the cache from THUMB_* settings; THUMB_SOURCE is 'gcs' or a local directory"""
+    source = config.get('THUMB_SOURCE') or 'gcs'
+    reader = GCSImageReader(storage_client_factory()) if source == 'gcs' else LocalImageReader(source)
+    return ThumbnailCache(
+        reader,
+        config.get('THUMB_URI_TEMPLATE'),
+        config.get('THUMB_CACHE_DIR') or 'thumb_cache',
+        max_bytes=int(config.get('THUMB_CACHE_MAX_BYTES', 256 * 1024 * 1024)),
+        sizes=parse_sizes(config.get('THUMB_SIZES')),
+        quality=int(config.get('THUMB_QUALITY', 80))
+    )
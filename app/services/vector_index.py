@@ -0,0 +1,289 @@
+import os
+
+import numpy as np
+
+# Positions of the product id and image URI in the feature view entity
+PRODUCT_ID_FEATURE = 8
+GCS_URI_FEATURE = 9
+
+
+def load_snapshot(path):
+    """Load an embedding snapshot written by save_snapshot"""
+    with np.load(path, allow_pickle=False) as snapshot:
+        ids = snapshot['ids'].astype(str)
+        embeddings = snapshot['embeddings'].astype(np.float32)
+        gcs_uris = snapshot['gcs_uris'].astype(str) if 'gcs_uris' in snapshot.files else None
+    return ids, embeddings, gcs_uris
+
+
+def snapshot_version(path):
+    """Identifies one build of a snapshot file; changes when the file is replaced"""
+    stat = os.stat(path)
+    return f"{stat.st_mtime_ns}:{stat.st_size}"
+
+
+def save_snapshot(path, ids, embeddings, gcs_uris=None, content_hashes=None):
+    """Write ids, embeddings and (optionally) image URIs and source image hashes as a compressed .npz snapshot"""
+    arrays = {
+        'ids': np.asarray(ids, dtype=str),
+        'embeddings': np.asarray(embeddings, dtype=np.float32)
+    }
+    if gcs_uris is not None:
+        arrays['gcs_uris'] = np.asarray(gcs_uris, dtype=str)
+    if content_hashes is not None:
+        arrays['content_hashes'] = np.asarray(content_hashes, dtype=str)
+    np.savez_compressed(path, **arrays)
+
+
+def normalize_rows(matrix):
+    """L2-normalize each row so a dot product is the cosine similarity"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def top_k(scores, k):
+    """Indices of the k highest scores, best first"""
+    k = min(k, scores.shape[0])
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < scores.shape[0]:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(scores.shape[0])
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+
+class VectorIndex:
+    """Nearest-neighbour backend over the product embeddings.
+
+    search() returns dicts with 'product_id', 'gcs_uri' and 'score' (higher is
+    closer), ordered best first.
+    """
+
+    # Product id of each row, for indexes whose rows are held locally
+    ids = None
+    # Build of the underlying data (see snapshot_version); None when unknown
+    version = None
+
+    def search(self, embedding, k):
+        raise NotImplementedError
+
+    def search_batch(self, embeddings, k):
+        return [self.search(embedding, k) for embedding in embeddings]
+
+    def search_subset(self, embedding, k, rows=None, filters=None):
+        """Search only the rows (positions in ids) matching filters ({attribute: value})"""
+        raise NotImplementedError
+
+
+class LocalVectorIndex(VectorIndex):
+    """Shared state for indexes built from a local snapshot"""
+
+    def __init__(self, ids, embeddings, gcs_uris=None):
+        self.ids = np.asarray(ids, dtype=str)
+        self.embeddings = normalize_rows(embeddings)
+        self.gcs_uris = np.asarray(gcs_uris, dtype=str) if gcs_uris is not None else None
+        if len(self.ids) != self.embeddings.shape[0]:
+            raise ValueError("Snapshot ids and embeddings have different lengths")
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        ids, embeddings, gcs_uris = load_snapshot(path)
+        index = cls(ids, embeddings, gcs_uris, **kwargs)
+        index.version = snapshot_version(path)
+        return index
+
+    @property
+    def dimensions(self):
+        return self.embeddings.shape[1]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _results(self, rows, scores):
+        return [
+            {
+                'product_id': str(self.ids[row]),
+                'gcs_uri': str(self.gcs_uris[row]) if self.gcs_uris is not None else '',
+                'score': float(score)
+            }
+            for row, score in zip(rows, scores)
+        ]
+
+    def search_subset(self, embedding, k, rows=None, filters=None):
+        # Exact scoring of just the pre-filtered rows, whatever the backend
+        query = normalize_rows(embedding)
+        rows = np.asarray(rows, dtype=np.int64)
+        scores = self.embeddings[rows] @ query
+        best = top_k(scores, k)
+        return self._results(rows[best], scores[best])
+
+
+class BruteForceIndex(LocalVectorIndex):
+    """Exact cosine search with a single matrix-vector product"""
+
+    def search(self, embedding, k):
+        query = normalize_rows(embedding)
+        scores = self.embeddings @ query
+        rows = top_k(scores, k)
+        return self._results(rows, scores[rows])
+
+    def search_batch(self, embeddings, k):
+        queries = normalize_rows(embeddings)
+        scores = queries @ self.embeddings.T
+        results = []
+        for row_scores in scores:
+            rows = top_k(row_scores, k)
+            results.append(self._results(rows, row_scores[rows]))
+        return results
+
+
+class IVFIndex(LocalVectorIndex):
+    """Approximate search with an inverted file over spherical k-means cells.
+
+    Rows are regrouped by cell so each probed list is a contiguous slice;
+    only the nprobe closest cells are scored per query.
+    """
+
+    def __init__(self, ids, embeddings, gcs_uris=None, nlist=None, nprobe=8,
+                 iterations=10, seed=0):
+        super().__init__(ids, embeddings, gcs_uris)
+        count = len(self.ids)
+        self.nlist = max(1, min(nlist or int(np.sqrt(count)), count))
+        self.nprobe = max(1, min(nprobe, self.nlist))
+        self.centroids = self._train(iterations, seed)
+
+        assignments = np.argmax(self.embeddings @ self.centroids.T, axis=1)
+        order = np.argsort(assignments, kind='stable')
+        self.embeddings = self.embeddings[order]
+        self.ids = self.ids[order]
+        if self.gcs_uris is not None:
+            self.gcs_uris = self.gcs_uris[order]
+        counts = np.bincount(assignments, minlength=self.nlist)
+        self.offsets = np.concatenate(([0], np.cumsum(counts)))
+
+    def _train(self, iterations, seed):
+        rng = np.random.default_rng(seed)
+        sample_size = min(len(self.ids), self.nlist * 256)
+        sample = self.embeddings[rng.choice(len(self.ids), sample_size, replace=False)]
+        centroids = sample[rng.choice(sample_size, self.nlist, replace=False)]
+        for _ in range(iterations):
+            assignments = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, sample)
+            empty = np.bincount(assignments, minlength=self.nlist) == 0
+            # Re-seed empty cells with random sample points
+            sums[empty] = sample[rng.choice(sample_size, int(empty.sum()))]
+            centroids = normalize_rows(sums)
+        return centroids
+
+    def _candidates(self, query):
+        cells = top_k(self.centroids @ query, self.nprobe)
+        return np.concatenate([
+            np.arange(self.offsets[cell], self.offsets[cell + 1]) for cell in cells
+        ])
+
+    def search(self, embedding, k):
+        query = normalize_rows(embedding)
+        candidates = self._candidates(query)
+        scores = self.embeddings[candidates] @ query
+        best = top_k(scores, k)
+        return self._results(candidates[best], scores[best])
+
+
+class FeatureStoreIndex(VectorIndex):
+    """Vertex AI Feature Online Store nearest-neighbour search"""
+
+    def __init__(self, registry):
+        self.registry = registry
+
+    def search(self, embedding, k, filters=None):
+        # Imported here so local backends work without the Vertex AI SDK
+        from google.cloud.aiplatform_v1beta1.types import (
+            NearestNeighborQuery,
+            feature_online_store_service as feature_online_store_service_pb2
+        )
+
+        # Filters are applied by the store before ranking; each attribute must
+        # be a filter column of the feature view's vector search config
+        string_filters = [
+            NearestNeighborQuery.StringFilter(name=attribute, allow_tokens=[value])
+            for attribute, value in (filters or {}).items()
+        ]
+        request = feature_online_store_service_pb2.SearchNearestEntitiesRequest(
+            feature_view=self.registry.feature_view_name,
+            query=NearestNeighborQuery(
+                embedding=NearestNeighborQuery.Embedding(value=list(embedding)),
+                neighbor_count=k,
+                string_filters=string_filters,
+            ),
+            return_full_entity=True,
+        )
+        upstream = self.registry.upstream('knn')
+        output = upstream.call(lambda: self.registry.data_client().search_nearest_entities(
+            request=request, timeout=upstream.timeout
+        ))
+
+        results = []
+        for neighbor in output.nearest_neighbors.neighbors[:k]:
+            features = neighbor.entity_key_values.key_values.features
+            # Product ids are stored as image file names, e.g. "9952.jpg"
+            file_name = features[PRODUCT_ID_FEATURE].value.string_value
+            results.append({
+                'product_id': file_name.split('.')[0],
+                'gcs_uri': features[GCS_URI_FEATURE].value.string_value,
+                'score': -neighbor.distance
+            })
+        return results
+
+    def search_batch(self, embeddings, k):
+        # The serving API takes one query per call; issue them concurrently
+        # (in the caller's context, so each call is capped by the request deadline)
+        return self.registry.stage_runner().map(lambda embedding: self.search(embedding, k), embeddings)
+
+    def search_subset(self, embedding, k, rows=None, filters=None):
+        return self.search(embedding, k, filters=filters)
+
+
+BACKENDS = {
+    'bruteforce': BruteForceIndex,
+    'ivf': IVFIndex
+}
+
+
+def create_vector_index(config, registry):
+    """Build the backend selected by VECTOR_INDEX_BACKEND"""
+    backend = (config.get('VECTOR_INDEX_BACKEND') or 'feature_store').lower()
+    if backend == 'feature_store':
+        return FeatureStoreIndex(registry)
+    if backend not in BACKENDS and backend not in ('mmap', 'reduced'):
+        raise ValueError(f"Unknown VECTOR_INDEX_BACKEND: {backend}")
+
+    path = config.get('VECTOR_INDEX_PATH')
+    if not path:
+        raise ValueError(f"VECTOR_INDEX_PATH is required for the {backend} backend")
+    if backend == 'mmap':
+        from .embedding_store import MappedIndex
+        return MappedIndex.load(path, rerank=int(config.get('MMAP_RERANK', 4)))
+    if backend == 'reduced':
+        from .projection import ReducedIndex, load_projection
+        # Fitting the PCA takes seconds, so it is done offline rather than in a worker
+        projection_path = config.get('REDUCED_PROJECTION_PATH')
+        if not projection_path:
+            raise ValueError("REDUCED_PROJECTION_PATH is required for the reduced backend; "
+                             "create it with `flask fit-projection`")
+        return ReducedIndex.load(
+            path,
+            projection=load_projection(projection_path),
+            candidates=int(config.get('REDUCED_CANDIDATES', 300)),
+            recall_sample=float(config.get('RECALL_SAMPLE_RATE', 0.0))
+        )
+    if backend == 'ivf':
+        return IVFIndex.load(
+            path,
+            nlist=int(config.get('IVF_NLIST') or 0) or None,
+            nprobe=int(config.get('IVF_NPROBE', 8))
+        )
+    return BruteForceIndex.load(path)
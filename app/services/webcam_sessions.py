@@ -0,0 +1,86 @@
+import threading
+import time
+from collections import OrderedDict
+
+from .image_pipeline import hamming_distance
+
+
+class WebcamSession:
+    __slots__ = ('frame_hash', 'features', 'results', 'neighbor_count', 'updated_at')
+
+    def __init__(self, frame_hash, features=None, results=None, neighbor_count=None):
+        self.frame_hash = frame_hash
+        self.features = features
+        self.results = results
+        # Number of results asked for when results were computed
+        self.neighbor_count = neighbor_count
+        self.updated_at = time.monotonic()
+
+
+class WebcamSessionStore:
+    """Remembers the last analysed frame per webcam session.
+
+    A frame whose perceptual hash is within threshold bits of the previous one
+    shows the same scene, so its Gemini attributes and search results can be
+    reused (results only for the same neighbor_count). Sessions expire after
+    ttl seconds idle and the least recently used are evicted beyond
+    max_sessions.
+    """
+
+    def __init__(self, max_sessions=1000, ttl=300, threshold=6):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.threshold = threshold
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.reused = 0
+        self.analysed = 0
+
+    def match(self, session_id, frame_hash):
+        """The session if frame_hash is close to its last frame, else None"""
+        if not session_id:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None
+            if now - session.updated_at > self.ttl:
+                del self._sessions[session_id]
+                return None
+            if hamming_distance(session.frame_hash, frame_hash) > self.threshold:
+                return None
+            # Each matching frame keeps an active session alive
+            session.updated_at = now
+            self._sessions.move_to_end(session_id)
+            self.reused += 1
+            return session
+
+    def update(self, session_id, frame_hash, features=None, results=None, neighbor_count=None):
+        """Record a freshly analysed frame, replacing the session's previous state"""
+        if not session_id:
+            return
+        with self._lock:
+            self._sessions[session_id] = WebcamSession(frame_hash, features, results, neighbor_count)
+            self._sessions.move_to_end(session_id)
+            self.analysed += 1
+            self._evict()
+
+    def _evict(self):
+        now = time.monotonic()
+        while self._sessions:
+            oldest_id, oldest = next(iter(self._sessions.items()))
+            if len(self._sessions) > self.max_sessions or now - oldest.updated_at > self.ttl:
+                del self._sessions[oldest_id]
+            else:
+                break
+
+    def stats(self):
+        with self._lock:
+            frames = self.reused + self.analysed
+            return {
+                'sessions': len(self._sessions),
+                'hits': self.reused,
+                'misses': self.analysed,
+                'hit_ratio': self.reused / frames if frames else 0.0
+            }
@@ -0,0 +1,38 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+SERVING_MODES = ('sync', 'gevent')
+
+
+def cooperative():
+    """True when the process runs on gevent's monkey-patched sockets and threads"""
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched('socket')
+
+
+def init_serving_mode(config):
+    """Prepare the process for SERVING_MODE; must run before any SDK client is built.
+
+    In 'gevent' mode every request is a greenlet, so a worker holds hundreds
+    of in-flight searches while they wait on upstreams. The HTTP clients
+    (BigQuery, Cloud Storage, Gemini) become non-blocking through the
+    patched sockets. gRPC (Vertex AI, the feature store) is switched to its
+    gevent-compatible I/O. Returns the mode actually in effect.
+    """
+    mode = (config.get('SERVING_MODE') or 'sync').lower()
+    if mode not in SERVING_MODES:
+        raise ValueError(f"Unknown SERVING_MODE: {mode}")
+    if mode == 'sync':
+        return mode
+    if not cooperative():
+        logger.warning("SERVING_MODE=%s but the process is not monkey-patched; "
+                       "serve with gunicorn -c gunicorn.conf.py", mode)
+        return 'sync'
+
+    import grpc.experimental.gevent as grpc_gevent
+    grpc_gevent.init_gevent()
+    return mode
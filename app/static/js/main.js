@@ -28,6 +28,11 @@ document.addEventListener('DOMContentLoaded', () => {
     const webcamVideo = document.getElementById('webcamVideo');
     const webcamCanvas = document.getElementById('webcamCanvas');
     let webcamStream = null;
+    // Last search and the cursor of its next page, for "Load more"
+    let lastSearch = null;
+    let nextCursor = null;
+    // Lets the server reuse analysis while the camera shows the same item
+    let webcamSessionId = null;
 
     // Event Listeners
     if (searchBtn && textQuery) {
@@ -90,6 +95,9 @@ document.addEventListener('DOMContentLoaded', () => {
                     video: { facingMode: 'environment' } 
                 });
                 webcamVideo.srcObject = webcamStream;
+                webcamSessionId = window.crypto && crypto.randomUUID
+                    ? crypto.randomUUID()
+                    : `${Date.now()}-${Math.random().toString(36).slice(2)}`;
                 webcamContainer.classList.remove('hidden');
                 startWebcamBtn.classList.add('hidden');
                 stopWebcamBtn.classList.remove('hidden');
@@ -106,6 +114,7 @@ document.addEventListener('DOMContentLoaded', () => {
             if (webcamStream) {
                 webcamStream.getTracks().forEach(track => track.stop());
                 webcamStream = null;
+                webcamSessionId = null;
                 webcamVideo.srcObject = null;
                 webcamContainer.classList.add('hidden');
                 startWebcamBtn.classList.remove('hidden');
@@ -126,8 +135,9 @@ document.addEventListener('DOMContentLoaded', () => {
                 const ctx = webcamCanvas.getContext('2d');
                 ctx.drawImage(webcamVideo, 0, 0);
                 
-                // Convert canvas to base64
-                const imageData = webcamCanvas.toDataURL('image/jpeg');
+                // Grab the frame as a binary JPEG; it is uploaded as-is
+                const imageBlob = await new Promise(resolve => webcamCanvas.toBlob(resolve, 'image/jpeg', 0.9));
+                const imageData = URL.createObjectURL(imageBlob);
                 
                 // Set image preview
                 const img = imagePreview.querySelector('img');
@@ -138,20 +148,19 @@ document.addEventListener('DOMContentLoaded', () => {
                     imagePreview.appendChild(newImg);
                 }
                 const previewImg = imagePreview.querySelector('img');
+                if (previewImg.src.startsWith('blob:')) URL.revokeObjectURL(previewImg.src);
                 previewImg.src = imageData;
                 imagePreview.classList.remove('hidden');
 
                 // First analyze image with Gemini
                 showLoading();
                 try {
+                    const form = new FormData();
+                    form.append('image', imageBlob, 'frame.jpg');
+                    form.append('session_id', webcamSessionId);
                     const analysisResponse = await fetch('/api/analyze-image', {
                         method: 'POST',
-                        headers: {
-                            'Content-Type': 'application/json'
-                        },
-                        body: JSON.stringify({
-                            image_data: imageData
-                        })
+                        body: form
                     });
 
                     if (!analysisResponse.ok) {
@@ -241,33 +250,10 @@ document.addEventListener('DOMContentLoaded', () => {
     async function performTextSearch(query) {
         try {
             showLoading();
-            const response = await fetch('/api/search', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json'
-                },
-                body: JSON.stringify({
-                    query: query,
-                    image_data: null
-                })
+            await streamSearch({
+                query: query,
+                image_data: null
             });
-
-            if (!response.ok) {
-                const errorData = await response.json();
-                throw new Error(errorData.error || errorData.details || 'Search failed');
-            }
-
-            const data = await response.json();
-            displayResults(data.results);
-            
-            // Update search time
-            if (data.elapsed_time) {
-                const searchTimeElement = document.createElement('div');
-                searchTimeElement.textContent = `Search completed in ${data.elapsed_time.toFixed(2)} seconds`;
-                searchTimeElement.classList.add('text-sm', 'text-gray-500', 'mt-2', 'mb-4');
-                document.querySelector('#results').insertBefore(searchTimeElement, document.querySelector('#results-grid'));
-            }
-
         } catch (error) {
             console.error('Search error:', error);
             showError(error.message);
@@ -276,7 +262,7 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
-    async function performImageSearch(imageData) {
+    async function performImageSearch(imageFile) {
         if (!results) {
             console.error('Results container not found');
             return;
@@ -285,46 +271,12 @@ document.addEventListener('DOMContentLoaded', () => {
         showLoading();
 
         try {
-            // Extract base64 data from the data URL
-            const base64Data = imageData.split(',')[1];
-            
-            const response = await fetch('/api/search', {
-                method: 'POST',
-                headers: { 
-                    'Content-Type': 'application/json',
-                    'Accept': 'application/json'
-                },
-                body: JSON.stringify({
-                    query: null,
-                    image_data: base64Data,
-                    neighbor_count: 10
-                })
+            await streamSearch({
+                query: null,
+                image: imageFile,
+                neighbor_count: 10
             });
             
-            if (!response.ok) {
-                const errorData = await response.json().catch(() => ({ error: 'Unknown error occurred' }));
-                throw new Error(errorData.error || errorData.details || `Search failed: ${response.status}`);
-            }
-            
-            const data = await response.json();
-            
-            if (!data.results) {
-                throw new Error('No results returned from search');
-            }
-            
-            displayResults(data.results);
-            
-            // Update search time
-            if (data.elapsed_time) {
-                const searchTimeElement = document.createElement('div');
-                searchTimeElement.textContent = `Search completed in ${data.elapsed_time.toFixed(2)} seconds`;
-                searchTimeElement.classList.add('text-sm', 'text-gray-500', 'mt-2', 'mb-4');
-                const resultsGrid = document.querySelector('#results-grid');
-                if (resultsGrid) {
-                    resultsGrid.parentElement.insertBefore(searchTimeElement, resultsGrid);
-                }
-            }
-            
         } catch (error) {
             console.error('Search error:', error);
             showError(error.message || 'Failed to perform image search');
@@ -333,17 +285,126 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
+    // Streams /api/search as NDJSON: the ranked products render as soon as
+    // kNN returns, then image URLs and aisles are filled in as they resolve.
+    // With a cursor the next page is appended to the current results.
+    async function streamSearch(payload, cursor = null) {
+        if (!cursor) {
+            lastSearch = payload;
+        }
+        setNextCursor(null);
+        // Pages only send the cursor; the query is resent if the server lost it
+        let response = await postSearch(cursor ? { cursor, neighbor_count: lastSearch.neighbor_count } : payload);
+        if (cursor && response.status === 410) {
+            response = await postSearch({ ...lastSearch, cursor });
+        }
+
+        if (!response.ok) {
+            const errorData = await response.json().catch(() => ({ error: 'Unknown error occurred' }));
+            throw new Error(errorData.error || errorData.details || `Search failed: ${response.status}`);
+        }
+
+        const handleEvent = (line) => {
+            if (!line.trim()) return;
+            const event = JSON.parse(line);
+            switch (event.type) {
+                case 'results':
+                    displayResults(event.results, Boolean(cursor));
+                    hideLoading();
+                    break;
+                case 'update':
+                    updateResults(event.field, event.values);
+                    break;
+                case 'done':
+                    if (!cursor) showSearchTime(event.elapsed_time);
+                    setNextCursor(event.next_cursor);
+                    break;
+                case 'error':
+                    throw new Error(event.details || event.error);
+            }
+        };
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            const lines = buffer.split('\n');
+            buffer = lines.pop();
+            lines.forEach(handleEvent);
+        }
+        handleEvent(buffer + decoder.decode());
+    }
+
+    // Images go up as binary multipart parts rather than base64 inside JSON
+    function postSearch(body) {
+        const headers = { 'Accept': 'application/x-ndjson' };
+        let payload;
+        if (body.image instanceof Blob) {
+            payload = new FormData();
+            Object.entries({ ...body, stream: true }).forEach(([name, value]) => {
+                if (value !== null && value !== undefined) payload.append(name, value);
+            });
+        } else {
+            headers['Content-Type'] = 'application/json';
+            payload = JSON.stringify({ ...body, stream: true });
+        }
+        return fetch('/api/search', { method: 'POST', headers, body: payload });
+    }
+
+    function setNextCursor(cursor) {
+        nextCursor = cursor || null;
+        const resultsGrid = document.querySelector('#results-grid');
+        let loadMoreBtn = document.getElementById('loadMoreBtn');
+        if (!loadMoreBtn && resultsGrid) {
+            loadMoreBtn = document.createElement('button');
+            loadMoreBtn.id = 'loadMoreBtn';
+            loadMoreBtn.textContent = 'Load more';
+            loadMoreBtn.classList.add('hidden', 'block', 'mx-auto', 'my-6', 'px-4', 'py-2', 'bg-blue-500', 'text-white', 'rounded', 'hover:bg-blue-600');
+            loadMoreBtn.addEventListener('click', loadMore);
+            resultsGrid.parentElement.appendChild(loadMoreBtn);
+        }
+        if (loadMoreBtn) {
+            loadMoreBtn.classList.toggle('hidden', !nextCursor);
+        }
+    }
+
+    async function loadMore() {
+        if (!nextCursor || !lastSearch) return;
+        try {
+            await streamSearch(lastSearch, nextCursor);
+        } catch (error) {
+            console.error('Load more error:', error);
+            showError(error.message || 'Failed to load more results');
+        }
+    }
+
+    function showSearchTime(elapsedTime) {
+        if (!elapsedTime) return;
+        const searchTimeElement = document.createElement('div');
+        searchTimeElement.textContent = `Search completed in ${elapsedTime.toFixed(2)} seconds`;
+        searchTimeElement.classList.add('text-sm', 'text-gray-500', 'mt-2', 'mb-4');
+        const resultsGrid = document.querySelector('#results-grid');
+        if (resultsGrid) {
+            resultsGrid.parentElement.insertBefore(searchTimeElement, resultsGrid);
+        }
+    }
+
     // Results display function
     function generateRandomPrice() {
         const price = (Math.random() * (49.99 - 15.99) + 15.99).toFixed(2);
         return `£${price}`;
     }
 
-    function displayResults(results) {
+    function displayResults(results, append = false) {
         const resultsGrid = document.querySelector('#results-grid');
-        resultsGrid.innerHTML = ''; // Clear existing results
+        if (!append) {
+            resultsGrid.innerHTML = ''; // Clear existing results
+        }
 
-        if (!results || results.length === 0) {
+        if (!append && (!results || results.length === 0)) {
             const noResults = document.createElement('div');
             noResults.textContent = 'No results found';
             noResults.classList.add('col-span-full', 'text-center', 'py-4');
@@ -354,13 +415,14 @@ document.addEventListener('DOMContentLoaded', () => {
         results.forEach(result => {
             const card = document.createElement('div');
             card.classList.add('bg-white', 'rounded-lg', 'shadow', 'overflow-hidden');
+            card.dataset.productId = result.id;
             
             // Generate a random price between £10 and £100
             const price = (Math.random() * 90 + 10).toFixed(2);
             
             card.innerHTML = `
                 <div class="aspect-w-1 aspect-h-1">
-                    <img src="${result.image_url}" alt="Product ${result.id}" 
+                    <img ${result.image_url ? `src="${result.image_url}"` : ''} alt="Product ${result.id}" 
                          class="w-full h-full object-cover"
                          onerror="this.src='/static/images/no-image.png'">
                 </div>
@@ -368,7 +430,7 @@ document.addEventListener('DOMContentLoaded', () => {
                     <div class="flex justify-between items-start">
                         <div>
                             <p class="text-sm text-gray-500">ID: ${result.id}</p>
-                            <p class="text-sm text-blue-600">Aisle: ${result.aisle}</p>
+                            <p class="text-sm text-blue-600" data-field="aisle">Aisle: ${result.aisle ?? '…'}</p>
                         </div>
                         <p class="text-lg font-bold text-green-600">£${price}</p>
                     </div>
@@ -379,6 +441,19 @@ document.addEventListener('DOMContentLoaded', () => {
         });
     }
 
+    // Fill in a field streamed after the initial results
+    function updateResults(field, values) {
+        document.querySelectorAll('#results-grid [data-product-id]').forEach(card => {
+            const value = values[card.dataset.productId];
+            if (value === undefined) return;
+            if (field === 'image_url') {
+                card.querySelector('img').src = value || '/static/images/no-image.png';
+            } else if (field === 'aisle') {
+                card.querySelector('[data-field="aisle"]').textContent = `Aisle: ${value}`;
+            }
+        });
+    }
+
     function showLoading() {
         const spinner = document.getElementById('loadingSpinner');
         if (spinner) {
@@ -474,32 +549,23 @@ document.addEventListener('DOMContentLoaded', () => {
             return;
         }
 
-        const reader = new FileReader();
-        reader.onload = async (e) => {
-            try {
-                // Set image preview
-                const img = imagePreview.querySelector('img');
-                if (!img) {
-                    const newImg = document.createElement('img');
-                    newImg.classList.add('w-full', 'h-full', 'object-contain');
-                    imagePreview.innerHTML = '';
-                    imagePreview.appendChild(newImg);
-                }
-                const previewImg = imagePreview.querySelector('img');
-                previewImg.src = e.target.result;
-                imagePreview.classList.remove('hidden');
-
-                // Perform search
-                await performImageSearch(e.target.result);
-            } catch (error) {
-                console.error('Error handling image:', error);
-                showError('Failed to process image');
-            }
-        };
-        reader.onerror = () => {
-            showError('Error reading the image file');
-        };
-        reader.readAsDataURL(file);
+        // Preview from an object URL; the file itself is uploaded without re-encoding
+        const img = imagePreview.querySelector('img');
+        if (!img) {
+            const newImg = document.createElement('img');
+            newImg.classList.add('w-full', 'h-full', 'object-contain');
+            imagePreview.innerHTML = '';
+            imagePreview.appendChild(newImg);
+        }
+        const previewImg = imagePreview.querySelector('img');
+        if (previewImg.src.startsWith('blob:')) URL.revokeObjectURL(previewImg.src);
+        previewImg.src = URL.createObjectURL(file);
+        imagePreview.classList.remove('hidden');
+
+        performImageSearch(file).catch(error => {
+            console.error('Error handling image:', error);
+            showError('Failed to process image');
+        });
     }
 
     // Clear image functionality
@@ -0,0 +1 @@
+"""Benchmark harness for the search API with local fakes for the cloud services"""
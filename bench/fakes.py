@@ -0,0 +1,293 @@
+"""In-process stand-ins for the Google Cloud SDK objects the app calls.
+
+Each fake sleeps for a configurable latency (plus Gaussian jitter) and fails
+at a configurable rate, so the request paths can be exercised and timed
+without credentials or cloud quota. They implement only the surface the
+services in app/services actually use.
+"""
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+from app.services.vector_index import BruteForceIndex, GCS_URI_FEATURE, PRODUCT_ID_FEATURE
+
+APPAREL_TYPES = ['t-shirt', 'shirt', 'sweatshirt', 'hoodie', 'sweater', 'jacket', 'shoes', 'shorts', 'jeans']
+COLORS = ['black', 'white', 'red', 'blue', 'green', 'grey', 'navy', 'beige', 'yellow', 'pink']
+GENDERS = ['man', 'woman', 'boy', 'girl']
+
+# Rough defaults for each dependency: (latency, jitter) in seconds
+DEFAULT_PROFILES = {
+    'embedding': (0.12, 0.03),
+    'feature_store': (0.03, 0.01),
+    'bigquery': (0.8, 0.2),
+    'storage': (0.002, 0.001),
+    'gemini': (1.2, 0.3)
+}
+
+
+class FakeServiceError(Exception):
+    """Injected failure raised by a fake"""
+
+
+class ServiceProfile:
+    """Latency, jitter and failure rate of one fake dependency"""
+
+    def __init__(self, name, latency=0.0, jitter=0.0, failure_rate=0.0, seed=None):
+        self.name = name
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.calls = 0
+        self.failures = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, name, seed=None):
+        """Profile from BENCH_<NAME>_LATENCY, _JITTER and _FAILURE_RATE, else the defaults"""
+        latency, jitter = DEFAULT_PROFILES[name]
+        prefix = f"BENCH_{name.upper()}_"
+        return cls(
+            name,
+            latency=float(os.getenv(prefix + 'LATENCY', latency)),
+            jitter=float(os.getenv(prefix + 'JITTER', jitter)),
+            failure_rate=float(os.getenv(prefix + 'FAILURE_RATE', '0')),
+            seed=seed
+        )
+
+    def call(self):
+        """Sleep for one simulated round trip, then maybe raise FakeServiceError"""
+        with self._lock:
+            delay = max(0.0, self._random.gauss(self.latency, self.jitter)) if self.jitter else self.latency
+            failed = self._random.random() < self.failure_rate
+            self.calls += 1
+            self.failures += failed
+        if delay:
+            time.sleep(delay)
+        if failed:
+            raise FakeServiceError(f"Injected {self.name} failure")
+
+
+def _seed(*parts):
+    digest = hashlib.sha256(b'\x1f'.join(
+        part if isinstance(part, bytes) else str(part).encode('utf-8') for part in parts
+    )).digest()
+    return int.from_bytes(digest[:8], 'big')
+
+
+def fake_vector(dimensions, *parts):
+    """A deterministic unit vector for the given inputs"""
+    vector = np.random.default_rng(_seed(*parts)).standard_normal(dimensions).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+class FakeCatalog:
+    """Synthetic products shared by the fakes: attributes, image URIs and embeddings"""
+
+    def __init__(self, size=5000, dimensions=1408, seed=0, bucket='bench-products'):
+        rng = random.Random(seed)
+        self.dimensions = dimensions
+        self.rows = []
+        for product_id in range(1, size + 1):
+            self.rows.append({
+                'productid': product_id,
+                'aisle': f"A{rng.randint(1, 40)}",
+                'apparel_type': rng.choice(APPAREL_TYPES),
+                'color': rng.choice(COLORS),
+                'gender': rng.choice(GENDERS),
+                'gcs_uri': f"gs://{bucket}/images/{product_id}.jpg"
+            })
+        embeddings = np.random.default_rng(seed).standard_normal((size, dimensions)).astype(np.float32)
+        self.index = BruteForceIndex(
+            [str(row['productid']) for row in self.rows],
+            embeddings,
+            [row['gcs_uri'] for row in self.rows]
+        )
+
+
+# --- Vertex AI multimodal embeddings ----------------------------------------
+
+class FakeMultiModalEmbeddingModel:
+    """Stands in for vertexai.vision_models.MultiModalEmbeddingModel"""
+
+    def __init__(self, profile, dimensions=1408):
+        self.profile = profile
+        self.dimensions = dimensions
+
+    def get_embeddings(self, image=None, contextual_text=None, **kwargs):
+        self.profile.call()
+        image_bytes = getattr(image, '_image_bytes', None) or b''
+        text_embedding = fake_vector(self.dimensions, 'text', contextual_text).tolist() if contextual_text else None
+        image_embedding = fake_vector(self.dimensions, 'image', image_bytes).tolist() if image is not None else None
+        return SimpleNamespace(image_embedding=image_embedding, text_embedding=text_embedding)
+
+
+class FakeTextEmbeddingModel:
+    """Stands in for vertexai.language_models.TextEmbeddingModel"""
+
+    def __init__(self, profile, dimensions=768):
+        self.profile = profile
+        self.dimensions = dimensions
+
+    def get_embeddings(self, texts):
+        self.profile.call()
+        return [SimpleNamespace(values=fake_vector(self.dimensions, 'gecko', text).tolist()) for text in texts]
+
+
+# --- Vertex AI Feature Online Store -----------------------------------------
+
+class FakeFeatureOnlineStoreAdminServiceClient:
+    def get_feature_online_store(self, name):
+        return SimpleNamespace(
+            dedicated_serving_endpoint=SimpleNamespace(public_endpoint_domain_name='feature-store.bench.local')
+        )
+
+
+class FakeFeatureOnlineStoreServiceClient:
+    """Stands in for FeatureOnlineStoreServiceClient.search_nearest_entities"""
+
+    def __init__(self, profile, catalog):
+        self.profile = profile
+        self.catalog = catalog
+
+    @staticmethod
+    def _feature(value):
+        return SimpleNamespace(value=SimpleNamespace(string_value=value))
+
+    def search_nearest_entities(self, request, timeout=None):
+        self.profile.call()
+        query = request.query
+        embedding = list(query.embedding.value)
+        filters = {f.name: set(f.allow_tokens) for f in getattr(query, 'string_filters', [])}
+        if filters:
+            rows = [
+                position for position, row in enumerate(self.catalog.rows)
+                if all(row.get(name) in tokens for name, tokens in filters.items())
+            ]
+            matches = self.catalog.index.search_subset(embedding, query.neighbor_count, rows=rows)
+        else:
+            matches = self.catalog.index.search(embedding, query.neighbor_count)
+
+        neighbors = []
+        for result in matches:
+            features = [self._feature('') for _ in range(max(PRODUCT_ID_FEATURE, GCS_URI_FEATURE) + 1)]
+            features[PRODUCT_ID_FEATURE] = self._feature(f"{result['product_id']}.jpg")
+            features[GCS_URI_FEATURE] = self._feature(result['gcs_uri'])
+            neighbors.append(SimpleNamespace(
+                distance=-result['score'],
+                entity_key_values=SimpleNamespace(key_values=SimpleNamespace(features=features))
+            ))
+        return SimpleNamespace(nearest_neighbors=SimpleNamespace(neighbors=neighbors))
+
+
+# --- BigQuery ---------------------------------------------------------------
+
+class FakeRow(dict):
+    """A result row with both mapping and attribute access, like bigquery.Row"""
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+class FakeQueryJob:
+    def __init__(self, rows):
+        self._rows = rows
+
+    def result(self, timeout=None):
+        return iter(self._rows)
+
+
+class FakeBigQueryClient:
+    """Stands in for bigquery.Client; every query reads the product_qty rows"""
+
+    def __init__(self, profile, catalog):
+        self.profile = profile
+        self.catalog = catalog
+
+    def query(self, query, job_config=None):
+        self.profile.call()
+        columns = ('productid', 'aisle', 'apparel_type', 'color', 'gender')
+        return FakeQueryJob([FakeRow({name: row[name] for name in columns}) for row in self.catalog.rows])
+
+
+# --- Cloud Storage URL signing ----------------------------------------------
+
+class FakeCredentials:
+    """Non-service-account credentials, so signing takes the IAM signBlob path"""
+    valid = True
+    token = 'bench-token'
+    service_account_email = 'bench@bench.iam.gserviceaccount.com'
+
+
+class FakeBlob:
+    def __init__(self, profile, bucket_name, name):
+        self.profile = profile
+        self.bucket_name = bucket_name
+        self.name = name
+
+    def generate_signed_url(self, version='v4', expiration=None, method='GET', **kwargs):
+        self.profile.call()
+        return f"https://storage.bench.local/{self.bucket_name}/{self.name}?X-Goog-Signature=bench"
+
+
+class FakeBucket:
+    def __init__(self, profile, name):
+        self.profile = profile
+        self.name = name
+
+    def blob(self, name):
+        return FakeBlob(self.profile, self.name, name)
+
+
+class FakeStorageClient:
+    """Stands in for storage.Client; signing is the only call the app makes"""
+
+    def __init__(self, profile):
+        self.profile = profile
+
+    def bucket(self, name):
+        return FakeBucket(self.profile, name)
+
+
+# --- Gemini -----------------------------------------------------------------
+
+class FakeGenerativeModel:
+    """Stands in for genai.GenerativeModel; answers with the attribute JSON the prompt asks for.
+
+    Several images in one request get a JSON array with one object per image.
+    """
+
+    def __init__(self, profile):
+        self.profile = profile
+
+    def generate_content(self, contents, *, generation_config=None, safety_settings=None, stream=False):
+        # Same keywords as google-generativeai 0.3.2; anything else fails there too
+        self.profile.call()
+        images = [
+            part['inline_data']['data'] for item in contents for part in item['parts'] if 'inline_data' in part
+        ]
+        answers = [self._attributes(data) for data in images]
+        payload = answers[0] if len(answers) == 1 else answers
+        return SimpleNamespace(text=f"```json\n{json.dumps(payload)}\n```")
+
+    @staticmethod
+    def _attributes(data):
+        rng = random.Random(_seed(data))
+        return {
+            'apparel_type': rng.choice(APPAREL_TYPES),
+            'color': rng.choice(COLORS),
+            'gender': rng.choice(GENDERS),
+            'gender_confidence': rng.choice(['high', 'medium', 'low']),
+            'pattern': rng.choice(['', 'striped', 'checkered', 'graphic']),
+            'features': rng.choice(['', 'crew neck', 'long sleeves', 'zip front']),
+            'brand': ''
+        }
@@ -0,0 +1,406 @@
+"""Load generator and latency report for the search API, backed by local fakes.
+
+Run in-process against fake Google Cloud services:
+
+    python -m bench --requests 500 --concurrency 1,8,32
+
+Local vector index backends are exercised with --index-backend, e.g. a
+snapshot without image URIs as `flask ingest` writes without --uri-prefix:
+
+    python -m bench --index-backend bruteforce --no-snapshot-uris --strict
+
+or serve the fake-backed app with gunicorn and drive it over HTTP to size a
+worker fleet:
+
+    gunicorn -w 4 'bench.harness:create_bench_app()'
+    python -m bench --url http://127.0.0.1:8000 --concurrency 64
+"""
+import argparse
+import base64
+import io
+import itertools
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from app.services.registry import ServiceRegistry
+
+from .fakes import (
+    APPAREL_TYPES, COLORS, DEFAULT_PROFILES, GENDERS,
+    FakeCatalog, FakeCredentials, FakeFeatureOnlineStoreAdminServiceClient,
+    FakeFeatureOnlineStoreServiceClient, FakeGenerativeModel, FakeBigQueryClient,
+    FakeMultiModalEmbeddingModel, FakeStorageClient, FakeTextEmbeddingModel, ServiceProfile
+)
+
+ENDPOINTS = {
+    'search': '/api/search',
+    'analyze-image': '/api/analyze-image',
+    'analyze-webcam': '/api/analyze-webcam'
+}
+PERCENTILES = (50, 95, 99)
+
+
+class FakeServiceRegistry(ServiceRegistry):
+    """ServiceRegistry whose SDK clients and models are the fakes in bench.fakes"""
+
+    def __init__(self, config, profiles=None, catalog=None):
+        self.profiles = profiles or {name: ServiceProfile.from_env(name) for name in DEFAULT_PROFILES}
+        self.fake_catalog = catalog or FakeCatalog(size=int(os.getenv('BENCH_CATALOG_SIZE', '5000')))
+        super().__init__(config)
+
+    def _init_vertexai(self):
+        return True
+
+    def embedding_model(self):
+        return self.get('embedding_model', lambda: FakeMultiModalEmbeddingModel(
+            self.profiles['embedding'], dimensions=self.fake_catalog.dimensions
+        ))
+
+    def bigquery_client(self):
+        return self.get('bigquery_client', lambda: FakeBigQueryClient(self.profiles['bigquery'], self.fake_catalog))
+
+    def storage_client(self):
+        return self.get('storage_client', lambda: FakeStorageClient(self.profiles['storage']))
+
+    def signed_url_provider(self):
+        from app.services.signed_urls import SignedUrlProvider
+        return self.get('signed_url_provider', lambda: SignedUrlProvider(
+            self.storage_client(),
+            credentials=FakeCredentials(),
+            expiration=int(self.config.get('SIGNED_URL_EXPIRATION', 3600)),
+            refresh_margin=int(self.config.get('SIGNED_URL_REFRESH_MARGIN', 300))
+        ))
+
+    def admin_client(self):
+        return self.get('admin_client', FakeFeatureOnlineStoreAdminServiceClient)
+
+    def _build_data_client(self, endpoint):
+        return FakeFeatureOnlineStoreServiceClient(self.profiles['feature_store'], self.fake_catalog)
+
+    def gemini_service(self):
+        from app.services.gemini_service import GeminiService
+
+        def factory():
+            service = GeminiService(api_key=self.config.get('GEMINI_API_KEY') or 'bench',
+                                    upstream=self.upstream('gemini'),
+                                    cache=self.gemini_cache(),
+                                    batch_size=int(self.config.get('GEMINI_BATCH_SIZE', 8)))
+            service.model = FakeGenerativeModel(self.profiles['gemini'])
+            return service
+        return self.get('gemini_service', factory)
+
+    def vertex_service(self):
+        from app.services.vertex_ai_service import VertexAIService
+        return self.get('vertex_service', lambda: VertexAIService(
+            self.project_id, self.location,
+            model=self.embedding_model(),
+            cache=self.embedding_cache(),
+            index=self.vector_index(),
+            text_model=FakeTextEmbeddingModel(self.profiles['embedding']),
+            upstream=self.upstream('embedding')
+        ))
+
+
+def write_bench_snapshot(catalog, backend, snapshot_uris=True):
+    """Write the fake catalog's embeddings where a local backend expects them; returns the path"""
+    from app.services.vector_index import save_snapshot
+
+    directory = tempfile.mkdtemp(prefix='bench-index-')
+    index = catalog.index
+    gcs_uris = index.gcs_uris if snapshot_uris else None
+    if backend == 'mmap':
+        from app.services.embedding_store import write_embedding_store
+        path = os.path.join(directory, 'products.emb')
+        write_embedding_store(path, index.ids, index.embeddings, gcs_uris)
+    else:
+        path = os.path.join(directory, 'products.npz')
+        save_snapshot(path, index.ids, index.embeddings, gcs_uris)
+    return path
+
+
+def create_bench_app(profiles=None, catalog=None, index_backend='feature_store', snapshot_uris=True):
+    """The real Flask app with its registry swapped for FakeServiceRegistry.
+
+    A local index_backend searches a snapshot of the fake catalog, optionally
+    without image URIs, instead of the fake feature store.
+    """
+    os.environ.setdefault('GEMINI_API_KEY', 'bench')
+    os.environ['WARMUP_ON_START'] = 'false'
+    from app import create_app
+
+    app = create_app()
+    registry = FakeServiceRegistry(app.config, profiles=profiles, catalog=catalog)
+    if index_backend != 'feature_store':
+        app.config.update(
+            VECTOR_INDEX_BACKEND=index_backend,
+            VECTOR_INDEX_PATH=write_bench_snapshot(registry.fake_catalog, index_backend, snapshot_uris)
+        )
+    app.extensions['service_registry'] = registry
+    return app
+
+
+# --- Request payloads -------------------------------------------------------
+
+def make_image(seed, size=(640, 480)):
+    """A random JPEG (as a data URL) of a few coloured shapes"""
+    rng = random.Random(seed)
+    image = Image.new('RGB', size, tuple(rng.randrange(256) for _ in range(3)))
+    draw = ImageDraw.Draw(image)
+    for _ in range(8):
+        x0, y0 = rng.randrange(size[0]), rng.randrange(size[1])
+        x1, y1 = x0 + rng.randrange(40, 300), y0 + rng.randrange(40, 300)
+        draw.rectangle((x0, y0, x1, y1), fill=tuple(rng.randrange(256) for _ in range(3)))
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=85)
+    return 'data:image/jpeg;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+class PayloadFactory:
+    """Request bodies drawn from a fixed pool, so cache hit rates stay realistic"""
+
+    def __init__(self, distinct_images=32, distinct_queries=200, image_search_ratio=0.2, seed=0):
+        rng = random.Random(seed)
+        self.images = [make_image(seed * 1000 + i) for i in range(max(1, distinct_images))]
+        self.queries = [
+            f"{rng.choice(COLORS)} {rng.choice(APPAREL_TYPES)} for {rng.choice(GENDERS)}"
+            for _ in range(max(1, distinct_queries))
+        ]
+        self.image_search_ratio = image_search_ratio
+        self._random = random.Random(seed + 1)
+        self._lock = threading.Lock()
+
+    def build(self, endpoint):
+        with self._lock:
+            image = self._random.choice(self.images)
+            query = self._random.choice(self.queries)
+            image_search = self._random.random() < self.image_search_ratio
+        if endpoint == 'search':
+            return {'image_data': image} if image_search else {'query': query}
+        return {'image_data': image}
+
+
+# --- Clients ----------------------------------------------------------------
+
+class InProcessClient:
+    """Calls the app through Flask's test client, one client per thread"""
+
+    def __init__(self, app):
+        self.app = app
+        self._local = threading.local()
+
+    def post(self, path, payload):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.post(path, json=payload)
+        return response.status_code, response.headers.get('Server-Timing', '')
+
+
+class HttpClient:
+    """Calls a running server over HTTP, one keep-alive session per thread"""
+
+    def __init__(self, base_url, timeout=60):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def post(self, path, payload):
+        import requests
+
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        response = session.post(self.base_url + path, json=payload, timeout=self.timeout)
+        return response.status_code, response.headers.get('Server-Timing', '')
+
+
+# --- Load generation and reporting ------------------------------------------
+
+def parse_server_timing(header):
+    """{stage: seconds} from a Server-Timing header"""
+    stages = {}
+    for entry in header.split(','):
+        name, _, params = entry.strip().partition(';')
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if name and key == 'dur':
+                stages[name] = stages.get(name, 0.0) + float(value) / 1000
+    return stages
+
+
+def parse_mix(value):
+    """'search=6,analyze-webcam=1' -> [(endpoint, weight)]"""
+    mix = []
+    for item in value.split(','):
+        endpoint, _, weight = item.partition('=')
+        endpoint = endpoint.strip()
+        if endpoint not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(f"Unknown endpoint: {endpoint}")
+        mix.append((endpoint, float(weight or 1)))
+    return mix
+
+
+def run_load(client, payloads, mix, requests, concurrency, seed=0):
+    """Send requests spread over the endpoint mix from concurrency threads.
+
+    Returns (records, wall_seconds); each record is
+    (endpoint, status, latency_seconds, {stage: seconds}).
+    """
+    rng = random.Random(seed)
+    endpoints, weights = zip(*mix)
+    schedule = rng.choices(endpoints, weights=weights, k=requests)
+    counter = itertools.count()
+    records = []
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            i = next(counter)
+            if i >= len(schedule):
+                return
+            endpoint = schedule[i]
+            payload = payloads.build(endpoint)
+            start = time.perf_counter()
+            try:
+                status, timing = client.post(ENDPOINTS[endpoint], payload)
+            except Exception:
+                status, timing = 0, ''
+            latency = time.perf_counter() - start
+            with lock:
+                records.append((endpoint, status, latency, parse_server_timing(timing)))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for _ in range(concurrency):
+            executor.submit(worker)
+    return records, time.perf_counter() - start
+
+
+def percentiles(values):
+    if not values:
+        return {f'p{p}': None for p in PERCENTILES}
+    points = np.percentile(np.asarray(values), PERCENTILES)
+    return {f'p{p}': float(point) for p, point in zip(PERCENTILES, points)}
+
+
+def summarize(records, wall, concurrency):
+    """Throughput and latency percentiles per endpoint and per endpoint stage"""
+    report = {
+        'concurrency': concurrency,
+        'requests': len(records),
+        'wall_seconds': wall,
+        'throughput': len(records) / wall if wall else 0.0,
+        'endpoints': {}
+    }
+    for endpoint in sorted({record[0] for record in records}):
+        rows = [record for record in records if record[0] == endpoint]
+        stage_names = sorted({name for row in rows for name in row[3] if name != 'total'})
+        report['endpoints'][endpoint] = {
+            'requests': len(rows),
+            'errors': sum(1 for row in rows if not 200 <= row[1] < 300),
+            'throughput': len(rows) / wall if wall else 0.0,
+            'latency': percentiles([row[2] for row in rows]),
+            'stages': {
+                name: percentiles([row[3][name] for row in rows if name in row[3]])
+                for name in stage_names
+            }
+        }
+    return report
+
+
+def format_report(report):
+    def ms(value):
+        return '-' if value is None else f"{value * 1000:.1f}"
+
+    lines = [
+        f"concurrency={report['concurrency']} requests={report['requests']} "
+        f"wall={report['wall_seconds']:.2f}s throughput={report['throughput']:.1f} req/s",
+        f"  {'endpoint / stage':<30}{'count':>7}{'errors':>8}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+    ]
+    for endpoint, stats in report['endpoints'].items():
+        latency = stats['latency']
+        lines.append(
+            f"  {endpoint:<30}{stats['requests']:>7}{stats['errors']:>8}{stats['throughput']:>9.1f}"
+            f"{ms(latency['p50']):>10}{ms(latency['p95']):>10}{ms(latency['p99']):>10}"
+        )
+        for stage, stage_latency in stats['stages'].items():
+            lines.append(
+                f"    {stage:<28}{'':>7}{'':>8}{'':>9}"
+                f"{ms(stage_latency['p50']):>10}{ms(stage_latency['p95']):>10}{ms(stage_latency['p99']):>10}"
+            )
+    return '\n'.join(lines)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='Drive a running server instead of an in-process fake-backed app')
+    parser.add_argument('--requests', type=int, default=200, help='Requests per concurrency level')
+    parser.add_argument('--concurrency', default='8', help='Comma-separated concurrency levels to sweep')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('search=6,analyze-image=2,analyze-webcam=2'),
+                        help='Endpoint weights, e.g. search=6,analyze-image=2,analyze-webcam=2')
+    parser.add_argument('--warmup', type=int, default=20, help='Unrecorded requests sent before each run')
+    parser.add_argument('--catalog-size', type=int, default=5000, help='Products in the fake catalog')
+    parser.add_argument('--distinct-images', type=int, default=32)
+    parser.add_argument('--distinct-queries', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', metavar='PATH', help='Also write the reports as JSON')
+    parser.add_argument('--index-backend', choices=('feature_store', 'bruteforce', 'ivf', 'mmap'),
+                        default='feature_store', help='Vector index searched by the in-process app')
+    parser.add_argument('--no-snapshot-uris', dest='snapshot_uris', action='store_false',
+                        help='Leave image URIs out of the local backend snapshot')
+    parser.add_argument('--strict', action='store_true', help='Exit non-zero if any request failed')
+    for name, (latency, jitter) in DEFAULT_PROFILES.items():
+        flag = name.replace('_', '-')
+        parser.add_argument(f'--{flag}-latency', type=float, default=latency, help=f'Mean {name} latency (s)')
+        parser.add_argument(f'--{flag}-jitter', type=float, default=jitter, help=f'{name} latency std dev (s)')
+        parser.add_argument(f'--{flag}-failure-rate', type=float, default=0.0, help=f'Fraction of {name} calls that fail')
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    if args.url:
+        client = HttpClient(args.url)
+    else:
+        profiles = {
+            name: ServiceProfile(
+                name,
+                latency=getattr(args, f'{name}_latency'),
+                jitter=getattr(args, f'{name}_jitter'),
+                failure_rate=getattr(args, f'{name}_failure_rate'),
+                seed=args.seed
+            )
+            for name in DEFAULT_PROFILES
+        }
+        client = InProcessClient(create_bench_app(
+            profiles=profiles, catalog=FakeCatalog(size=args.catalog_size, seed=args.seed),
+            index_backend=args.index_backend, snapshot_uris=args.snapshot_uris
+        ))
+
+    payloads = PayloadFactory(args.distinct_images, args.distinct_queries, seed=args.seed)
+    reports = []
+    for concurrency in (int(level) for level in args.concurrency.split(',')):
+        if args.warmup:
+            run_load(client, payloads, args.mix, args.warmup, concurrency, seed=args.seed)
+        records, wall = run_load(client, payloads, args.mix, args.requests, concurrency, seed=args.seed)
+        report = summarize(records, wall, concurrency)
+        reports.append(report)
+        print(format_report(report))
+        print()
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(reports, f, indent=2)
+    if args.strict:
+        failed = sum(stats['errors'] for report in reports for stats in report['endpoints'].values())
+        if failed:
+            raise SystemExit(f"{failed} requests failed")
+    return reports
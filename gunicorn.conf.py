@@ -0,0 +1,24 @@
+"""gunicorn settings: gunicorn -c gunicorn.conf.py run:app
+
+SERVING_MODE=gevent runs each request as a greenlet, so a worker keeps up
+to WORKER_CONNECTIONS searches in flight instead of one per thread.
+"""
+import multiprocessing
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+bind = os.getenv('BIND', '127.0.0.1:8000')
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+timeout = int(os.getenv('WORKER_TIMEOUT', '60'))
+
+if os.getenv('SERVING_MODE', 'sync').lower() == 'gevent':
+    worker_class = 'gevent'
+    worker_connections = int(os.getenv('WORKER_CONNECTIONS', '500'))
+    # The app must be created after the worker has patched sockets and threads
+    preload_app = False
+else:
+    worker_class = 'gthread'
+    threads = int(os.getenv('WORKER_THREADS', '4'))